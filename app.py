@@ -1,19 +1,84 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, send_file, abort, session, make_response
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from database.db import db, User, Novel, Scene
+from database.db import (db, User, Novel, Scene, Asset, ReadingProgress, ensure_schema, delete_scene_rows,
+                         novels_using_asset, bump_render_version)
+from database.engine import configure_sqlite, install_pragmas, use_read_only
+from database.search import search_novels
+from database.slow_queries import install_slow_query_log
 from config import Config
+from assets import (AssetError, get_asset_store, store_asset, register_asset, externalize_scene_media,
+                    is_asset_id, asset_id_from_ref, asset_srcset, asset_variant_url)
+from image_pipeline import get_image_pipeline
+from static_assets import init_static_assets
+from jobs import JobQueue
+from metrics import init_metrics
+from progress import get_progress_buffer, delete_progress
+from reader_bundle import (reader_scene_payload, current_bundle, build_novel_bundle, get_bundle_store,
+                           build_novel_pack, ready_pack_path, novel_version)
 import json
 from datetime import datetime
 import os
+import sys
 from werkzeug.utils import secure_filename
 import uuid
 import traceback
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import load_only, joinedload
+import base64
+import hashlib
+from werkzeug.http import is_resource_modified, parse_content_range_header
+from render_cache import RenderCache
 
 app = Flask(__name__)
 app.config.from_object(Config)
 app.secret_key = Config.SECRET_KEY
 
+configure_sqlite(app)
 db.init_app(app)
+install_pragmas(app, db)
+# Задержка, SQL и объем по каждому endpoint: /metrics и журнал доступа
+init_metrics(app, db)
+install_slow_query_log(app, db)
+
+# Готовые страницы читалки, ключ включает версию новеллы (reader_bundle.novel_version)
+viewer_cache = RenderCache(app.config['VIEWER_CACHE_MAX_ENTRIES'], app.config['VIEWER_CACHE_MAX_BYTES'])
+# Фоновые задачи: сборка бандлов читалки
+jobs = JobQueue(app)
+
+def novel_content_changed(novel, was_published=True):
+    """После commit: сбросить кеш читалки и пересобрать бандл опубликованной новеллы.
+    Только что опубликованной - собрать и офлайн-пакет, не дожидаясь первого запроса"""
+    viewer_cache.invalidate(novel.id)
+    if novel.is_published:
+        jobs.enqueue(('bundle', novel.id), build_novel_bundle, novel.id)
+        if not was_published:
+            jobs.enqueue(('pack', novel.id), build_novel_pack, novel.id)
+
+# url_for('static', ...) ведет на файлы с хешами, если статика собрана
+init_static_assets(app)
+
+# Картинки из хранилища в шаблонах: src нужного размера и srcset
+app.jinja_env.globals.update(asset_srcset=asset_srcset, asset_variant_url=asset_variant_url)
+
+def refresh_asset_novels(asset_id):
+    """Фоновая задача: новеллы с изображением получают новый render_version -
+    ключ кеша читалки, ETag и версия бандла меняются, updated_at остается"""
+    novels = db.session.execute(
+        select(Novel.id, Novel.is_published).where(Novel.id.in_(novels_using_asset(asset_id)))
+    ).all()
+    if not novels:
+        return
+    bump_render_version(Novel.id.in_([novel.id for novel in novels]))
+    db.session.commit()
+    for novel in novels:
+        novel_content_changed(novel)
+
+def image_variants_ready(asset_id):
+    """Варианты изображения готовы - страницы с ним должны получить srcset"""
+    jobs.enqueue(('variants', asset_id), refresh_asset_novels, asset_id)
+
+with app.app_context():
+    get_image_pipeline().on_ready = image_variants_ready
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -24,14 +89,116 @@ def load_user(user_id):
     return User.query.get(int(user_id))
 
 # ========== ГЛАВНАЯ СТРАНИЦА ==========
+def encode_catalog_cursor(novel):
+    """Курсор на позицию после новеллы: дата создания и id"""
+    raw = f'{novel.created_at.isoformat()}|{novel.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_catalog_cursor(cursor):
+    """Разбирает курсор, для некорректного возвращает None (первая страница)"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, novel_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(novel_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+def card_options():
+    """Колонки для карточек новелл и автор тем же запросом: без граф сюжета и
+    прочих тяжелых полей, которые спискам не нужны"""
+    return (
+        load_only(Novel.id, Novel.title, Novel.description, Novel.cover_image,
+                  Novel.author_id, Novel.created_at),
+        joinedload(Novel.author).load_only(User.id, User.nickname)
+    )
+
+def catalog_page(cursor=None):
+    """Страница опубликованных новелл по курсору (keyset), без OFFSET.
+    
+    Стоимость запроса не зависит от номера страницы, а авторы
+    подгружаются тем же запросом, без отдельного SELECT на карточку.
+    """
+    page_size = app.config['CATALOG_PAGE_SIZE']
+    query = Novel.query.options(*card_options()).filter(Novel.is_published == True)
+    
+    position = decode_catalog_cursor(cursor)
+    if position:
+        query = query.filter(tuple_(Novel.created_at, Novel.id) < position)
+    
+    novels = query.order_by(Novel.created_at.desc(), Novel.id.desc()).limit(page_size + 1).all()
+    next_cursor = encode_catalog_cursor(novels[page_size - 1]) if len(novels) > page_size else None
+    return novels[:page_size], next_cursor
+
 @app.route('/')
 def index():
+    use_read_only(db.session)
     try:
-        novels = Novel.query.filter_by(is_published=True).order_by(Novel.created_at.desc()).all()
+        novels, next_cursor = catalog_page(request.args.get('cursor'))
     except:
-        novels = []
+        novels, next_cursor = [], None
+    
+    return render_template('index.html', novels=novels, next_cursor=next_cursor)
+
+# ========== API: КАТАЛОГ ДЛЯ БЕСКОНЕЧНОЙ ПРОКРУТКИ ==========
+@app.route('/api/catalog')
+def catalog():
+    use_read_only(db.session)
+    try:
+        novels, next_cursor = catalog_page(request.args.get('cursor'))
+    except Exception as e:
+        print(f"❌ Ошибка загрузки каталога: {e}")
+        return jsonify({'error': str(e)}), 500
     
-    return render_template('index.html', novels=novels)
+    return jsonify({
+        'novels': [{
+            'id': novel.id,
+            'title': novel.title,
+            'description': novel.description or '',
+            'cover_image': novel.cover_image or '',
+            'author': novel.author.nickname,
+            'created_at': novel.created_at.isoformat()
+        } for novel in novels],
+        'html': render_template('novel_cards.html', novels=novels),
+        'next_cursor': next_cursor
+    })
+
+# ========== ПОИСК ==========
+def search_page():
+    """Страница результатов поиска: (запрос, номер страницы, [(новелла, фрагмент)], есть_еще)"""
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    hits, has_more = search_novels(db.session, query, page, app.config['SEARCH_PAGE_SIZE'])
+    
+    novels = {}
+    if hits:
+        novels = {novel.id: novel for novel in Novel.query.options(*card_options())
+                  .filter(Novel.id.in_([novel_id for novel_id, _ in hits]))}
+    results = [(novels[novel_id], snippet) for novel_id, snippet in hits if novel_id in novels]
+    return query, page, results, has_more
+
+@app.route('/search')
+def search():
+    use_read_only(db.session)
+    query, page, results, has_more = search_page()
+    return render_template('search.html', query=query, page=page, results=results, has_more=has_more)
+
+@app.route('/api/search')
+def api_search():
+    use_read_only(db.session)
+    query, page, results, has_more = search_page()
+    return jsonify({
+        'query': query,
+        'page': page,
+        'results': [{
+            'id': novel.id,
+            'title': novel.title,
+            'author': novel.author.nickname,
+            'snippet': str(snippet)
+        } for novel, snippet in results],
+        'next_page': page + 1 if has_more else None
+    })
 
 # ========== РЕГИСТРАЦИЯ ==========
 @app.route('/register', methods=['GET', 'POST'])
@@ -196,14 +363,19 @@ def change_phone():
 @login_required
 def my_novels():
     try:
-        novels = Novel.query.filter_by(author_id=current_user.id).order_by(Novel.created_at.desc()).all()
-        novels_with_counts = []
-        for novel in novels:
-            scene_count = Scene.query.filter_by(novel_id=novel.id).count()
-            novels_with_counts.append({
-                'novel': novel,
-                'scene_count': scene_count
-            })
+        # Только колонки для списка: число сцен хранится в новелле,
+        # а от описания берем начало для превью
+        excerpt = func.substr(Novel.description, 1, 200).label('excerpt')
+        rows = db.session.query(Novel, excerpt).options(
+            load_only(Novel.id, Novel.title, Novel.is_published,
+                      Novel.created_at, Novel.updated_at, Novel.scene_count)
+        ).filter(Novel.author_id == current_user.id).order_by(Novel.created_at.desc()).all()
+        
+        novels_with_counts = [{
+            'novel': novel,
+            'scene_count': novel.scene_count,
+            'excerpt': excerpt or ''
+        } for novel, excerpt in rows]
         return render_template('my_novels.html', novels_with_counts=novels_with_counts)
     except Exception as e:
         print(f"Ошибка в my_novels: {e}")
@@ -257,7 +429,7 @@ def get_novel_data(novel_id):
             return jsonify({'error': 'Нет доступа'}), 403
         
         scenes_data = []
-        for i, scene in enumerate(novel.scenes):
+        for i, scene in enumerate(Scene.decode_all(novel.scenes)):
             scenes_data.append({
                 'id': scene.id,
                 'name': scene.name or f'Сцена {i + 1}',
@@ -274,7 +446,8 @@ def get_novel_data(novel_id):
             'description': novel.description or '',
             'cover_image': novel.cover_image or '',
             'is_published': novel.is_published or False,
-            'scenes': scenes_data
+            'scenes': scenes_data,
+            'graph': graph_summary(novel)
         }
         
         return jsonify(response_data)
@@ -283,6 +456,14 @@ def get_novel_data(novel_id):
         print(f"❌ Ошибка в get_novel_data: {e}")
         return jsonify({'error': str(e)}), 500
 
+def parse_scene_id(value):
+    """id сцены из базы (число) или None для новых сцен вида 'scene_<timestamp>'"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.isdigit():
+        return int(value)
+    return None
+
 # ========== API: СОХРАНЕНИЕ НОВЕЛЛЫ ==========
 @app.route('/api/save_novel/<int:novel_id>', methods=['POST'])
 @login_required
@@ -291,6 +472,7 @@ def save_novel(novel_id):
         novel = Novel.query.get_or_404(novel_id)
         if novel.author_id != current_user.id:
             return jsonify({'success': False, 'error': 'Нет доступа к этой новелле'})
+        was_published = novel.is_published
         
         data = request.get_json()
         if not data:
@@ -300,38 +482,56 @@ def save_novel(novel_id):
         novel.title = data.get('title', novel.title)
         novel.description = data.get('description', novel.description)
         novel.is_published = bool(data.get('is_published', novel.is_published))
-        novel.updated_at = datetime.utcnow()
         
         # Получаем сцены
         scenes_data = data.get('scenes', [])
         
-        # Удаляем старые сцены
-        Scene.query.filter_by(novel_id=novel.id).delete()
+        # Встроенные base64 картинки переносим в хранилище
+        for scene_data in scenes_data:
+            externalize_scene_media(scene_data, current_user.id)
+        
+        # Сравниваем присланные сцены с сохраненными по id и пишем только разницу
+        existing = {scene.id: scene for scene in novel.scenes}
+        kept_ids = set()
+        results = []
         
-        # Добавляем новые сцены
         for i, scene_data in enumerate(scenes_data):
-            scene = Scene(
-                novel_id=novel.id,
-                name=scene_data.get('name', f'Сцена {i+1}'),
-                background=scene_data.get('background', ''),
-                text=scene_data.get('text', ''),
-                order=scene_data.get('order', i)
-            )
-            
-            # Устанавливаем choices и sprites через свойства
-            scene.choices_list = scene_data.get('choices', [])
-            scene.sprites_list = scene_data.get('sprites', [])
-            
-            db.session.add(scene)
+            scene = existing.get(parse_scene_id(scene_data.get('id')))
+            if scene is None or scene.id in kept_ids:
+                scene = Scene(novel_id=novel.id)
+                scene.apply_data(scene_data, i)
+                db.session.add(scene)
+                status = 'created'
+            else:
+                kept_ids.add(scene.id)
+                status = 'updated' if scene.apply_data(scene_data, i) else 'unchanged'
+            results.append((scene_data.get('id'), scene, status))
+        
+        deleted_ids = [scene_id for scene_id in existing if scene_id not in kept_ids]
+        for scene_id in deleted_ids:
+            db.session.delete(existing[scene_id])
+        
+        scenes_changed = deleted_ids or any(status != 'unchanged' for _, _, status in results)
+        if scenes_changed or db.session.is_modified(novel):
+            novel.updated_at = datetime.utcnow()
         
+        db.session.flush()
+        scene_statuses = [
+            {'client_id': client_id, 'id': scene.id, 'status': status}
+            for client_id, scene, status in results
+        ]
         db.session.commit()
+        novel_content_changed(novel, was_published)
         
         return jsonify({
             'success': True,
             'message': 'Новелла сохранена успешно',
             'novel_id': novel.id,
             'is_published': novel.is_published,
-            'scenes_count': len(scenes_data)
+            'scenes_count': len(scenes_data),
+            'scenes': scene_statuses,
+            'deleted': deleted_ids,
+            'graph': graph_summary(novel)
         })
         
     except Exception as e:
@@ -340,36 +540,561 @@ def save_novel(novel_id):
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)})
 
+# ========== API: ПОСЦЕННОЕ РЕДАКТИРОВАНИЕ ==========
+class SceneOperationError(Exception):
+    """Ошибка в операции над сценой (неизвестная сцена, неверные данные)"""
+    
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+def resolve_scene(novel, scene_ref, id_map):
+    """Находит сцену новеллы по id из базы или по client_id созданной в этом же пакете"""
+    if isinstance(scene_ref, str) and scene_ref in id_map:
+        return id_map[scene_ref]
+    scene_id = parse_scene_id(scene_ref)
+    scene = Scene.query.filter_by(id=scene_id, novel_id=novel.id).first() if scene_id else None
+    if scene is None:
+        raise SceneOperationError(f'Сцена {scene_ref} не найдена', 404)
+    return scene
+
+def apply_scene_operation(novel, operation, id_map):
+    """Выполняет одну операцию над сценами, возвращает результат для ответа"""
+    op = operation.get('op')
+    data = operation.get('data') or {}
+    if not isinstance(data, dict):
+        raise SceneOperationError('Поле data должно быть объектом')
+    
+    if op == 'create':
+        externalize_scene_media(data, current_user.id)
+        position = data['order'] if 'order' in data else Scene.query.filter_by(novel_id=novel.id).count()
+        scene = Scene(novel_id=novel.id)
+        scene.apply_data(data, position)
+        db.session.add(scene)
+        db.session.flush()
+        client_id = operation.get('client_id')
+        if client_id is not None:
+            id_map[client_id] = scene
+        return {'op': op, 'client_id': client_id, 'id': scene.id, 'status': 'created'}
+    
+    if op in ('update', 'choices', 'sprites'):
+        scene = resolve_scene(novel, operation.get('id'), id_map)
+        if op != 'update':
+            # Замена только вариантов выбора или только спрайтов
+            data = {op: operation.get(op, data.get(op, []))}
+        externalize_scene_media(data, current_user.id)
+        changed = scene.apply_data(data, partial=True)
+        return {'op': op, 'id': scene.id, 'status': 'updated' if changed else 'unchanged'}
+    
+    if op == 'delete':
+        scene = resolve_scene(novel, operation.get('id'), id_map)
+        scene_id = scene.id
+        db.session.delete(scene)
+        return {'op': op, 'id': scene_id, 'status': 'deleted'}
+    
+    if op == 'reorder':
+        order = operation.get('order')
+        if not isinstance(order, list):
+            raise SceneOperationError('Для reorder нужен список id сцен в поле order')
+        # Для перестановки нужны только id и порядок, тексты и JSON не загружаем
+        stored = {
+            scene.id: scene
+            for scene in Scene.query.options(load_only(Scene.id, Scene.order)).filter_by(novel_id=novel.id)
+        }
+        moved = 0
+        for position, scene_ref in enumerate(order):
+            scene = id_map.get(scene_ref) if isinstance(scene_ref, str) else None
+            scene = scene or stored.get(parse_scene_id(scene_ref))
+            if scene is None:
+                raise SceneOperationError(f'Сцена {scene_ref} не найдена', 404)
+            if scene.order != position:
+                scene.order = position
+                moved += 1
+        return {'op': op, 'status': 'updated' if moved else 'unchanged', 'moved': moved}
+    
+    if op == 'novel':
+        for field in ('title', 'description'):
+            if field in data:
+                setattr(novel, field, data[field])
+        if 'is_published' in data:
+            novel.is_published = bool(data['is_published'])
+        if 'cover_image' in data:
+            cover = data['cover_image'] or ''
+            if cover and not asset_id_from_ref(cover):
+                raise SceneOperationError('Обложка должна быть загружена через /api/assets')
+            novel.cover_image = cover
+        return {'op': op, 'id': novel.id, 'status': 'updated' if db.session.is_modified(novel) else 'unchanged'}
+    
+    raise SceneOperationError(f'Неизвестная операция: {op}')
+
+def run_scene_operations(novel_id, operations):
+    """Выполняет операции одной транзакцией и формирует JSON ответ"""
+    novel = Novel.query.get_or_404(novel_id)
+    if novel.author_id != current_user.id:
+        return jsonify({'success': False, 'error': 'Нет доступа к этой новелле'}), 403
+    was_published = novel.is_published
+    
+    id_map = {}
+    results = []
+    try:
+        for index, operation in enumerate(operations):
+            if not isinstance(operation, dict):
+                raise SceneOperationError(f'Операция {index} должна быть объектом')
+            try:
+                results.append(apply_scene_operation(novel, operation, id_map))
+            except SceneOperationError as e:
+                raise SceneOperationError(f'Операция {index}: {e}', e.status) from e
+        
+        if any(result['status'] != 'unchanged' for result in results):
+            novel.updated_at = datetime.utcnow()
+        db.session.commit()
+        novel_content_changed(novel, was_published)
+    except SceneOperationError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), e.status
+    except Exception as e:
+        print(f"❌ Ошибка редактирования сцен: {e}")
+        traceback.print_exc()
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    return jsonify({'success': True, 'novel_id': novel.id, 'results': results, 'graph': graph_summary(novel)})
+
+@app.route('/api/novel/<int:novel_id>/scenes', methods=['POST'])
+@login_required
+def create_scene(novel_id):
+    data = request.get_json(silent=True) or {}
+    return run_scene_operations(novel_id, [
+        {'op': 'create', 'client_id': data.pop('client_id', None), 'data': data}
+    ])
+
+@app.route('/api/novel/<int:novel_id>/scenes/<int:scene_id>', methods=['PATCH'])
+@login_required
+def update_scene(novel_id, scene_id):
+    data = request.get_json(silent=True) or {}
+    return run_scene_operations(novel_id, [{'op': 'update', 'id': scene_id, 'data': data}])
+
+@app.route('/api/novel/<int:novel_id>/scenes/<int:scene_id>', methods=['DELETE'])
+@login_required
+def delete_scene(novel_id, scene_id):
+    return run_scene_operations(novel_id, [{'op': 'delete', 'id': scene_id}])
+
+@app.route('/api/novel/<int:novel_id>/scenes/<int:scene_id>/<any(choices, sprites):field>', methods=['PUT'])
+@login_required
+def replace_scene_field(novel_id, scene_id, field):
+    data = request.get_json(silent=True) or {}
+    return run_scene_operations(novel_id, [{'op': field, 'id': scene_id, field: data.get(field, [])}])
+
+@app.route('/api/novel/<int:novel_id>/scenes/order', methods=['PUT'])
+@login_required
+def reorder_scenes(novel_id):
+    data = request.get_json(silent=True) or {}
+    return run_scene_operations(novel_id, [{'op': 'reorder', 'order': data.get('order')}])
+
+@app.route('/api/novel/<int:novel_id>/batch', methods=['POST'])
+@login_required
+def batch_scene_operations(novel_id):
+    """Пакет операций от автосохранения конструктора"""
+    data = request.get_json(silent=True) or {}
+    operations = data.get('operations')
+    if not isinstance(operations, list):
+        return jsonify({'success': False, 'error': 'Нет операций для выполнения'}), 400
+    return run_scene_operations(novel_id, operations)
+
+# ========== API: ЗАГРУЗКА ИЗОБРАЖЕНИЙ ==========
+def asset_json(asset, **extra):
+    return jsonify({
+        'success': True,
+        'asset_id': asset.id,
+        'url': asset.url,
+        'mime_type': asset.mime_type,
+        'size': asset.size,
+        **extra
+    })
+
+@app.route('/api/assets', methods=['POST', 'PUT'])
+@login_required
+def upload_asset():
+    """POST - multipart с полем file, PUT - сам файл в теле запроса.
+    
+    Тело читается потоком по 64KB прямо в файл хранилища.
+    """
+    if request.method == 'PUT':
+        stream = request.stream
+    else:
+        file = request.files.get('file')
+        if not file:
+            return jsonify({'success': False, 'error': 'Файл не передан'}), 400
+        stream = file.stream
+    
+    try:
+        asset = store_asset(stream, owner_id=current_user.id)
+        db.session.commit()
+    except AssetError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        print(f"❌ Ошибка загрузки изображения: {e}")
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+    
+    return asset_json(asset)
+
+# ========== API: ЗАГРУЗКА ПО ЧАСТЯМ С ДОКАЧКОЙ ==========
+def upload_for_current_user(upload_id):
+    """Описание загрузки текущего пользователя или ответ с ошибкой"""
+    try:
+        info = get_asset_store().upload_info(upload_id)
+    except AssetError:
+        info = None
+    if info is None or info['owner_id'] != current_user.id:
+        return None, (jsonify({'success': False, 'error': 'Загрузка не найдена'}), 404)
+    return info, None
+
+def upload_status(info, **extra):
+    return jsonify({
+        'success': True,
+        'upload_id': info['upload_id'],
+        'size': info['size'],
+        'offset': info['offset'],
+        'chunk_size': app.config['UPLOAD_CHUNK_SIZE'],
+        'complete': False,
+        **extra
+    })
+
+@app.route('/api/uploads', methods=['POST'])
+@login_required
+def start_upload():
+    data = request.get_json(silent=True) or {}
+    store = get_asset_store()
+    store.cleanup_uploads(app.config['UPLOAD_EXPIRY'])
+    try:
+        info = store.start_upload(data.get('size'), current_user.id)
+    except AssetError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return upload_status(info), 201
+
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+@login_required
+def get_upload(upload_id):
+    """Сколько байт уже принято - с этого места клиент продолжает загрузку"""
+    info, error = upload_for_current_user(upload_id)
+    return error or upload_status(info)
+
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    """Часть файла с заголовком Content-Range: bytes <start>-<end>/<size>"""
+    info, error = upload_for_current_user(upload_id)
+    if error:
+        return error
+    
+    content_range = parse_content_range_header(request.headers.get('Content-Range'))
+    if content_range is None or content_range.length != info['size']:
+        return jsonify({'success': False, 'error': 'Нужен заголовок Content-Range с полным размером файла'}), 400
+    if content_range.stop - content_range.start > app.config['UPLOAD_CHUNK_SIZE']:
+        return jsonify({'success': False, 'error': 'Слишком большая часть файла'}), 413
+    
+    store = get_asset_store()
+    try:
+        offset = store.append_chunk(upload_id, content_range.start, content_range.stop, request.stream)
+    except AssetError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    if offset != content_range.stop:
+        # Часть не с текущей позиции - сообщаем, откуда продолжать
+        return upload_status(dict(info, offset=offset)), 409
+    if offset < info['size']:
+        return upload_status(dict(info, offset=offset))
+    
+    try:
+        asset = register_asset(*store.finish_upload(upload_id), owner_id=current_user.id)
+        db.session.commit()
+    except AssetError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return asset_json(asset, complete=True)
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_upload(upload_id):
+    info, error = upload_for_current_user(upload_id)
+    if error:
+        return error
+    get_asset_store().discard_upload(upload_id)
+    return jsonify({'success': True})
+
+@app.errorhandler(413)
+def request_too_large(e):
+    """Ответ на запрос больше MAX_CONTENT_LENGTH"""
+    limit = app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)
+    if request.path.startswith('/api/'):
+        return jsonify({'success': False, 'error': f'Слишком большой запрос (макс. {limit}MB)'}), 413
+    return f'Слишком большой запрос (макс. {limit}MB)', 413
+
+# ========== PWA ==========
+@app.route('/sw.js')
+def service_worker():
+    """Service worker из корня сайта - иначе он не видит /view/ и /assets/.
+    В начало подставлен список статики с хешами для предзагрузки"""
+    source = app.extensions['static_manifest'].service_worker_source()
+    response = make_response(source)
+    response.mimetype = 'application/javascript'
+    response.set_etag(hashlib.sha1(source).hexdigest())
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+# ========== РАЗДАЧА ИЗОБРАЖЕНИЙ ==========
+@app.route('/assets/<asset_id>')
+def serve_asset(asset_id):
+    if not is_asset_id(asset_id):
+        abort(404)
+    
+    asset = db.session.get(Asset, asset_id)
+    store = get_asset_store()
+    if not asset or not store.exists(asset_id):
+        abort(404)
+    
+    # Содержимое по этому адресу никогда не меняется
+    response = send_file(store.path_for(asset_id), mimetype=asset.mime_type,
+                         etag=asset_id, conditional=True, max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@app.route('/assets/<asset_id>/<variant>')
+def serve_asset_variant(asset_id, variant):
+    """Уменьшенная копия в лучшем формате из тех, что принимает браузер"""
+    if not is_asset_id(asset_id) or variant not in app.config['IMAGE_VARIANTS']:
+        abort(404)
+    
+    found = get_image_pipeline().variant_file(asset_id, variant, request.accept_mimetypes)
+    if found is None:
+        # Вариант еще не построен или оригинал меньше - отдаем оригинал
+        return serve_asset(asset_id)
+    
+    path, mime_type = found
+    response = send_file(path, mimetype=mime_type, etag=f'{asset_id}-{variant}-{mime_type}',
+                         conditional=True, max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.vary.add('Accept')
+    return response
+
 # ========== ПРОСМОТР НОВЕЛЛЫ ==========
+def can_read(novel):
+    """Опубликованную новеллу читают все, черновик - только автор"""
+    return novel.is_published or (current_user.is_authenticated and novel.author_id == current_user.id)
+
+def scene_ids_in_order(novel):
+    """id сцен новеллы в порядке показа - позиция в списке это номер сцены"""
+    graph = novel.story_graph_data
+    if graph and graph.get('total') == novel.scene_count:
+        return graph['scene_ids']
+    rows = db.session.query(Scene.id).filter_by(novel_id=novel.id).order_by(Scene.order, Scene.id)
+    return [row.id for row in rows]
+
+def graph_summary(novel):
+    """Проблемы сюжета для конструктора: недостижимые сцены, тупики, битые ссылки"""
+    graph = novel.story_graph_data or {}
+    return {
+        'orphans': graph.get('orphans', []),
+        'dead_ends': graph.get('dead_ends', []),
+        'dangling': graph.get('dangling', [])
+    }
+
+def reader_bundle_for(novel):
+    """Актуальный бандл новеллы; если его нет, ставит сборку в очередь"""
+    bundle = current_bundle(novel)
+    if bundle is None and novel.is_published:
+        jobs.enqueue(('bundle', novel.id), build_novel_bundle, novel.id)
+    return bundle
+
+def render_viewer(novel):
+    """Рендерит страницу читалки: в страницу попадает только первая сцена,
+    остальные viewer.js догружает через /api/read по мере чтения"""
+    bundle = reader_bundle_for(novel)
+    if bundle is not None:
+        # Опубликованная новелла: все уже собрано в бандле, запросов к сценам нет
+        first_scene = bundle.scene(0)
+        novel_data = {
+            'id': novel.id,
+            'title': novel.title,
+            'total': bundle.total,
+            'edges': bundle.data['edges'],
+            'scenes': {0: first_scene} if first_scene else {},
+            'saveProgress': current_user.is_authenticated
+        }
+        return render_template('viewer.html', novel=novel, novel_data=novel_data)
+    
+    ordered_ids = scene_ids_in_order(novel)
+    first_scene = db.session.get(Scene, ordered_ids[0]) if ordered_ids else None
+    graph = novel.story_graph_data
+    novel_data = {
+        'id': novel.id,
+        'title': novel.title,
+        'total': len(ordered_ids),
+        'edges': graph['edges'] if graph and graph.get('total') == len(ordered_ids) else None,
+        'scenes': {0: reader_scene_payload(first_scene, 0)} if first_scene else {},
+        'saveProgress': current_user.is_authenticated
+    }
+    
+    print(f"📖 Загружена новелла '{novel.title}' ({novel.scene_count} сцен)")
+    
+    return render_template('viewer.html', novel=novel, novel_data=novel_data)
+
+# ========== API: СЦЕНЫ ДЛЯ ЧИТАЛКИ ==========
+@app.route('/api/read/<int:novel_id>/scenes')
+def read_scenes(novel_id):
+    """Сцены по позициям (?positions=1,4,5) для постепенной загрузки в читалке"""
+    use_read_only(db.session)
+    novel = Novel.query.get_or_404(novel_id)
+    if not can_read(novel):
+        return jsonify({'error': 'Нет доступа'}), 403
+    
+    try:
+        positions = sorted({int(p) for p in request.args.get('positions', '').split(',') if p.strip()})
+    except ValueError:
+        return jsonify({'error': 'Некорректный список позиций'}), 400
+    positions = positions[:app.config['READER_MAX_SCENES_PER_REQUEST']]
+    
+    bundle = reader_bundle_for(novel)
+    version = bundle.version if bundle else novel_version(novel)
+    etag = hashlib.sha1(f'{novel.id}:{version}:{positions}'.encode()).hexdigest()
+    if not is_resource_modified(request.environ, etag=etag):
+        response = make_response('', 304)
+    elif bundle is not None:
+        scenes = {p: bundle.scene(p) for p in positions}
+        response = jsonify({
+            'total': bundle.total,
+            'scenes': {p: scene for p, scene in scenes.items() if scene is not None}
+        })
+    else:
+        ordered_ids = scene_ids_in_order(novel)
+        wanted = {ordered_ids[p]: p for p in positions if 0 <= p < len(ordered_ids)}
+        scenes = Scene.decode_all(Scene.query.filter(Scene.id.in_(wanted)).all()) if wanted else []
+        response = jsonify({
+            'total': len(ordered_ids),
+            'scenes': {wanted[scene.id]: reader_scene_payload(scene, wanted[scene.id]) for scene in scenes}
+        })
+    
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# ========== API: ПРОГРЕСС ЧТЕНИЯ ==========
+def progress_json(row, ordered_ids):
+    """Слот для читалки; позицию уточняем по id сцены, если сцены переставили"""
+    position = row['scene_position']
+    if row.get('scene_id') in ordered_ids:
+        position = ordered_ids.index(row['scene_id'])
+    history = row['history']
+    return {
+        'slot': row['slot'],
+        'name': row.get('name') or '',
+        'scene': position,
+        'sceneId': row.get('scene_id'),
+        'history': json.loads(history) if isinstance(history, str) else history,
+        'updatedAt': row['updated_at'].isoformat() + 'Z' if row.get('updated_at') else None
+    }
+
+@app.route('/api/progress/<int:novel_id>')
+@login_required
+def get_progress(novel_id):
+    """Все слоты читателя для новеллы, включая еще не записанные в базу"""
+    use_read_only(db.session)
+    novel = Novel.query.get_or_404(novel_id)
+    if not can_read(novel):
+        return jsonify({'error': 'Нет доступа'}), 403
+    
+    slots = {}
+    for progress in ReadingProgress.query.filter_by(user_id=current_user.id, novel_id=novel_id):
+        slots[progress.slot] = {
+            'slot': progress.slot,
+            'name': progress.name,
+            'scene_position': progress.scene_position,
+            'scene_id': progress.scene_id,
+            'history': progress.history_list,
+            'updated_at': progress.updated_at
+        }
+    slots.update(get_progress_buffer().pending_for(current_user.id, novel_id))
+    
+    ordered_ids = scene_ids_in_order(novel)
+    response = jsonify({'slots': [progress_json(slots[slot], ordered_ids) for slot in sorted(slots)]})
+    response.headers['Cache-Control'] = 'private, no-store'
+    return response
+
+# POST - для navigator.sendBeacon при закрытии страницы
+@app.route('/api/progress/<int:novel_id>/<int:slot>', methods=['PUT', 'POST'])
+@login_required
+def save_progress(novel_id, slot):
+    """Запоминает место чтения; в базу оно попадет со следующей пачкой"""
+    if not 0 <= slot <= app.config['PROGRESS_MAX_SLOTS']:
+        return jsonify({'success': False, 'error': 'Некорректный номер слота'}), 400
+    
+    data = request.get_json(force=True, silent=True) or {}
+    scene = data.get('scene')
+    history = data.get('history') or []
+    if not isinstance(scene, int) or scene < 0 or not isinstance(history, list) \
+            or not all(isinstance(p, int) for p in history):
+        return jsonify({'success': False, 'error': 'Некорректные данные прогресса'}), 400
+    scene_id = data.get('sceneId') if isinstance(data.get('sceneId'), int) else None
+    
+    use_read_only(db.session)
+    novel = Novel.query.get_or_404(novel_id)
+    if not can_read(novel):
+        return jsonify({'success': False, 'error': 'Нет доступа'}), 403
+    
+    get_progress_buffer().put(
+        current_user.id, novel_id, slot, scene,
+        scene_id=scene_id,
+        history=history[-app.config['PROGRESS_HISTORY_LIMIT']:],
+        name=str(data.get('name') or '')[:100]
+    )
+    return jsonify({'success': True}), 202
+
+@app.route('/api/progress/<int:novel_id>/<int:slot>', methods=['DELETE'])
+@login_required
+def delete_progress_slot(novel_id, slot):
+    delete_progress(current_user.id, novel_id, slot)
+    db.session.commit()
+    return jsonify({'success': True})
+
 @app.route('/view/<int:novel_id>')
 def view_novel(novel_id):
+    use_read_only(db.session)
     try:
-        novel = Novel.query.get_or_404(novel_id)
+        # Автор - тем же запросом: его никнейм в шапке и в ключе кеша
+        novel = Novel.query.options(joinedload(Novel.author)).get_or_404(novel_id)
         
         # Проверяем доступ
-        if not novel.is_published and (not current_user.is_authenticated or novel.author_id != current_user.id):
+        if not can_read(novel):
             flash('Эта новелла не опубликована', 'error')
             return redirect(url_for('index'))
         
-        # Подготавливаем сцены для шаблона
-        scenes_for_template = []
-        for scene in novel.scenes:
-            scene_data = {
-                'id': scene.id,
-                'name': scene.name or f'Сцена {len(scenes_for_template) + 1}',
-                'text': scene.text or '',
-                'background': scene.background or '',
-                'order': scene.order,
-                'choices': scene.choices_list,
-                'sprites': scene.sprites_list
-            }
-            scenes_for_template.append(scene_data)
+        # Страница зависит от новеллы (с render_version), никнейма автора
+        # и от того, кто смотрит (меню в шапке)
+        viewer_id = current_user.id if current_user.is_authenticated else 0
+        version = novel.updated_at or novel.created_at
+        cache_key = (novel.id, novel_version(novel), novel.author.nickname, viewer_id)
+        etag = hashlib.sha1(repr(cache_key).encode()).hexdigest()
         
-        print(f"📖 Загружена новелла '{novel.title}' с {len(scenes_for_template)} сценами")
+        # Страницы с flash-сообщениями уникальны - их не кешируем
+        if session.get('_flashes'):
+            return render_viewer(novel)
         
-        return render_template('viewer.html', 
-                             novel=novel, 
-                             scenes=scenes_for_template)
+        if not is_resource_modified(request.environ, etag=etag, last_modified=version):
+            response = make_response('', 304)
+        else:
+            html = viewer_cache.get(cache_key)
+            if html is None:
+                html = render_viewer(novel).encode('utf-8')
+                viewer_cache.set(cache_key, html)
+            response = make_response(html)
+        
+        response.set_etag(etag)
+        response.last_modified = version
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('Cookie')
+        return response
         
     except Exception as e:
         print(f"Ошибка загрузки новеллы: {e}")
@@ -377,6 +1102,62 @@ def view_novel(novel_id):
         flash('Ошибка загрузки новеллы', 'error')
         return redirect(url_for('index'))
 
+# ========== ОФЛАЙН-ПАКЕТЫ ==========
+def novel_pack_bundle(novel_id):
+    """Бандл и путь к готовому офлайн-пакету: (bundle, path, None) или (None, None, ответ)"""
+    use_read_only(db.session)
+    novel = Novel.query.get_or_404(novel_id)
+    if not novel.is_published:
+        return None, None, (jsonify({'error': 'Офлайн-пакеты доступны только для опубликованных новелл'}), 403)
+    bundle = reader_bundle_for(novel)
+    path = ready_pack_path(novel_id, bundle) if bundle is not None else None
+    if path is None:
+        # Бандл или пакет собирается в фоне - клиент повторит запрос позже
+        if bundle is not None:
+            jobs.enqueue(('pack', novel_id), build_novel_pack, novel_id)
+        response = jsonify({'pending': True})
+        response.headers['Retry-After'] = '5'
+        return None, None, (response, 202)
+    return bundle, path, None
+
+@app.route('/novel/<int:novel_id>/pack/info')
+def novel_pack_info(novel_id):
+    """Версия и размер пакета: по ним service worker решает, качать ли заново"""
+    bundle, path, error = novel_pack_bundle(novel_id)
+    if error:
+        return error
+    
+    response = jsonify({
+        'novel_id': novel_id,
+        'version': bundle.version,
+        'size': os.path.getsize(path),
+        'url': url_for('novel_pack', novel_id=novel_id, v=bundle.version)
+    })
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/novel/<int:novel_id>/pack')
+def novel_pack(novel_id):
+    """ZIP-архив со сценами и изображениями новеллы, поддерживает Range"""
+    bundle, path, error = novel_pack_bundle(novel_id)
+    if error:
+        return error
+    
+    # Докачка частями имеет смысл только внутри одной версии
+    requested = request.args.get('v')
+    if requested and requested != bundle.version:
+        return jsonify({'error': 'Версия пакета устарела', 'version': bundle.version}), 409
+    
+    response = send_file(path, mimetype='application/zip',
+                         etag=bundle.version, conditional=True,
+                         download_name=f'novel-{novel_id}-{bundle.version}.zip')
+    response.accept_ranges = 'bytes'
+    if requested:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 # ========== УДАЛЕНИЕ НОВЕЛЛЫ ==========
 @app.route('/delete_novel/<int:novel_id>', methods=['POST'])
 @login_required
@@ -384,9 +1165,13 @@ def delete_novel(novel_id):
     try:
         novel = Novel.query.get(novel_id)
         if novel and novel.author_id == current_user.id:
+            delete_scene_rows(novel.id)
+            delete_progress(novel_id=novel.id)
             Scene.query.filter_by(novel_id=novel.id).delete()
             db.session.delete(novel)
             db.session.commit()
+            viewer_cache.invalidate(novel_id)
+            get_bundle_store().remove(novel_id)
             flash('Новелла удалена', 'success')
         else:
             flash('Нет доступа к этой новелле', 'error')
@@ -404,9 +1189,11 @@ def publish_novel(novel_id):
         if novel.author_id != current_user.id:
             return jsonify({'success': False, 'error': 'Нет доступа'})
         
+        was_published = novel.is_published
         novel.is_published = True
         novel.updated_at = datetime.utcnow()
         db.session.commit()
+        novel_content_changed(novel, was_published)
         
         return jsonify({
             'success': True,
@@ -531,22 +1318,21 @@ def create_demo_novel():
         print(f"❌ Ошибка создания демо новеллы: {e}")
 
 # ========== ЗАПУСК СЕРВЕРА ==========
+def init_database():
+    """Разовая подготовка базы: новые таблицы и колонки, демо новелла"""
+    added = ensure_schema()
+    for name in added:
+        print(f"✅ Добавлено в схему: {name}")
+    create_demo_novel()
+
+@app.cli.command('init-db')
+def init_db_command():
+    """flask --app app init-db"""
+    init_database()
+
 if __name__ == '__main__':
-    with app.app_context():
-        db.create_all()
-        create_demo_novel()
-    
-    print("=" * 50)
-    print("🚀 Сервер визуальных новелл запускается...")
-    print("=" * 50)
-    print("🌐 Откройте в браузере:")
-    print("   1. http://localhost:5000 - Главная страница")
-    print("   2. http://localhost:5000/login - Вход")
-    print("   3. http://localhost:5000/register - Регистрация")
-    print("=" * 50)
-    print("🔑 Тестовый пользователь:")
-    print("   Email: test@example.com")
-    print("   Пароль: test123")
-    print("=" * 50)
-    
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    # Запуск через waitress (run.py); сервер разработки: flask --app app run --debug.
+    # Модуль уже загружен как __main__ - не даем run.py импортировать его второй раз
+    sys.modules.setdefault('app', sys.modules[__name__])
+    from run import main
+    main()
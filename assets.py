@@ -0,0 +1,379 @@
+# assets.py - хранилище изображений с адресацией по содержимому
+import base64
+import binascii
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+from flask import current_app
+
+from database.db import db, Asset
+from image_pipeline import RESIZABLE_MIME_TYPES, get_image_pipeline
+
+ASSET_URL_PREFIX = '/assets/'
+CHUNK_SIZE = 64 * 1024
+
+_ASSET_ID_RE = re.compile(r'^[0-9a-f]{64}$')
+_ASSET_REF_RE = re.compile(r'^/assets/([0-9a-f]{64})$')
+_UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+_DATA_URL_RE = re.compile(r'^data:([\w.+-]+/[\w.+-]+)?(;[\w=.+-]+)*;base64,', re.IGNORECASE)
+
+
+class AssetError(ValueError):
+    """Ошибка при сохранении изображения (неверный формат, размер и т.п.)"""
+
+
+def sniff_mime_type(head):
+    """Определяет тип изображения по первым байтам файла"""
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith((b'GIF87a', b'GIF89a')):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[4:12] in (b'ftypavif', b'ftypavis'):
+        return 'image/avif'
+    return None
+
+
+def is_asset_id(value):
+    return isinstance(value, str) and bool(_ASSET_ID_RE.match(value))
+
+
+def asset_ref(asset_id):
+    """Короткая ссылка на изображение, которая хранится в полях сцены"""
+    return f'{ASSET_URL_PREFIX}{asset_id}'
+
+
+def asset_id_from_ref(value):
+    """Возвращает id изображения из ссылки /assets/<sha256> или None"""
+    if not isinstance(value, str):
+        return None
+    match = _ASSET_REF_RE.match(value)
+    return match.group(1) if match else None
+
+
+def asset_srcset(url):
+    """srcset для ссылки на изображение из хранилища ('' если вариантов нет)"""
+    asset_id = asset_id_from_ref(url)
+    return get_image_pipeline().srcset(asset_id) if asset_id else ''
+
+
+def asset_variant_url(url, variant):
+    """Ссылка на вариант нужного размера, если он уже построен, иначе исходная"""
+    asset_id = asset_id_from_ref(url)
+    if asset_id:
+        manifest = get_image_pipeline().manifest(asset_id)
+        if manifest and variant in manifest['variants']:
+            return f'{url}/{variant}'
+    return url
+
+
+def is_data_url(value):
+    return isinstance(value, str) and bool(_DATA_URL_RE.match(value))
+
+
+class AssetStore:
+    """Файлы на диске, имя файла - sha256 от содержимого.
+
+    Одинаковые картинки хранятся один раз, а запись идет через временный
+    файл, поэтому читатели никогда не видят недописанный файл.
+    """
+
+    def __init__(self, root, max_size):
+        self.root = str(root)
+        self.max_size = max_size
+        self.tmp_dir = os.path.join(self.root, 'tmp')
+        self.uploads_dir = os.path.join(self.root, 'uploads')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        os.makedirs(self.uploads_dir, exist_ok=True)
+        self._upload_locks = {}
+        self._locks_guard = threading.Lock()
+
+    def path_for(self, asset_id):
+        return os.path.join(self.root, asset_id[:2], asset_id[2:4], asset_id)
+
+    def exists(self, asset_id):
+        return os.path.exists(self.path_for(asset_id))
+
+    def save_stream(self, stream):
+        """Сохраняет поток в хранилище, возвращает (asset_id, mime_type, size)"""
+        hasher = hashlib.sha256()
+        size = 0
+        head = b''
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_size:
+                        raise AssetError(f'Файл слишком большой (макс. {self.max_size // (1024 * 1024)}MB)')
+                    if len(head) < 16:
+                        head += chunk[:16 - len(head)]
+                    hasher.update(chunk)
+                    tmp.write(chunk)
+
+            if size == 0:
+                raise AssetError('Пустой файл')
+
+            mime_type = sniff_mime_type(head)
+            if not mime_type:
+                raise AssetError('Поддерживаются только изображения PNG, JPEG, GIF, WebP и AVIF')
+
+            asset_id = hasher.hexdigest()
+            target = self.path_for(asset_id)
+            if os.path.exists(target):
+                os.remove(tmp_path)
+                # Свежий mtime: sweep_unregistered_files не тронет файл, пока
+                # запись о нем еще не закоммичена
+                os.utime(target)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(tmp_path, target)
+            return asset_id, mime_type, size
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def stored_ids(self, older_than):
+        """id файлов хранилища (без уменьшенных копий), не менявшихся с older_than"""
+        for directory, subdirs, names in os.walk(self.root):
+            if directory == self.root:
+                subdirs[:] = [name for name in subdirs if len(name) == 2]
+            for name in names:
+                if _ASSET_ID_RE.match(name) and os.path.getmtime(os.path.join(directory, name)) < older_than:
+                    yield name
+    
+    def remove(self, asset_id):
+        """Удаляет файл вместе с уменьшенными копиями и манифестом"""
+        directory = os.path.dirname(self.path_for(asset_id))
+        for name in os.listdir(directory):
+            if name == asset_id or name.startswith(asset_id + '.'):
+                os.remove(os.path.join(directory, name))
+    
+    def remove_stale_tmp(self, older_than):
+        """Временные файлы прерванных записей"""
+        for name in os.listdir(self.tmp_dir):
+            path = os.path.join(self.tmp_dir, name)
+            if os.path.getmtime(path) < older_than:
+                os.remove(path)
+    
+    # ---- Загрузка по частям с докачкой ----
+    
+    def _upload_paths(self, upload_id):
+        if not isinstance(upload_id, str) or not _UPLOAD_ID_RE.match(upload_id):
+            raise AssetError('Некорректный id загрузки')
+        base = os.path.join(self.uploads_dir, upload_id)
+        return base + '.part', base + '.json'
+    
+    def start_upload(self, size, owner_id):
+        """Создает пустую загрузку, возвращает ее описание"""
+        if not isinstance(size, int) or size <= 0:
+            raise AssetError('Нужен размер файла в байтах')
+        if size > self.max_size:
+            raise AssetError(f'Файл слишком большой (макс. {self.max_size // (1024 * 1024)}MB)')
+        upload_id = uuid.uuid4().hex
+        part_path, meta_path = self._upload_paths(upload_id)
+        open(part_path, 'wb').close()
+        info = {'upload_id': upload_id, 'size': size, 'owner_id': owner_id, 'created': time.time()}
+        with open(meta_path, 'w') as f:
+            json.dump(info, f)
+        return dict(info, offset=0)
+    
+    def upload_info(self, upload_id):
+        """Описание загрузки с текущим смещением или None"""
+        part_path, meta_path = self._upload_paths(upload_id)
+        try:
+            with open(meta_path) as f:
+                info = json.load(f)
+            info['offset'] = os.path.getsize(part_path)
+        except (OSError, ValueError):
+            return None
+        return info
+    
+    def append_chunk(self, upload_id, offset, end, stream):
+        """Дописывает часть файла [offset, end), возвращает новое смещение.
+        
+        Часть, пришедшая не с текущей позиции, не принимается - клиент
+        узнает смещение через upload_info и продолжает с него. Часть,
+        в которой байт меньше или больше заявленного, отбрасывается целиком.
+        """
+        with self._upload_lock(upload_id):
+            info = self.upload_info(upload_id)
+            if info is None:
+                raise AssetError('Загрузка не найдена')
+            if offset != info['offset']:
+                return info['offset']
+            if end > info['size']:
+                raise AssetError('Данных больше, чем заявленный размер файла')
+            part_path, _ = self._upload_paths(upload_id)
+            written = info['offset']
+            with open(part_path, 'ab') as part:
+                try:
+                    while True:
+                        chunk = stream.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        written += len(chunk)
+                        if written > end:
+                            raise AssetError('Часть файла больше, чем указано в Content-Range')
+                        part.write(chunk)
+                    if written != end:
+                        raise AssetError('Часть файла получена не полностью')
+                except BaseException:
+                    # Обрываем недописанную часть, чтобы докачка началась с ее начала
+                    part.truncate(offset)
+                    raise
+            return written
+    
+    def _upload_lock(self, upload_id):
+        # Две части одной загрузки не пишутся одновременно
+        self._upload_paths(upload_id)
+        with self._locks_guard:
+            return self._upload_locks.setdefault(upload_id, threading.Lock())
+    
+    def finish_upload(self, upload_id):
+        """Переносит собранный файл в хранилище, возвращает (asset_id, mime_type, size).
+        
+        Под той же блокировкой, что и append_chunk: файл не переносится,
+        пока в него дописывается часть.
+        """
+        part_path, _ = self._upload_paths(upload_id)
+        try:
+            with self._upload_lock(upload_id):
+                info = self.upload_info(upload_id)
+                if info is None:
+                    raise AssetError('Загрузка не найдена')
+                if info['offset'] != info['size']:
+                    raise AssetError('Файл загружен не полностью')
+                try:
+                    with open(part_path, 'rb') as part:
+                        return self.save_stream(part)
+                finally:
+                    self._remove_upload_files(upload_id)
+        finally:
+            self._forget_upload_lock(upload_id)
+    
+    def discard_upload(self, upload_id):
+        with self._upload_lock(upload_id):
+            self._remove_upload_files(upload_id)
+        self._forget_upload_lock(upload_id)
+    
+    def _remove_upload_files(self, upload_id):
+        for path in self._upload_paths(upload_id):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    def _forget_upload_lock(self, upload_id):
+        with self._locks_guard:
+            self._upload_locks.pop(upload_id, None)
+    
+    def cleanup_uploads(self, max_age):
+        """Удаляет брошенные загрузки, в которые ничего не дописывалось max_age секунд.
+        
+        Метаданные пишутся один раз при создании, поэтому время последней
+        части - это mtime .part; оба файла загрузки удаляются вместе.
+        """
+        deadline = time.time() - max_age
+        upload_ids = {os.path.splitext(name)[0] for name in os.listdir(self.uploads_dir)}
+        for upload_id in upload_ids:
+            if not _UPLOAD_ID_RE.match(upload_id):
+                continue
+            with self._upload_lock(upload_id):
+                try:
+                    active = max(os.path.getmtime(path) for path in self._upload_paths(upload_id)
+                                 if os.path.exists(path))
+                    if active < deadline:
+                        self._remove_upload_files(upload_id)
+                except (OSError, ValueError):
+                    pass
+        
+        # Блокировки удаленных загрузок (и запросов к несуществующим) больше не нужны
+        with self._locks_guard:
+            for upload_id, lock in list(self._upload_locks.items()):
+                if not lock.locked() and not any(os.path.exists(path) for path in self._upload_paths(upload_id)):
+                    del self._upload_locks[upload_id]
+
+def get_asset_store():
+    """Хранилище для текущего приложения (создается один раз)"""
+    store = current_app.extensions.get('asset_store')
+    if store is None:
+        store = AssetStore(current_app.config['ASSET_DIR'], current_app.config['MAX_ASSET_SIZE'])
+        current_app.extensions['asset_store'] = store
+    return store
+
+
+def sweep_unregistered_files(max_age):
+    """Удаляет файлы хранилища без записи в таблице asset, старше max_age секунд.
+    
+    Файл попадает в хранилище до commit записи о нем; если транзакция
+    откатилась (ошибка в другой сцене той же новеллы), он остается без
+    ссылок. Возвращает id удаленных файлов.
+    """
+    store = get_asset_store()
+    deadline = time.time() - max_age
+    store.remove_stale_tmp(deadline)
+    candidates = list(store.stored_ids(deadline))
+    removed = []
+    for start in range(0, len(candidates), 500):
+        batch = candidates[start:start + 500]
+        known = {row.id for row in db.session.query(Asset.id).filter(Asset.id.in_(batch))}
+        for asset_id in batch:
+            if asset_id not in known:
+                store.remove(asset_id)
+                removed.append(asset_id)
+    return removed
+
+
+def store_asset(stream, owner_id=None):
+    """Сохраняет файл и регистрирует его в таблице asset (без commit).
+    
+    Уменьшенные копии строятся в фоне, файл на диске уже готов.
+    """
+    return register_asset(*get_asset_store().save_stream(stream), owner_id=owner_id)
+
+
+def register_asset(asset_id, mime_type, size, owner_id=None):
+    """Запись в таблице asset для файла, уже лежащего в хранилище"""
+    asset = db.session.get(Asset, asset_id)
+    if asset is None:
+        asset = Asset(id=asset_id, mime_type=mime_type, size=size, owner_id=owner_id)
+        db.session.add(asset)
+    if mime_type in RESIZABLE_MIME_TYPES:
+        get_image_pipeline().submit(asset_id)
+    return asset
+
+
+def ingest_data_url(value, owner_id=None):
+    """Переносит base64 data: URL в хранилище и возвращает короткую ссылку"""
+    try:
+        payload = base64.b64decode(value.split(',', 1)[1], validate=False)
+    except (binascii.Error, IndexError):
+        raise AssetError('Некорректные данные изображения')
+    return asset_ref(store_asset(io.BytesIO(payload), owner_id).id)
+
+
+def externalize_scene_media(scene_data, owner_id=None):
+    """Заменяет встроенные base64 картинки сцены ссылками на хранилище"""
+    background = scene_data.get('background')
+    if is_data_url(background):
+        scene_data['background'] = ingest_data_url(background, owner_id)
+
+    sprites = scene_data.get('sprites')
+    if isinstance(sprites, list):
+        for sprite in sprites:
+            if isinstance(sprite, dict) and is_data_url(sprite.get('url')):
+                sprite['url'] = ingest_data_url(sprite['url'], owner_id)
+    return scene_data
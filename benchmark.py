@@ -0,0 +1,258 @@
+# benchmark.py - замеры основных маршрутов на сгенерированном корпусе
+#
+# Сначала корпус:   python generate_corpus.py --preset medium
+# Затем замер:      python benchmark.py --requests 200 --json before.json
+# После изменений:  python benchmark.py --requests 200 --compare before.json
+#
+# Запросы идут через тестовый клиент Flask в этом же процессе: сеть и waitress
+# не участвуют, видно время самого приложения и базы.
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from generate_corpus import DEFAULT_DIR, BENCH_PASSWORD, configure_environment
+
+# Маршруты в порядке вывода
+ROUTES = ('index', 'view_novel', 'get_novel_data', 'save_novel', 'my_novels')
+# Сколько запросов маршрута повторить под tracemalloc для пика памяти
+MEMORY_SAMPLES = 5
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Замеры маршрутов на синтетическом корпусе')
+    parser.add_argument('--dir', default=DEFAULT_DIR, help='каталог корпуса (generate_corpus.py --dir)')
+    parser.add_argument('--requests', type=int, default=100, help='запросов на маршрут')
+    parser.add_argument('--warmup', type=int, default=10, help='прогревочных запросов на маршрут')
+    parser.add_argument('--routes', default=','.join(ROUTES), help='маршруты через запятую')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', dest='json_path', help='сохранить результаты в файл')
+    parser.add_argument('--compare', help='сравнить с сохраненными результатами')
+    parser.add_argument('--max-regression', type=float,
+                        help='код выхода 1, если p50 или p99 хуже базовых больше чем на столько %%')
+    return parser.parse_args(argv)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def peak_rss_mb():
+    """Пиковая память процесса; на Windows нет resource - пробуем psutil"""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss) / 1024 / 1024
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux - килобайты, macOS - байты
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+class Workload:
+    """Выбирает из корпуса автора и новеллы и строит запросы к маршрутам"""
+
+    def __init__(self, app, rng):
+        from sqlalchemy import func, select
+        from database.db import db, User, Novel
+
+        self.app = app
+        self.rng = rng
+        with app.app_context():
+            # Автор с наибольшим числом новелл - самый тяжелый "Мои новеллы"
+            author_id, email = db.session.execute(
+                select(User.id, User.email).join(Novel, Novel.author_id == User.id)
+                .where(User.email.like('%@bench.local'))
+                .group_by(User.id).order_by(func.count(Novel.id).desc()).limit(1)
+            ).one()
+            self.email = email
+            self.own_novels = [row[0] for row in db.session.execute(
+                select(Novel.id).where(Novel.author_id == author_id).order_by(Novel.id))]
+            published = [row[0] for row in db.session.execute(
+                select(Novel.id).where(Novel.is_published == True).order_by(Novel.id))]
+        if not published:
+            raise SystemExit('❌ В корпусе нет опубликованных новелл')
+        # Читаем разные новеллы, а не одну и ту же из кеша страниц
+        self.published = rng.sample(published, min(len(published), 50))
+        self.client = app.test_client()
+        self.saves = 0
+
+    def login(self):
+        response = self.client.post('/login', data={'email': self.email, 'password': BENCH_PASSWORD})
+        if response.status_code != 302:
+            raise SystemExit(f'❌ Не удалось войти как {self.email}')
+
+    def request(self, route):
+        """Один запрос маршрута: (статус, байт в ответе)"""
+        if route == 'index':
+            response = self.client.get('/')
+        elif route == 'view_novel':
+            response = self.client.get(f'/view/{self.rng.choice(self.published)}')
+        elif route == 'get_novel_data':
+            response = self.client.get(f'/api/novel/{self.rng.choice(self.own_novels)}')
+        elif route == 'save_novel':
+            response = self.save()
+        elif route == 'my_novels':
+            response = self.client.get('/my_novels')
+        else:
+            raise SystemExit(f'❌ Неизвестный маршрут: {route}')
+        return response.status_code, len(response.get_data())
+
+    def save(self):
+        """Автор сохраняет новеллу целиком, изменив текст одной сцены"""
+        novel_id = self.rng.choice(self.own_novels)
+        data = self.client.get(f'/api/novel/{novel_id}').get_json()
+        self.saves += 1
+        if data['scenes']:
+            scene = self.rng.choice(data['scenes'])
+            scene['text'] = f"{scene['text'].split(' [правка')[0]} [правка {self.saves}]"
+        return self.client.post(f'/api/save_novel/{novel_id}', json=data)
+
+
+def run_route(workload, route, args):
+    for _ in range(args.warmup):
+        workload.request(route)
+
+    timings, errors, size = [], 0, 0
+    started = time.perf_counter()
+    for _ in range(args.requests):
+        request_started = time.perf_counter()
+        status, size = workload.request(route)
+        timings.append(time.perf_counter() - request_started)
+        if status >= 400:
+            errors += 1
+    elapsed = time.perf_counter() - started
+
+    # Пик выделенной Python-памяти на запрос - отдельно, tracemalloc замедляет все
+    tracemalloc.start()
+    peak = 0
+    for _ in range(MEMORY_SAMPLES):
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        workload.request(route)
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+    rss = peak_rss_mb()
+
+    return {
+        'requests': args.requests,
+        'errors': errors,
+        'rps': round(args.requests / elapsed, 1),
+        'p50_ms': round(percentile(timings, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(timings, 0.99) * 1000, 2),
+        'mean_ms': round(statistics.mean(timings) * 1000, 2),
+        'response_kb': round(size / 1024, 1),
+        'alloc_peak_mb': round(peak / 1024 / 1024, 2),
+        'rss_peak_mb': round(rss, 1) if rss is not None else None
+    }
+
+
+def corpus_summary(app):
+    from sqlalchemy import func, select
+    from database.db import db, User, Novel, Scene
+
+    with app.app_context():
+        return {
+            'users': db.session.scalar(select(func.count(User.id))),
+            'novels': db.session.scalar(select(func.count(Novel.id))),
+            'scenes': db.session.scalar(select(func.count(Scene.id)))
+        }
+
+
+def change(current, baseline):
+    if not baseline or current is None:
+        return ''
+    return f'{(current - baseline) / baseline * 100:+.0f}%'
+
+
+def print_results(results, baseline=None):
+    baseline = (baseline or {}).get('routes', {})
+    print(f"\n📊 Результаты:")
+    print(f"   {'маршрут':<16}{'rps':>9}{'p50 мс':>10}{'p99 мс':>10}{'ответ KB':>10}"
+          f"{'пик МБ':>9}{'RSS МБ':>9}{'ошибки':>8}")
+    for route, row in results['routes'].items():
+        rss = row['rss_peak_mb'] if row['rss_peak_mb'] is not None else 'n/a'
+        print(f"   {route:<16}{row['rps']:>9}{row['p50_ms']:>10}{row['p99_ms']:>10}{row['response_kb']:>10}"
+              f"{row['alloc_peak_mb']:>9}{rss:>9}{row['errors']:>8}")
+        base = baseline.get(route)
+        if base:
+            print(f"   {'':<16}{change(row['rps'], base['rps']):>9}{change(row['p50_ms'], base['p50_ms']):>10}"
+                  f"{change(row['p99_ms'], base['p99_ms']):>10}{change(row['response_kb'], base['response_kb']):>10}"
+                  f"{change(row['alloc_peak_mb'], base['alloc_peak_mb']):>9}"
+                  f"{change(row['rss_peak_mb'], base['rss_peak_mb']):>9}")
+
+
+def regressions(results, baseline, limit):
+    """Маршруты, где p50 или p99 выросли больше чем на limit %"""
+    found = []
+    for route, row in results['routes'].items():
+        base = baseline.get('routes', {}).get(route)
+        if not base:
+            continue
+        for key in ('p50_ms', 'p99_ms'):
+            if base[key] and (row[key] - base[key]) / base[key] * 100 > limit:
+                found.append(f'{route} {key}: {base[key]} -> {row[key]}')
+    return found
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not os.path.exists(os.path.join(args.dir, 'corpus.db')):
+        raise SystemExit(f'❌ Корпус не найден в {args.dir}: сначала python generate_corpus.py')
+    configure_environment(args.dir)
+
+    from app import app
+
+    routes = [route.strip() for route in args.routes.split(',') if route.strip()]
+    workload = Workload(app, random.Random(args.seed))
+    workload.login()
+    results = {
+        'corpus': corpus_summary(app),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'requests_per_route': args.requests,
+        'routes': {}
+    }
+    print(f"📚 Корпус: {results['corpus']['novels']} новелл, {results['corpus']['scenes']} сцен")
+    print(f"👤 Автор: {workload.email} ({len(workload.own_novels)} новелл)")
+
+    for route in routes:
+        print(f"⏱️ {route}...")
+        results['routes'][route] = run_route(workload, route, args)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('corpus') != results['corpus']:
+            print(f"⚠️ Корпус отличается от базового: {baseline.get('corpus')}")
+    print_results(results, baseline)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Сохранено: {args.json_path}")
+
+    if baseline and args.max_regression is not None:
+        found = regressions(results, baseline, args.max_regression)
+        for line in found:
+            print(f"❌ Замедление больше {args.max_regression}%: {line}")
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,6 +4,8 @@ echo ?????? Visual Novel...
 REM ??????? ?????????? ??????
 rd /s /q build dist 2>nul
 
+python build_static.py
+
 REM ??????
 pyinstaller --onefile ^
   --name "VisualNovel" ^
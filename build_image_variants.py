@@ -0,0 +1,45 @@
+# build_image_variants.py
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, db, jobs
+from database.db import Asset
+from image_pipeline import RESIZABLE_MIME_TYPES, get_image_pipeline
+
+# Рабочие процессы пайплайна изображений (forkserver) импортируют этот модуль заново
+if __name__ == '__main__':
+    print("🔄 Построение уменьшенных копий изображений...")
+
+    with app.app_context():
+        pipeline = get_image_pipeline()
+        if not pipeline.enabled:
+            print("❌ Pillow не установлен или IMAGE_WORKERS=0 - нечего делать")
+            sys.exit(1)
+
+        assets = db.session.query(Asset.id).filter(Asset.mime_type.in_(RESIZABLE_MIME_TYPES)).all()
+        futures = {asset.id: pipeline.submit(asset.id) for asset in assets}
+        built_count = 0
+        error_count = 0
+
+        for asset_id, future in futures.items():
+            if future is None:
+                continue
+            try:
+                manifest = future.result()
+                built_count += 1
+                print(f"✅ {asset_id[:12]}: {', '.join(manifest['variants'])}")
+            except Exception as e:
+                error_count += 1
+                print(f"❌ {asset_id[:12]}: ошибка - {e}")
+
+        pipeline.shutdown()
+        # Новеллы с этими изображениями получают новый render_version - читалка
+        # и бандлы пересобираются уже с srcset
+        jobs.join()
+        print(f"\n📊 Результаты:")
+        print(f"   Построено: {built_count}")
+        print(f"   Уже были готовы: {sum(1 for f in futures.values() if f is None)}")
+        print(f"   Ошибок: {error_count}")
+
+    print("\n🎯 Готово!")
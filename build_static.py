@@ -0,0 +1,119 @@
+# build_static.py - сборка статики с хешами в именах файлов
+#
+# Запуск: python build_static.py
+# Результат: static/dist/ с файлами вида js/builder.3f2a1b9c0d.js, их
+# сжатыми копиями .gz/.br и static/dist/manifest.json для static_assets.py
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BASE_DIR = Path(__file__).parent
+STATIC_DIR = BASE_DIR / 'static'
+DIST_DIR = STATIC_DIR / 'dist'
+
+# Адрес этих файлов должен оставаться постоянным
+SKIP_FILES = {'sw.js', 'manifest.json'}
+COMPRESS_EXTENSIONS = {'.js', '.css', '.svg', '.json', '.txt'}
+CSS_URL_RE = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+def hashed_name(relative_path, content):
+    digest = hashlib.sha256(content).hexdigest()[:10]
+    stem, ext = os.path.splitext(relative_path)
+    return f'{stem}.{digest}{ext}'
+
+
+def rewrite_css_urls(relative_path, content, manifest):
+    """Заменяет относительные url() в CSS на файлы с хешами"""
+    css_dir = os.path.dirname(relative_path)
+
+    def replace(match):
+        quote, url = match.groups()
+        if re.match(r'^(?:[a-z]+:|/|#)', url):
+            return match.group(0)
+        target = os.path.normpath(os.path.join(css_dir, url)).replace(os.sep, '/')
+        if target not in manifest:
+            return match.group(0)
+        # Сам CSS тоже переезжает в dist/, поэтому путь считаем оттуда
+        new_url = os.path.relpath(manifest[target], f'dist/{css_dir}').replace(os.sep, '/')
+        return f'url({quote}{new_url}{quote})'
+
+    return CSS_URL_RE.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+
+def write_compressed(path, content):
+    """Сжатые копии рядом с файлом: их отдает сервер по Accept-Encoding"""
+    if path.suffix not in COMPRESS_EXTENSIONS:
+        return []
+    written = []
+    gz_path = path.with_name(path.name + '.gz')
+    # mtime=0 - одинаковый результат при повторной сборке
+    with open(gz_path, 'wb') as f, gzip.GzipFile(fileobj=f, mode='wb', compresslevel=9, mtime=0) as gz:
+        gz.write(content)
+    written.append(gz_path)
+    if brotli is not None:
+        br_path = path.with_name(path.name + '.br')
+        br_path.write_bytes(brotli.compress(content, quality=11))
+        written.append(br_path)
+    return written
+
+
+def collect_files():
+    files = []
+    for path in sorted(STATIC_DIR.rglob('*')):
+        if not path.is_file() or DIST_DIR in path.parents:
+            continue
+        relative_path = path.relative_to(STATIC_DIR).as_posix()
+        if relative_path in SKIP_FILES:
+            continue
+        files.append(relative_path)
+    # CSS в конце: к этому моменту известны новые имена картинок
+    return sorted(files, key=lambda name: name.endswith('.css'))
+
+
+def build():
+    if DIST_DIR.exists():
+        shutil.rmtree(DIST_DIR)
+    DIST_DIR.mkdir(parents=True)
+
+    manifest = {}
+    total_size = 0
+    compressed_size = 0
+    for relative_path in collect_files():
+        content = (STATIC_DIR / relative_path).read_bytes()
+        if relative_path.endswith('.css'):
+            content = rewrite_css_urls(relative_path, content, manifest)
+
+        output_name = hashed_name(relative_path, content)
+        output_path = DIST_DIR / output_name
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_path.write_bytes(content)
+        manifest[relative_path] = f'dist/{output_name}'
+
+        total_size += len(content)
+        for path in write_compressed(output_path, content):
+            if path.suffix == '.gz':
+                compressed_size += path.stat().st_size
+        print(f"✅ {relative_path} -> dist/{output_name}")
+
+    # Пути в манифесте указаны относительно static/
+    with open(DIST_DIR / 'manifest.json', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    print(f"\n📊 Файлов: {len(manifest)}, {total_size // 1024} KB, gzip: {compressed_size // 1024} KB")
+    if brotli is None:
+        print("ℹ️ Модуль brotli не установлен - собраны только .gz")
+    return manifest
+
+
+if __name__ == '__main__':
+    build()
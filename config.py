@@ -5,5 +5,90 @@ BASE_DIR = Path(__file__).parent
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key'
-    SQLALCHEMY_DATABASE_URI = f'sqlite:///{BASE_DIR}/visual_novel.db'
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    # DATABASE_URL - другой файл базы, например для сгенерированного корпуса (generate_corpus.py)
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or f'sqlite:///{BASE_DIR}/visual_novel.db'
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    
+    # Хранилище загруженных изображений (assets.py)
+    ASSET_DIR = os.environ.get('ASSET_DIR') or str(BASE_DIR / 'uploads' / 'assets')
+    MAX_ASSET_SIZE = int(os.environ.get('MAX_ASSET_SIZE', 5 * 1024 * 1024))
+    
+    # Новелл на одной странице каталога
+    CATALOG_PAGE_SIZE = 24
+    
+    # Результатов поиска на одной странице (/search)
+    SEARCH_PAGE_SIZE = 20
+    
+    # Кеш отрендеренных страниц читалки (render_cache.py)
+    VIEWER_CACHE_MAX_ENTRIES = int(os.environ.get('VIEWER_CACHE_MAX_ENTRIES', 256))
+    VIEWER_CACHE_MAX_BYTES = int(os.environ.get('VIEWER_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    
+    # Сколько сцен читалка может запросить за один раз
+    READER_MAX_SCENES_PER_REQUEST = 16
+    
+    # Прогресс чтения (progress.py): как часто писать накопленное в базу,
+    # сколько ручных слотов сохранения и длина истории переходов
+    PROGRESS_FLUSH_INTERVAL = float(os.environ.get('PROGRESS_FLUSH_INTERVAL', 2.0))
+    PROGRESS_MAX_SLOTS = 10
+    PROGRESS_HISTORY_LIMIT = 500
+    
+    # Профиль SQLite (database/engine.py): WAL и pragma на каждое соединение
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -16000)),
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 128 * 1024 * 1024)),
+        'temp_store': 'MEMORY'
+    }
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))
+    SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', 10))
+    SQLITE_MAX_OVERFLOW = int(os.environ.get('SQLITE_MAX_OVERFLOW', 20))
+    SQLITE_POOL_TIMEOUT = int(os.environ.get('SQLITE_POOL_TIMEOUT', 30))
+    # Отдельный движок только для чтения для каталога и читалки
+    SQLITE_READ_ONLY_ENGINE = os.environ.get('SQLITE_READ_ONLY_ENGINE', '').lower() in ('1', 'true', 'yes')
+    
+    # Уменьшенные копии изображений (image_pipeline.py): имя -> рамка (ширина, высота)
+    IMAGE_VARIANTS = {
+        'thumb': (200, 200),
+        'card': (400, 400),
+        'stage': (800, 800),
+        'retina': (1600, 1600)
+    }
+    IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', 80))
+    # 0 - не строить варианты (только оригиналы)
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+    
+    # Предел размера любого запроса - Flask отвечает 413 до чтения тела
+    MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))
+    # Загрузка по частям с докачкой (/api/uploads)
+    UPLOAD_CHUNK_SIZE = 1024 * 1024
+    UPLOAD_EXPIRY = 24 * 60 * 60
+    
+    # Манифест статики с хешами в именах (build_static.py), без него - обычные файлы
+    STATIC_MANIFEST = os.environ.get('STATIC_MANIFEST') or str(BASE_DIR / 'static' / 'dist' / 'manifest.json')
+    
+    # Сервер waitress (run.py)
+    SERVER_HOST = os.environ.get('SERVER_HOST', '0.0.0.0')
+    SERVER_PORT = int(os.environ.get('SERVER_PORT', 5000))
+    SERVER_THREADS = int(os.environ.get('SERVER_THREADS', 8))
+    SERVER_CONNECTION_LIMIT = int(os.environ.get('SERVER_CONNECTION_LIMIT', 200))
+    SERVER_BACKLOG = int(os.environ.get('SERVER_BACKLOG', 1024))
+    # Сколько секунд держать простаивающее keep-alive соединение
+    SERVER_CHANNEL_TIMEOUT = int(os.environ.get('SERVER_CHANNEL_TIMEOUT', 30))
+    # Сколько ждать завершения начатых запросов при остановке
+    SERVER_SHUTDOWN_TIMEOUT = int(os.environ.get('SERVER_SHUTDOWN_TIMEOUT', 15))
+    
+    # Метрики запросов (metrics.py): журнал доступа JSON-строками
+    # ('-' - stdout, путь - файл, пусто - выключен) и Bearer-токен для /metrics
+    # (пока токен не задан, /metrics отвечает 404)
+    ACCESS_LOG = os.environ.get('ACCESS_LOG', '-')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+    
+    # Журнал медленных SQL-запросов с EXPLAIN QUERY PLAN (database/slow_queries.py):
+    # порог в мс (отрицательный - выключен, 0 - все запросы) и куда писать
+    SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', 100))
+    SLOW_QUERY_LOG = os.environ.get('SLOW_QUERY_LOG', '-')
+    
+    # Бандлы читалки для опубликованных новелл (reader_bundle.py)
+    BUNDLE_DIR = os.environ.get('BUNDLE_DIR') or str(BASE_DIR / 'uploads' / 'bundles')
+    BUNDLE_CACHE_MAX_BYTES = int(os.environ.get('BUNDLE_CACHE_MAX_BYTES', 64 * 1024 * 1024))
@@ -59,6 +59,7 @@ CREATE TABLE IF NOT EXISTS novel (
     author_id INTEGER NOT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    scene_count INTEGER NOT NULL DEFAULT 0,
     FOREIGN KEY (author_id) REFERENCES user(id)
 )
 ''')
@@ -244,6 +245,9 @@ for i in range(3):
 
 print(f"✅ Добавлено 3 пустые сцены для черновика")
 
+# Счетчики сцен в новеллах
+cursor.execute('UPDATE novel SET scene_count = (SELECT COUNT(*) FROM scene WHERE scene.novel_id = novel.id)')
+
 # Сохраняем изменения
 conn.commit()
 
@@ -4,9 +4,12 @@ from datetime import datetime
 import json
 import os
 from sqlalchemy.ext.hybrid import hybrid_property
-from sqlalchemy import event
+from sqlalchemy import DDL, delete, event, func, insert, inspect, select, text, update
+from sqlalchemy.orm import Session, load_only
+from database.graph import choice_target, compile_story_graph
+from database.engine import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(UserMixin, db.Model):
     __tablename__ = 'user'
@@ -23,6 +26,12 @@ class User(UserMixin, db.Model):
 
 class Novel(db.Model):
     __tablename__ = 'novel'
+    __table_args__ = (
+        # Каталог: опубликованные, новые сверху (id в индексе SQLite есть всегда как rowid)
+        db.Index('ix_novel_published_created', 'is_published', 'created_at'),
+        # "Мои новеллы": новеллы автора, новые сверху
+        db.Index('ix_novel_author_created', 'author_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
@@ -32,11 +41,29 @@ class Novel(db.Model):
     author_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Число сцен поддерживается обработчиком flush ниже, без COUNT на каждый показ
+    scene_count = db.Column(db.Integer, nullable=False, default=0)
+    # Скомпилированный граф сюжета (database/graph.py), пересобирается при commit
+    story_graph = db.Column(db.Text, default='')
+    # Версия готового бандла читалки (reader_bundle.py), собирается в фоне
+    bundle_version = db.Column(db.String(32), default='')
+    # Растет, когда новелла меняется для читателя без правки автора (готовы
+    # уменьшенные копии ее изображений); входит в ключ кеша читалки и версию бандла
+    render_version = db.Column(db.Integer, nullable=False, default=0)
     
-    scenes = db.relationship('Scene', backref='novel', lazy=True, order_by='Scene.order')
+    scenes = db.relationship('Scene', backref='novel', lazy=True, order_by='(Scene.order, Scene.id)')
+    
+    @property
+    def story_graph_data(self):
+        """Граф сюжета как словарь или None, если еще не собран"""
+        return decoded_json(self, 'story_graph', decode_story_graph)
 
 class Scene(db.Model):
     __tablename__ = 'scene'
+    __table_args__ = (
+        # Сцены новеллы в порядке показа (Novel.scenes, scene_ids_in_order)
+        db.Index('ix_scene_novel_order', 'novel_id', 'order'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     novel_id = db.Column(db.Integer, db.ForeignKey('novel.id'), nullable=False)
@@ -47,50 +74,283 @@ class Scene(db.Model):
     choices = db.Column(db.Text, default='[]')
     sprites = db.Column(db.Text, default='[]')
     
-    # Свойства для удобной работы с JSON данными
+    # Свойства для удобной работы с JSON данными.
+    # Разобранный список кешируется до изменения колонки, поэтому менять
+    # его на месте нельзя - новое значение присваивается через setter.
     @property
     def choices_list(self):
         """Возвращает choices как список Python"""
-        if self.choices and self.choices != '[]':
-            try:
-                return json.loads(self.choices)
-            except:
-                return []
-        return []
+        return decoded_json(self, 'choices', decode_choices)
     
     @choices_list.setter
     def choices_list(self, value):
         """Устанавливает choices из списка Python"""
-        if isinstance(value, list):
-            self.choices = json.dumps(value, ensure_ascii=False)
-        else:
-            self.choices = '[]'
+        self.choices = dump_choices(value)
     
     @property
     def sprites_list(self):
         """Возвращает sprites как список Python"""
-        if self.sprites and self.sprites != '[]':
-            try:
-                sprites = json.loads(self.sprites)
-                # Гарантируем наличие isOnCanvas
-                if isinstance(sprites, list):
-                    for sprite in sprites:
-                        if isinstance(sprite, dict):
-                            sprite['isOnCanvas'] = sprite.get('isOnCanvas', True)
-                return sprites
-            except:
-                return []
-        return []
+        return decoded_json(self, 'sprites', decode_sprites)
     
     @sprites_list.setter
     def sprites_list(self, value):
         """Устанавливает sprites из списка Python"""
-        if isinstance(value, list):
-            # Фильтруем только спрайты на холсте
-            canvas_sprites = [s for s in value if s.get('isOnCanvas', True)]
-            self.sprites = json.dumps(canvas_sprites, ensure_ascii=False)
-        else:
-            self.sprites = '[]'
+        self.sprites = dump_sprites(value)
+    
+    @staticmethod
+    def decode_all(scenes):
+        """Разбирает choices и sprites всех сцен за один проход (для целой новеллы)"""
+        for scene in scenes:
+            decoded_json(scene, 'choices', decode_choices)
+            decoded_json(scene, 'sprites', decode_sprites)
+        return scenes
+    
+    def apply_data(self, data, index=0, partial=False):
+        """Обновляет сцену из данных конструктора.
+        
+        При partial=True меняются только переданные поля. Возвращает True,
+        если хоть одно поле действительно изменилось - неизмененные сцены
+        не попадают в UPDATE.
+        """
+        defaults = {
+            'name': f'Сцена {index + 1}',
+            'background': '',
+            'text': '',
+            'order': index
+        }
+        values = {}
+        for field, default in defaults.items():
+            if field in data:
+                values[field] = data[field]
+            elif not partial:
+                values[field] = default
+        
+        if 'choices' in data or not partial:
+            values['choices'] = dump_choices(data.get('choices', []))
+        if 'sprites' in data or not partial:
+            values['sprites'] = dump_sprites(data.get('sprites', []))
+        
+        changed = False
+        for field, value in values.items():
+            current = getattr(self, field)
+            if current == value:
+                continue
+            # JSON колонки сравниваем по содержимому: в старых записях ключи
+            # могут идти в другом порядке, и это не изменение сцены
+            decode = {'choices': decode_choices, 'sprites': decode_sprites}.get(field)
+            if decode is not None and decoded_json(self, field, decode) == decode(value):
+                continue
+            setattr(self, field, value)
+            changed = True
+        return changed
+
+def decoded_json(obj, field, decode):
+    """Значение JSON колонки, разобранное один раз на каждое ее значение.
+    
+    Кеш сверяется с самой строкой колонки по идентичности: setter,
+    загрузка из базы и expire дают новую строку и сбрасывают кеш.
+    """
+    raw = getattr(obj, field)
+    cache = obj.__dict__.get('_json_cache')
+    if cache is None:
+        cache = obj.__dict__['_json_cache'] = {}
+    entry = cache.get(field)
+    if entry is not None and entry[0] is raw:
+        return entry[1]
+    value = decode(raw)
+    cache[field] = (raw, value)
+    return value
+
+def decode_choices(raw):
+    if not raw or raw == '[]':
+        return []
+    try:
+        return json.loads(raw)
+    except:
+        return []
+
+def decode_sprites(raw):
+    sprites = decode_choices(raw)
+    # Гарантируем наличие isOnCanvas
+    if isinstance(sprites, list):
+        for sprite in sprites:
+            if isinstance(sprite, dict):
+                sprite['isOnCanvas'] = sprite.get('isOnCanvas', True)
+    return sprites
+
+def decode_story_graph(raw):
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return None
+
+def decode_history(raw):
+    try:
+        history = json.loads(raw) if raw else []
+    except (TypeError, ValueError):
+        return []
+    return history if isinstance(history, list) else []
+
+def dump_choices(value):
+    """Сериализует список вариантов выбора в JSON для колонки choices.
+    
+    Ключи по алфавиту - как их возвращает /api/novel (jsonify), чтобы
+    одинаковые данные давали одинаковую строку.
+    """
+    if isinstance(value, list):
+        return json.dumps(value, ensure_ascii=False, sort_keys=True)
+    return '[]'
+
+def dump_sprites(value):
+    """Сериализует спрайты в JSON, оставляя только спрайты на холсте"""
+    if isinstance(value, list):
+        canvas_sprites = [s for s in value if s.get('isOnCanvas', True)]
+        return json.dumps(canvas_sprites, ensure_ascii=False, sort_keys=True)
+    return '[]'
+
+def number_or_none(value):
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+class SceneChoice(db.Model):
+    """Вариант выбора сцены - нормализованная копия Scene.choices для запросов"""
+    __tablename__ = 'scene_choice'
+    __table_args__ = (
+        db.Index('ix_scene_choice_scene_position', 'scene_id', 'position'),
+        db.Index('ix_scene_choice_novel_target', 'novel_id', 'next_scene'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    # PRAGMA foreign_keys выключен - ON DELETE CASCADE не сработал бы. Строки
+    # удаляются вместе со сценой в sync_scene_rows() и delete_scene_rows()
+    scene_id = db.Column(db.Integer, db.ForeignKey('scene.id'), nullable=False)
+    novel_id = db.Column(db.Integer, db.ForeignKey('novel.id'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    text = db.Column(db.Text, default='')
+    # Номер сцены с 1, как nextScene в JSON; 0 - конец истории
+    next_scene = db.Column(db.Integer, nullable=False, default=0)
+    
+    @staticmethod
+    def rows_for(scene):
+        return [{
+            'scene_id': scene.id,
+            'novel_id': scene.novel_id,
+            'position': position,
+            'text': str(choice.get('text') or ''),
+            'next_scene': choice_target(choice)
+        } for position, choice in enumerate(scene.choices_list) if isinstance(choice, dict)]
+
+class SceneSprite(db.Model):
+    """Спрайт сцены - нормализованная копия Scene.sprites для запросов"""
+    __tablename__ = 'scene_sprite'
+    __table_args__ = (
+        db.Index('ix_scene_sprite_scene_position', 'scene_id', 'position'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    # Удаляются вручную, как и SceneChoice
+    scene_id = db.Column(db.Integer, db.ForeignKey('scene.id'), nullable=False)
+    novel_id = db.Column(db.Integer, db.ForeignKey('novel.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False)
+    sprite_key = db.Column(db.String(100), default='')
+    name = db.Column(db.String(100), default='')
+    url = db.Column(db.Text, default='')
+    # Изображение из хранилища, если url вида /assets/<sha256>
+    asset_id = db.Column(db.String(64), db.ForeignKey('asset.id'), index=True)
+    x = db.Column(db.Float)
+    y = db.Column(db.Float)
+    width = db.Column(db.Float)
+    height = db.Column(db.Float)
+    rotation = db.Column(db.Float)
+    z_index = db.Column(db.Integer)
+    
+    @staticmethod
+    def rows_for(scene):
+        from assets import asset_id_from_ref
+        
+        rows = []
+        for position, sprite in enumerate(scene.sprites_list):
+            if not isinstance(sprite, dict):
+                continue
+            z_index = number_or_none(sprite.get('zIndex'))
+            rows.append({
+                'scene_id': scene.id,
+                'novel_id': scene.novel_id,
+                'position': position,
+                'sprite_key': str(sprite.get('id') or '')[:100],
+                'name': str(sprite.get('name') or '')[:100],
+                'url': sprite.get('url') or '',
+                'asset_id': asset_id_from_ref(sprite.get('url')),
+                'x': number_or_none(sprite.get('x')),
+                'y': number_or_none(sprite.get('y')),
+                'width': number_or_none(sprite.get('width')),
+                'height': number_or_none(sprite.get('height')),
+                'rotation': number_or_none(sprite.get('rotation')),
+                'z_index': int(z_index) if z_index is not None else None
+            })
+        return rows
+
+class Asset(db.Model):
+    """Изображение в хранилище assets.py, id - sha256 от содержимого"""
+    __tablename__ = 'asset'
+    
+    id = db.Column(db.String(64), primary_key=True)
+    mime_type = db.Column(db.String(50), nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @property
+    def url(self):
+        return f'/assets/{self.id}'
+
+class ReadingProgress(db.Model):
+    """Место чтения новеллы: слот 0 - автосохранение, остальные - ручные сохранения.
+
+    Пишется не из запроса, а пачками из progress.py.
+    """
+    __tablename__ = 'reading_progress'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'novel_id', 'slot', name='uq_reading_progress_slot'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    novel_id = db.Column(db.Integer, db.ForeignKey('novel.id'), nullable=False, index=True)
+    slot = db.Column(db.Integer, nullable=False, default=0)
+    name = db.Column(db.String(100), default='')
+    # Позиция текущей сцены и id сцены на случай, если порядок сцен поменяют
+    scene_position = db.Column(db.Integer, nullable=False, default=0)
+    scene_id = db.Column(db.Integer)
+    # JSON-список позиций пройденных сцен
+    history = db.Column(db.Text, default='[]')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    @property
+    def history_list(self):
+        return decoded_json(self, 'history', decode_history)
+
+# Полнотекстовый поиск (database/search.py). Таблицы FTS5 не описываются
+# моделями - их создает db.create_all() через DDL ниже. unicode61 приводит
+# кириллицу к нижнему регистру, remove_diacritics 2 убирает диакритику
+# латиницы; ё и е он не склеивает, поэтому в индекс пишем текст с е
+SEARCH_TOKENIZER = 'unicode61 remove_diacritics 2'
+SEARCH_TABLES = {
+    'novel_search': f"CREATE VIRTUAL TABLE IF NOT EXISTS novel_search "
+                    f"USING fts5(title, description, tokenize='{SEARCH_TOKENIZER}')",
+    'scene_search': f"CREATE VIRTUAL TABLE IF NOT EXISTS scene_search "
+                    f"USING fts5(text, novel_id UNINDEXED, tokenize='{SEARCH_TOKENIZER}')"
+}
+for search_ddl in SEARCH_TABLES.values():
+    event.listen(db.metadata, 'after_create', DDL(search_ddl))
+
+def search_text(value):
+    return (value or '').replace('ё', 'е').replace('Ё', 'Е')
 
 # Добавляем обработчик событий для автоматического преобразования
 @event.listens_for(Scene, 'before_insert')
@@ -99,13 +359,293 @@ def before_scene_save(mapper, connection, target):
     """Автоматически преобразуем choices в JSON при сохранении"""
     if hasattr(target, '_choices'):
         if isinstance(target._choices, list):
-            target._choices = json.dumps(target._choices, ensure_ascii=False)
+            target._choices = json.dumps(target._choices, ensure_ascii=False, sort_keys=True)
         elif target._choices is None:
             target._choices = '[]'
     
     if hasattr(target, '_sprites'):
         if isinstance(target._sprites, list):
-            target._sprites = json.dumps(target._sprites, ensure_ascii=False)
+            target._sprites = json.dumps(target._sprites, ensure_ascii=False, sort_keys=True)
         elif target._sprites is None:
             target._sprites = '[]'
 
+# Поддерживаем Novel.scene_count и граф сюжета при изменении сцен через ORM
+@event.listens_for(Session, 'before_flush')
+def track_scene_changes(session, flush_context, instances):
+    # Новеллы, где сцены добавлялись или удалялись - пересчитаем scene_count
+    recount = session.info.setdefault('scene_count_novels', set())
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Scene) and obj.novel_id is not None:
+            recount.add(obj.novel_id)
+
+    # Новеллы, у которых менялись сцены - граф пересоберем перед commit
+    graph_dirty = session.info.setdefault('graph_dirty_novels', set())
+    graph_dirty.update(recount)
+    
+    # Сцены, чьи строки в scene_choice/scene_sprite нужно переписать
+    changed = session.info.setdefault('scene_rows_changed', {})
+    removed = session.info.setdefault('scene_rows_removed', set())
+    for obj in session.new:
+        if isinstance(obj, Scene):
+            changed[obj] = ('choices', 'sprites')
+    for obj in session.deleted:
+        if isinstance(obj, Scene) and obj.id is not None:
+            removed.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, Scene) and obj.novel_id is not None and session.is_modified(obj):
+            graph_dirty.add(obj.novel_id)
+            state = inspect(obj)
+            fields = tuple(f for f in ('choices', 'sprites') if state.attrs[f].history.has_changes())
+            if fields:
+                changed[obj] = tuple(set(changed.get(obj, ())) | set(fields))
+
+@event.listens_for(Session, 'after_flush_postexec')
+def apply_scene_count_changes(session, flush_context):
+    # Считаем заново, а не прибавляем разницу: при одновременных сохранениях
+    # DELETE уже удаленной другим автором сцены не меняет число строк
+    for novel_id in session.info.pop('scene_count_novels', set()):
+        session.connection().execute(scene_count_statement(novel_id))
+        novel = session.identity_map.get(session.identity_key(Novel, novel_id))
+        if novel is not None:
+            session.expire(novel, ['scene_count'])
+
+@event.listens_for(Session, 'after_flush_postexec')
+def sync_scene_rows(session, flush_context):
+    changed = session.info.pop('scene_rows_changed', {})
+    removed = session.info.pop('scene_rows_removed', set())
+    if not changed and not removed:
+        return
+    connection = session.connection()
+    for model, field in ((SceneChoice, 'choices'), (SceneSprite, 'sprites')):
+        scenes = [scene for scene, fields in changed.items() if field in fields and scene.id is not None]
+        stale_ids = removed | {scene.id for scene in scenes}
+        if stale_ids:
+            connection.execute(delete(model).where(model.scene_id.in_(stale_ids)))
+        rows = [row for scene in scenes for row in model.rows_for(scene)]
+        if rows:
+            connection.execute(insert(model), rows)
+
+# Поисковый индекс: rowid в novel_search - id новеллы, в scene_search - id сцены
+SEARCH_FIELDS = {Novel: ('title', 'description'), Scene: ('text',)}
+
+@event.listens_for(Session, 'before_flush')
+def track_search_changes(session, flush_context, instances):
+    changed = session.info.setdefault('search_changed', set())
+    removed = session.info.setdefault('search_removed', set())
+    for obj in session.new:
+        if isinstance(obj, (Novel, Scene)):
+            changed.add(obj)
+    for obj in session.deleted:
+        if isinstance(obj, (Novel, Scene)) and obj.id is not None:
+            removed.add((type(obj), obj.id))
+    for obj in session.dirty:
+        fields = SEARCH_FIELDS.get(type(obj))
+        if fields and session.is_modified(obj):
+            state = inspect(obj)
+            if any(state.attrs[field].history.has_changes() for field in fields):
+                changed.add(obj)
+
+@event.listens_for(Session, 'after_flush_postexec')
+def sync_search_index(session, flush_context):
+    changed = session.info.pop('search_changed', set())
+    removed = session.info.pop('search_removed', set())
+    if not changed and not removed:
+        return
+    connection = session.connection()
+    stale = removed | {(type(obj), obj.id) for obj in changed if obj.id is not None}
+    for model, table in ((Novel, 'novel_search'), (Scene, 'scene_search')):
+        ids = [{'id': obj_id} for obj_type, obj_id in stale if obj_type is model]
+        if ids:
+            connection.execute(text(f'DELETE FROM {table} WHERE rowid = :id'), ids)
+    
+    novels = [obj for obj in changed if isinstance(obj, Novel) and obj.id is not None
+              and (Novel, obj.id) not in removed]
+    scenes = [obj for obj in changed if isinstance(obj, Scene) and obj.id is not None
+              and (Scene, obj.id) not in removed]
+    if novels:
+        connection.execute(
+            text('INSERT INTO novel_search (rowid, title, description) VALUES (:id, :title, :description)'),
+            [{'id': n.id, 'title': search_text(n.title), 'description': search_text(n.description)}
+             for n in novels]
+        )
+    if scenes:
+        connection.execute(
+            text('INSERT INTO scene_search (rowid, text, novel_id) VALUES (:id, :text, :novel_id)'),
+            [{'id': s.id, 'text': search_text(s.text), 'novel_id': s.novel_id} for s in scenes]
+        )
+
+@event.listens_for(Session, 'before_commit')
+def rebuild_dirty_story_graphs(session):
+    # Сбрасываем изменения заранее: before_flush отметит затронутые новеллы
+    session.flush()
+    if not session.info.get('graph_dirty_novels'):
+        return
+    for novel_id in session.info.pop('graph_dirty_novels', set()):
+        rebuild_story_graph(novel_id, session)
+
+@event.listens_for(Session, 'after_rollback')
+def forget_dirty_story_graphs(session):
+    session.info.pop('graph_dirty_novels', None)
+    session.info.pop('scene_rows_changed', None)
+    session.info.pop('scene_rows_removed', None)
+    session.info.pop('search_changed', None)
+    session.info.pop('search_removed', None)
+
+def rebuild_story_graph(novel_id, session=None):
+    """Собирает граф сюжета новеллы, читая только id и choices сцен"""
+    session = session or db.session
+    rows = session.execute(
+        select(Scene.id, Scene.choices).where(Scene.novel_id == novel_id).order_by(Scene.order, Scene.id)
+    ).all()
+    scene_choices = []
+    for row in rows:
+        choices = decode_choices(row.choices)
+        scene_choices.append(choices if isinstance(choices, list) else [])
+    
+    graph = compile_story_graph([row.id for row in rows], scene_choices)
+    session.execute(
+        update(Novel).where(Novel.id == novel_id)
+        .values(story_graph=json.dumps(graph), updated_at=Novel.updated_at)
+    )
+    return graph
+
+def rebuild_scene_rows(novel_id=None):
+    """Заполняет scene_choice и scene_sprite заново из JSON колонок сцен"""
+    query = Scene.query.options(load_only(Scene.id, Scene.novel_id, Scene.choices, Scene.sprites))
+    if novel_id is not None:
+        query = query.filter(Scene.novel_id == novel_id)
+    for model in (SceneChoice, SceneSprite):
+        statement = delete(model)
+        if novel_id is not None:
+            statement = statement.where(model.novel_id == novel_id)
+        db.session.execute(statement)
+    
+    count = 0
+    for scene in query.order_by(Scene.id).yield_per(500):
+        choices, sprites = SceneChoice.rows_for(scene), SceneSprite.rows_for(scene)
+        if choices:
+            db.session.execute(insert(SceneChoice), choices)
+        if sprites:
+            db.session.execute(insert(SceneSprite), sprites)
+        count += 1
+    return count
+
+def delete_scene_rows(novel_id):
+    """Для массового удаления сцен мимо ORM (Scene.query...delete())"""
+    for model in (SceneChoice, SceneSprite):
+        db.session.execute(delete(model).where(model.novel_id == novel_id))
+    db.session.execute(
+        text('DELETE FROM scene_search WHERE rowid IN (SELECT id FROM scene WHERE novel_id = :novel_id)'),
+        {'novel_id': novel_id}
+    )
+
+def rebuild_search_index():
+    """Заполняет таблицы поиска заново из novel и scene"""
+    for table in SEARCH_TABLES:
+        db.session.execute(text(f'DELETE FROM {table}'))
+    # search_text() на стороне SQLite
+    fold = "replace(replace(coalesce({}, ''), 'ё', 'е'), 'Ё', 'Е')"
+    db.session.execute(text(
+        f"INSERT INTO novel_search (rowid, title, description) "
+        f"SELECT id, {fold.format('title')}, {fold.format('description')} FROM novel"
+    ))
+    db.session.execute(text(
+        f"INSERT INTO scene_search (rowid, text, novel_id) "
+        f"SELECT id, {fold.format('text')}, novel_id FROM scene"
+    ))
+
+def scenes_pointing_to(novel_id, position):
+    """id сцен новеллы, у которых есть выбор, ведущий на сцену с номером position (с 0)"""
+    rows = db.session.execute(
+        select(SceneChoice.scene_id).distinct()
+        .where(SceneChoice.novel_id == novel_id, SceneChoice.next_scene == position + 1)
+    )
+    return [row.scene_id for row in rows]
+
+def novels_using_asset(asset_id):
+    """id новелл, где изображение используется как обложка, спрайт или фон"""
+    ref = f'/assets/{asset_id}'
+    sprite_novels = select(SceneSprite.novel_id).where(SceneSprite.asset_id == asset_id)
+    background_novels = select(Scene.novel_id).where(Scene.background == ref)
+    cover_novels = select(Novel.id).where(Novel.cover_image == ref)
+    rows = db.session.execute(sprite_novels.union(background_novels, cover_novels))
+    return sorted(row[0] for row in rows)
+
+def bump_render_version(*criteria):
+    """Страницы читалки и бандлы новелл собираются заново, updated_at
+    при этом не меняется - автор новеллу не правил"""
+    db.session.execute(
+        update(Novel).where(*criteria)
+        .values(render_version=Novel.render_version + 1, updated_at=Novel.updated_at)
+    )
+
+def recount_scenes(novel_id=None):
+    """Пересчитывает scene_count одним запросом (для всех новелл или одной)"""
+    db.session.execute(scene_count_statement(novel_id))
+
+def scene_count_statement(novel_id=None):
+    counts = select(func.count(Scene.id)).where(Scene.novel_id == Novel.id).scalar_subquery()
+    # updated_at=updated_at - служебный пересчет не считается правкой новеллы
+    statement = update(Novel).values(scene_count=counts, updated_at=Novel.updated_at)
+    if novel_id is not None:
+        statement = statement.where(Novel.id == novel_id)
+    return statement
+
+def ensure_schema():
+    """Добавляет в существующую базу колонки и индексы, появившиеся в моделях.
+    
+    db.create_all() создает только новые таблицы, а старые файлы
+    visual_novel.db нужно дополнять через ALTER TABLE и CREATE INDEX.
+    """
+    inspector = inspect(db.engine)
+    existing_tables = set(inspector.get_table_names())
+    created = set(db.metadata.tables) - existing_tables
+    created_search = set(SEARCH_TABLES) - existing_tables
+    db.create_all()
+    inspector = inspect(db.engine)
+    added = [f'{name} (table)' for name in sorted(created | created_search)]
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+                default = column.default.arg if column.default is not None and column.default.is_scalar else None
+                if default is not None:
+                    ddl += f' DEFAULT {int(default) if isinstance(default, bool) else repr(default)}'
+                    if not column.nullable:
+                        ddl += ' NOT NULL'
+                connection.execute(text(ddl))
+                added.append(f'{table.name}.{column.name}')
+            
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in sorted(table.indexes, key=lambda index: index.name):
+                if index.name not in existing_indexes:
+                    index.create(connection)
+                    added.append(f'{index.name} (index)')
+    
+    if 'novel.scene_count' in added:
+        recount_scenes()
+        db.session.commit()
+    if created & {'scene_choice', 'scene_sprite'} and Scene.query.first() is not None:
+        rebuild_scene_rows()
+        db.session.commit()
+    if created_search:
+        rebuild_search_index()
+        db.session.commit()
+    if 'novel.story_graph' in added:
+        for (novel_id,) in db.session.execute(select(Novel.id)).all():
+            rebuild_story_graph(novel_id)
+        db.session.commit()
+    # Каталог листается курсором по (created_at, id): новеллам без даты
+    # создания (старые базы, строки, вставленные вручную) даем ее из updated_at
+    backfilled = db.session.execute(
+        update(Novel).where(Novel.created_at.is_(None))
+        .values(created_at=func.coalesce(Novel.updated_at, datetime.utcnow()), updated_at=Novel.updated_at)
+    ).rowcount
+    db.session.commit()
+    if backfilled:
+        added.append(f'novel.created_at ({backfilled} без даты)')
+    return added
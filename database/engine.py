@@ -0,0 +1,127 @@
+# database/engine.py - профиль SQLite для одновременной работы авторов и читателей
+import time
+import weakref
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from flask_sqlalchemy.session import Session
+
+# Ключ в SQLALCHEMY_BINDS для движка только для чтения
+READ_ONLY_BIND = 'readonly'
+
+
+def is_sqlite_file(uri):
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:')
+
+
+def read_only_uri(uri):
+    """Тот же файл базы, открытый в режиме mode=ro"""
+    url = make_url(uri)
+    database = url.database
+    if url.query.get('uri'):
+        database = database[len('file:'):].split('?', 1)[0]
+    return f'sqlite:///file:{database}?mode=ro&uri=true'
+
+
+def configure_sqlite(app):
+    """Дополняет конфиг до db.init_app: таймауты, пул и read-only движок.
+
+    Явно заданные SQLALCHEMY_ENGINE_OPTIONS не перезаписываются.
+    """
+    config = app.config
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    if not is_sqlite_file(uri):
+        return
+
+    options = config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+    options.setdefault('pool_size', config['SQLITE_POOL_SIZE'])
+    options.setdefault('max_overflow', config['SQLITE_MAX_OVERFLOW'])
+    options.setdefault('pool_timeout', config['SQLITE_POOL_TIMEOUT'])
+    connect_args = options.setdefault('connect_args', {})
+    # Ожидание блокировки на уровне драйвера вместо мгновенного "database is locked"
+    connect_args.setdefault('timeout', config['SQLITE_BUSY_TIMEOUT'] / 1000)
+    connect_args.setdefault('check_same_thread', False)
+
+    if config['SQLITE_READ_ONLY_ENGINE']:
+        binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+        binds.setdefault(READ_ONLY_BIND, {'url': read_only_uri(uri), **options})
+        config['SQLALCHEMY_BINDS'] = binds
+
+
+def sqlite_pragmas(config, read_only=False):
+    pragmas = dict(config['SQLITE_PRAGMAS'])
+    pragmas.setdefault('busy_timeout', config['SQLITE_BUSY_TIMEOUT'])
+    if read_only:
+        # Режим журнала хранится в файле базы, read-only соединение его не меняет
+        pragmas.pop('journal_mode', None)
+        pragmas['query_only'] = 'ON'
+    return pragmas
+
+
+def install_pragmas(app, db):
+    """Выставляет pragma на каждое новое соединение движков приложения"""
+    with app.app_context():
+        engines = dict(db.engines)
+
+    for key, engine in engines.items():
+        if engine.dialect.name != 'sqlite':
+            continue
+        pragmas = sqlite_pragmas(app.config, read_only=key == READ_ONLY_BIND)
+
+        @event.listens_for(engine, 'connect')
+        def set_sqlite_pragmas(dbapi_connection, connection_record, pragmas=pragmas):
+            cursor = dbapi_connection.cursor()
+            try:
+                for name, value in pragmas.items():
+                    cursor.execute(f'PRAGMA {name}={value}')
+            finally:
+                cursor.close()
+
+
+# Движок -> обработчики on_query_executed
+_query_callbacks = weakref.WeakKeyDictionary()
+
+
+def on_query_executed(engine, callback):
+    """callback(conn, statement, parameters, context, executemany, duration)
+    после каждого выполненного запроса движка.
+
+    Таймер на движок один на всех подписчиков. Начало запроса хранится
+    в контексте выполнения, а не на соединении: запрос, упавший с ошибкой,
+    не оставляет на соединении из пула ничего лишнего.
+    """
+    callbacks = _query_callbacks.get(engine)
+    if callbacks is None:
+        callbacks = _query_callbacks[engine] = []
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+            context._query_started = time.perf_counter()
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+            duration = time.perf_counter() - context._query_started
+            for callback in callbacks:
+                callback(conn, statement, parameters, context, executemany, duration)
+    callbacks.append(callback)
+
+
+class RoutingSession(Session):
+    """Сессия, которая для публичных страниц читает через read-only движок.
+
+    Режим включается через use_read_only(); запись (flush) всегда идет
+    через основной движок.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('read_only') and not self._flushing:
+            engine = self._db.engines.get(READ_ONLY_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def use_read_only(session):
+    """Переключает текущую сессию запроса на read-only движок, если он настроен"""
+    session.info['read_only'] = True
@@ -0,0 +1,72 @@
+# database/graph.py - граф переходов между сценами новеллы
+from collections import deque
+
+GRAPH_VERSION = 1
+
+
+def choice_target(choice):
+    """nextScene из варианта выбора: номер сцены с 1, 0 - конец истории"""
+    if not isinstance(choice, dict):
+        return 0
+    value = choice.get('nextScene', choice.get('next_scene', 0))
+    try:
+        return int(value or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def compile_story_graph(scene_ids, scene_choices):
+    """Строит граф сюжета по сценам в порядке показа.
+
+    scene_ids и scene_choices - списки одинаковой длины: id сцены и ее
+    варианты выбора. Переходы повторяют логику viewer.js: сцена без
+    выборов ведет на следующую, nextScene=0 завершает историю, а ссылка
+    на несуществующую сцену работает как кнопка "Далее".
+    """
+    total = len(scene_ids)
+    edges = []
+    dangling = []
+
+    for position, choices in enumerate(scene_choices):
+        targets = set()
+        choices = [c for c in (choices or []) if isinstance(c, dict)]
+        if not choices:
+            if position + 1 < total:
+                targets.add(position + 1)
+        for index, choice in enumerate(choices):
+            target = choice_target(choice)
+            if target == 0:
+                continue
+            if 1 <= target <= total:
+                targets.add(target - 1)
+            else:
+                dangling.append({'scene': position, 'choice': index, 'target': target})
+                if position + 1 < total:
+                    targets.add(position + 1)
+        edges.append(sorted(targets))
+
+    # Обход в ширину от первой сцены
+    order = []
+    if total:
+        seen = {0}
+        queue = deque([0])
+        while queue:
+            position = queue.popleft()
+            order.append(position)
+            for target in edges[position]:
+                if target not in seen:
+                    seen.add(target)
+                    queue.append(target)
+
+    reachable = set(order)
+    return {
+        'version': GRAPH_VERSION,
+        'total': total,
+        'scene_ids': list(scene_ids),
+        'edges': edges,
+        'order': order,
+        'reachable': sorted(reachable),
+        'orphans': [p for p in range(total) if p not in reachable],
+        'dead_ends': [p for p in range(total) if not edges[p]],
+        'dangling': dangling
+    }
@@ -0,0 +1,73 @@
+# database/search.py - поиск по новеллам и тексту сцен (SQLite FTS5)
+import re
+
+from markupsafe import Markup, escape
+from sqlalchemy import text
+
+from database.db import search_text
+
+WORD_RE = re.compile(r'\w+')
+# Изменяемые окончания русских слов: "королевство" ищем как "королевств"*,
+# чтобы находилось и "королевству" - без полноценного стеммера
+RUSSIAN_ENDING_RE = re.compile(r'(?<=[а-я]{4})[аеийоуыьэюя]$')
+# Не больше стольких слов из запроса - длинная строка не должна стать тяжелым MATCH
+MAX_QUERY_WORDS = 8
+# Маркеры совпадений в snippet(): управляющие символы не встречаются в тексте,
+# поэтому текст можно экранировать целиком и только потом вставить <mark>
+MARK_START, MARK_END = '\x02', '\x03'
+
+# Совпадение в названии весит больше, чем в описании, а то - больше, чем в тексте сцены.
+# Из всех совпадений новеллы берется лучшее (MIN по bm25, меньше - лучше)
+SEARCH_SQL = text("""
+    WITH hits AS (
+        SELECT rowid AS novel_id,
+               bm25(novel_search, 10.0, 4.0) AS rank,
+               snippet(novel_search, -1, :mark_start, :mark_end, '…', 16) AS snippet
+        FROM novel_search WHERE novel_search MATCH :query
+        UNION ALL
+        SELECT novel_id,
+               bm25(scene_search),
+               snippet(scene_search, 0, :mark_start, :mark_end, '…', 16)
+        FROM scene_search WHERE scene_search MATCH :query
+    ), best AS (
+        SELECT novel_id, MIN(rank) AS rank, snippet FROM hits GROUP BY novel_id
+    )
+    SELECT best.novel_id, best.rank, best.snippet
+    FROM best JOIN novel ON novel.id = best.novel_id
+    WHERE novel.is_published = 1
+    ORDER BY best.rank, best.novel_id
+    LIMIT :limit OFFSET :offset
+""")
+
+
+def match_query(query):
+    """Строка пользователя -> выражение FTS5: все слова, каждое как префикс.
+
+    Слова берутся в кавычки, поэтому операторы и скобки FTS5 из запроса
+    не работают и не вызывают синтаксических ошибок. Префикс выручает
+    с окончаниями: "дракон"* находит "драконы" и "дракона".
+    """
+    words = WORD_RE.findall(search_text(query).lower())[:MAX_QUERY_WORDS]
+    return ' '.join(f'"{RUSSIAN_ENDING_RE.sub("", word)}"*' for word in words)
+
+
+def highlight(snippet):
+    """Фрагмент из snippet() в безопасный HTML с <mark>"""
+    html = str(escape(snippet or ''))
+    return Markup(html.replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+def search_novels(session, query, page=1, page_size=20):
+    """Опубликованные новеллы по запросу: ([(novel_id, snippet)], есть_еще)"""
+    expression = match_query(query)
+    if not expression:
+        return [], False
+    rows = session.execute(SEARCH_SQL, {
+        'query': expression,
+        'mark_start': MARK_START,
+        'mark_end': MARK_END,
+        'limit': page_size + 1,
+        'offset': (page - 1) * page_size
+    }).all()
+    hits = [(row.novel_id, highlight(row.snippet)) for row in rows[:page_size]]
+    return hits, len(rows) > page_size
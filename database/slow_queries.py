@@ -0,0 +1,138 @@
+# database/slow_queries.py - журнал медленных SQL-запросов с планом выполнения
+import json
+import logging
+import re
+import sys
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+from flask import has_request_context, request
+
+from database.engine import on_query_executed
+
+# Полный проход по таблице: "SCAN novel", а не "SCAN novel USING INDEX ..."
+FULL_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?(\w+)(?: AS \w+)?$')
+# Планы повторяющихся запросов не перепроверяем
+PLAN_CACHE_SIZE = 256
+
+
+def parameter_rows(parameters, executemany):
+    """Наборы параметров запроса. При insertmanyvalues SQLAlchemy сообщает
+    executemany, но передает один плоский кортеж на весь многострочный INSERT"""
+    parameters = parameters or ()
+    if executemany and parameters and isinstance(parameters[0], (tuple, list, dict)):
+        return list(parameters)
+    return [parameters]
+
+
+def parameters_shape(parameters, executemany):
+    """Типы параметров без значений: в журнал не попадают пароли и тексты"""
+    rows = parameter_rows(parameters, executemany)
+    if len(rows) > 1:
+        return {'rows': len(rows), 'types': parameters_shape(rows[0], False)}
+    parameters = rows[0]
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    return [type(value).__name__ for value in parameters]
+
+
+def full_scans(plan):
+    """Таблицы, которые план читает целиком (проход по CTE и подзапросам не в счет)"""
+    subqueries = {step.split()[-1] for step in plan if step.startswith(('CO-ROUTINE ', 'MATERIALIZE '))}
+    tables = []
+    for step in plan:
+        match = FULL_SCAN_RE.match(step)
+        if match and match.group(1) not in subqueries:
+            tables.append(match.group(1))
+    return tables
+
+
+class SlowQueryLog:
+    """Запросы дольше порога: SQL, форма параметров, время и EXPLAIN QUERY PLAN.
+
+    Последние записи хранятся в памяти (recent), каждая пишется в журнал
+    одной JSON-строкой.
+    """
+
+    def __init__(self, threshold, logger=None, keep=200):
+        self.threshold = threshold
+        self.logger = logger
+        self.recent = deque(maxlen=keep)
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def explain(self, dbapi_connection, statement, parameters, executemany):
+        """План через тот же DBAPI-курсор, мимо событий SQLAlchemy"""
+        plan = self._plans.get(statement)
+        if plan is not None:
+            return plan
+        parameters = parameter_rows(parameters, executemany)[0]
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute(f'EXPLAIN QUERY PLAN {statement}', parameters or ())
+            plan = [row[3] for row in cursor.fetchall()]
+        except Exception as e:
+            return [f'EXPLAIN не выполнен: {e}']
+        finally:
+            cursor.close()
+        with self._lock:
+            if len(self._plans) >= PLAN_CACHE_SIZE:
+                self._plans.clear()
+            self._plans[statement] = plan
+        return plan
+
+    def record(self, connection, statement, parameters, executemany, duration):
+        plan = self.explain(connection.connection.dbapi_connection, statement, parameters, executemany)
+        entry = {
+            'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+            'duration_ms': round(duration * 1000, 2),
+            'endpoint': request.endpoint if has_request_context() else None,
+            'statement': statement,
+            'parameters': parameters_shape(parameters, executemany),
+            'plan': plan,
+            'full_scans': full_scans(plan)
+        }
+        self.recent.append(entry)
+        if self.logger is not None:
+            self.logger.warning(json.dumps(entry, ensure_ascii=False))
+        return entry
+
+
+def slow_query_logger(target):
+    """'-' - stderr, иначе путь к файлу"""
+    logger = logging.getLogger('visual_novel.slow_query')
+    logger.propagate = False
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stderr) if target == '-' else logging.FileHandler(target, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+    return logger
+
+
+def install_slow_query_log(app, db):
+    """Подключает журнал к движкам приложения; выключен, если порог не задан"""
+    threshold_ms = app.config['SLOW_QUERY_THRESHOLD_MS']
+    if threshold_ms is None or threshold_ms < 0:
+        return None
+    target = app.config['SLOW_QUERY_LOG']
+    log = SlowQueryLog(threshold_ms / 1000, slow_query_logger(target) if target else None)
+    app.extensions['slow_query_log'] = log
+
+    with app.app_context():
+        engines = [engine for engine in db.engines.values() if engine.dialect.name == 'sqlite']
+
+    def check_slow_query(conn, statement, parameters, context, executemany, duration):
+        if duration < log.threshold or statement.lstrip().upper().startswith(('PRAGMA', 'EXPLAIN')):
+            return
+        # Журнал не должен ломать сам запрос
+        try:
+            log.record(conn, statement, parameters, executemany, duration)
+        except Exception as e:
+            print(f"❌ Ошибка журнала медленных запросов: {e}")
+
+    # Тот же таймер, что у счетчиков metrics.py
+    for engine in engines:
+        on_query_executed(engine, check_slow_query)
+
+    return log
@@ -0,0 +1,239 @@
+# generate_corpus.py - синтетический корпус для нагрузочных замеров
+#
+# Запуск (база и хранилище - отдельные от рабочих):
+#   python generate_corpus.py --users 200 --novels 1000 --scenes 30 --payload asset
+#   python generate_corpus.py --preset small        # быстрый корпус для проверки
+#
+# Пароль всех пользователей - bench, email - user<N>@bench.local.
+# Корпус создается заново: файл базы удаляется, хранилище изображений - нет.
+import argparse
+import base64
+import math
+import os
+import random
+import struct
+import sys
+import time
+import zlib
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DIR = os.path.join(BASE_DIR, 'bench')
+BENCH_PASSWORD = 'bench'
+
+PRESETS = {
+    'small': {'users': 20, 'novels': 50, 'scenes': 10},
+    'medium': {'users': 200, 'novels': 1000, 'scenes': 30},
+    'large': {'users': 2000, 'novels': 10000, 'scenes': 40}
+}
+
+WORDS = (
+    'лес тропа дракон замок рыцарь принцесса туман река мост деревня старик ведьма '
+    'меч тайна письмо ключ дверь башня ночь утро костер волк ворон сказка путь '
+    'герой город рынок корабль море остров буря пещера сокровище карта друг враг'
+).split()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Генератор синтетического корпуса новелл')
+    parser.add_argument('--preset', choices=sorted(PRESETS), help='готовый размер корпуса')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--novels', type=int, default=500)
+    parser.add_argument('--scenes', type=int, default=20, help='медиана числа сцен в новелле')
+    parser.add_argument('--scenes-spread', type=float, default=0.6,
+                        help='разброс числа сцен (сигма логнормального распределения)')
+    parser.add_argument('--max-scenes', type=int, default=300)
+    parser.add_argument('--branching', type=float, default=0.3, help='доля сцен с выборами')
+    parser.add_argument('--max-choices', type=int, default=4)
+    parser.add_argument('--sprites', type=float, default=1.5, help='среднее число спрайтов на сцену')
+    parser.add_argument('--text-words', type=int, default=80, help='среднее число слов в тексте сцены')
+    parser.add_argument('--payload', choices=('none', 'asset', 'base64'), default='asset',
+                        help='картинки: нет, ссылки на хранилище или встроенный base64 (старый формат)')
+    parser.add_argument('--payload-kb', type=int, default=60, help='размер одной картинки')
+    parser.add_argument('--images', type=int, default=40, help='сколько разных картинок в хранилище')
+    parser.add_argument('--published', type=float, default=0.8, help='доля опубликованных новелл')
+    parser.add_argument('--variants', action='store_true', help='строить уменьшенные копии изображений')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--dir', default=DEFAULT_DIR, help='куда положить базу и изображения')
+    args = parser.parse_args(argv)
+    if args.preset:
+        for key, value in PRESETS[args.preset].items():
+            setattr(args, key, value)
+    return args
+
+
+def configure_environment(directory, variants=False):
+    """Отдельная база и хранилище: задаются до импорта app"""
+    os.makedirs(directory, exist_ok=True)
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(os.path.abspath(directory), 'corpus.db')}"
+    os.environ['ASSET_DIR'] = os.path.join(directory, 'assets')
+    os.environ['BUNDLE_DIR'] = os.path.join(directory, 'bundles')
+    os.environ.setdefault('ACCESS_LOG', '')
+    os.environ.setdefault('SLOW_QUERY_THRESHOLD_MS', '-1')
+    if not variants:
+        os.environ['IMAGE_WORKERS'] = '0'
+
+
+def noise_png(size_kb, rng):
+    """PNG из шума: почти не сжимается, поэтому размер файла близок к заданному"""
+    side = max(4, int(math.sqrt(size_kb * 1024 / 3)))
+    rows = b''.join(b'\x00' + rng.randbytes(side * 3) for _ in range(side))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', side, side, 8, 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + chunk(b'IDAT', zlib.compress(rows, 1)) + chunk(b'IEND', b'')
+
+
+def sentence(rng, words):
+    text = ' '.join(rng.choice(WORDS) for _ in range(max(1, words)))
+    return text[:1].upper() + text[1:] + '.'
+
+
+def scene_count(rng, args):
+    count = round(rng.lognormvariate(math.log(args.scenes), args.scenes_spread))
+    return min(max(count, 1), args.max_scenes)
+
+
+def scene_choices(rng, position, total, args):
+    """Выборы ведут в основном вперед; 0 - конец истории"""
+    if rng.random() >= args.branching or total < 2:
+        return []
+    choices = []
+    for i in range(rng.randint(2, max(2, args.max_choices))):
+        if rng.random() < 0.1:
+            target = 0
+        else:
+            target = min(total, position + 1 + int(rng.expovariate(0.3))) + 1
+            target = min(target, total)
+        choices.append({'text': sentence(rng, 3), 'nextScene': target})
+    return choices
+
+
+def scene_sprites(rng, images, args):
+    count = min(int(rng.expovariate(1 / args.sprites)) if args.sprites > 0 else 0, 6)
+    return [{
+        'id': f'sprite_{i}',
+        'name': rng.choice(WORDS).capitalize(),
+        'url': rng.choice(images) if images else '',
+        'x': rng.randint(0, 600), 'y': rng.randint(0, 300),
+        'width': rng.choice((120, 150, 180)), 'height': rng.choice((160, 200, 240)),
+        'rotation': 0, 'zIndex': i + 1,
+        'isOnCanvas': True
+    } for i in range(count)]
+
+
+def populate(args, rng, offset=0):
+    """Добавляет пользователей, изображения, новеллы и сцены в текущую базу
+    (нужен контекст приложения). offset - номер первого пользователя и новеллы,
+    чтобы дописывать корпус повторными вызовами. Возвращает число сцен."""
+    from sqlalchemy import insert, select
+    from app import db
+    from assets import asset_ref, store_asset
+    from database.db import (User, Novel, Scene, dump_choices, dump_sprites, rebuild_scene_rows,
+                             rebuild_search_index, rebuild_story_graph, recount_scenes)
+    import io
+
+    now = datetime.utcnow()
+    emails = [f'user{offset + i}@bench.local' for i in range(args.users)]
+    print(f"👤 Пользователи: {args.users}")
+    db.session.execute(insert(User), [{
+        'email': email,
+        'password': BENCH_PASSWORD,
+        'nickname': f'Автор {offset + i}',
+        'created_at': now - timedelta(days=rng.randint(0, 900))
+    } for i, email in enumerate(emails)])
+    user_ids = [row[0] for row in db.session.execute(select(User.id).where(User.email.in_(emails)))]
+
+    images = []
+    if args.payload == 'asset':
+        print(f"🖼️ Изображения в хранилище: {args.images} по ~{args.payload_kb} KB")
+        for _ in range(args.images):
+            asset = store_asset(io.BytesIO(noise_png(args.payload_kb, rng)), rng.choice(user_ids))
+            images.append(asset_ref(asset.id))
+    elif args.payload == 'base64':
+        print(f"🖼️ Встроенные base64 изображения: {args.images} вариантов по ~{args.payload_kb} KB")
+        images = ['data:image/png;base64,' + base64.b64encode(noise_png(args.payload_kb, rng)).decode()
+                  for _ in range(args.images)]
+    db.session.commit()
+
+    print(f"📚 Новеллы: {args.novels}")
+    total_scenes = 0
+    batch = []
+    novel_ids = []
+    for i in range(args.novels):
+        created_at = now - timedelta(minutes=rng.randint(0, 60 * 24 * 365))
+        novel_id = db.session.execute(insert(Novel).values(
+            title=f'{sentence(rng, 3)[:-1]} #{offset + i}',
+            description=sentence(rng, 20),
+            cover_image=rng.choice(images) if images and rng.random() < 0.7 else '',
+            is_published=rng.random() < args.published,
+            author_id=rng.choice(user_ids),
+            created_at=created_at,
+            updated_at=created_at
+        )).inserted_primary_key[0]
+        novel_ids.append(novel_id)
+
+        count = scene_count(rng, args)
+        total_scenes += count
+        for position in range(count):
+            batch.append({
+                'novel_id': novel_id,
+                'name': f'Сцена {position + 1}',
+                'background': rng.choice(images) if images and rng.random() < 0.8 else '',
+                'text': ' '.join(sentence(rng, rng.randint(5, 15))
+                                 for _ in range(max(1, args.text_words // 10))),
+                'order': position,
+                'choices': dump_choices(scene_choices(rng, position, count, args)),
+                'sprites': dump_sprites(scene_sprites(rng, images, args))
+            })
+        if len(batch) >= 2000:
+            db.session.execute(insert(Scene), batch)
+            batch = []
+        if (i + 1) % 500 == 0:
+            db.session.commit()
+            print(f"   ... {i + 1} новелл, {total_scenes} сцен")
+    if batch:
+        db.session.execute(insert(Scene), batch)
+    db.session.commit()
+
+    # Сцены вставлены мимо ORM - производные данные собираем одним проходом
+    print("🔄 Счетчики сцен, выборы и спрайты, поиск, графы сюжета...")
+    recount_scenes()
+    rebuild_scene_rows()
+    rebuild_search_index()
+    for novel_id in novel_ids:
+        rebuild_story_graph(novel_id)
+    db.session.commit()
+    return total_scenes
+
+
+def generate(args):
+    configure_environment(args.dir, args.variants)
+    database_path = os.path.join(args.dir, 'corpus.db')
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(database_path + suffix):
+            os.remove(database_path + suffix)
+
+    from app import app, init_database
+
+    started = time.perf_counter()
+    with app.app_context():
+        init_database()
+        total_scenes = populate(args, random.Random(args.seed))
+
+    size_mb = os.path.getsize(database_path) / 1024 / 1024
+    print(f"\n📊 Результаты:")
+    print(f"   Пользователей: {args.users}")
+    print(f"   Новелл: {args.novels}")
+    print(f"   Сцен: {total_scenes}")
+    print(f"   База: {database_path} ({size_mb:.1f} MB)")
+    print(f"   Время: {time.perf_counter() - started:.1f} с")
+    return database_path
+
+
+if __name__ == '__main__':
+    generate(parse_args())
@@ -0,0 +1,215 @@
+# image_pipeline.py - уменьшенные копии изображений в современных форматах
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+
+# Форматы в порядке предпочтения при выборе по заголовку Accept
+FORMAT_MIME_TYPES = {
+    'avif': 'image/avif',
+    'webp': 'image/webp',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png'
+}
+# Анимированные GIF не пережимаем - отдаем оригинал
+RESIZABLE_MIME_TYPES = {'image/png', 'image/jpeg', 'image/webp', 'image/avif'}
+
+
+def supported_formats():
+    """Форматы, которые умеет кодировать установленный Pillow"""
+    try:
+        from PIL import features
+    except ImportError:
+        return []
+    formats = [name for name in ('avif', 'webp') if features.check(name)]
+    return formats + ['jpeg', 'png']
+
+
+def worker_context():
+    """Рабочие процессы не форкаем от многопоточного процесса waitress:
+    forkserver, где его нет (Windows) - spawn"""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def build_variants(source_path, target_prefix, variants, formats, quality):
+    """Создает файлы <prefix>.<variant>.<format> и манифест <prefix>.variants.json.
+
+    Выполняется в отдельном процессе, поэтому работает только с путями и
+    возвращает манифест как словарь.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(source_path) as original:
+        original = ImageOps.exif_transpose(original)
+        has_alpha = original.mode in ('RGBA', 'LA') or 'transparency' in original.info
+        image = original.convert('RGBA' if has_alpha else 'RGB')
+
+    # Без прозрачности запасной формат - JPEG, с прозрачностью - PNG
+    fallback = 'png' if has_alpha else 'jpeg'
+    formats = [f for f in formats if f not in ('jpeg', 'png')] + [fallback]
+
+    manifest = {'width': image.width, 'height': image.height, 'variants': {}}
+    built_widths = set()
+    for name, (max_width, max_height) in sorted(variants.items(), key=lambda item: item[1][0]):
+        copy = image.copy()
+        copy.thumbnail((max_width, max_height), Image.LANCZOS)
+        # Вариант размером с уже готовый (маленький оригинал) не дублируем
+        if copy.width in built_widths:
+            continue
+        built_widths.add(copy.width)
+
+        files = {}
+        for image_format in formats:
+            path = f'{target_prefix}.{name}.{image_format}'
+            options = {'quality': quality} if image_format != 'png' else {'optimize': True}
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'wb') as tmp:
+                    copy.save(tmp, format=image_format.upper(), **options)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            files[image_format] = os.path.getsize(path)
+        manifest['variants'][name] = {'width': copy.width, 'height': copy.height, 'files': files}
+
+    manifest_path = f'{target_prefix}.variants.json'
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return manifest
+
+
+class ImagePipeline:
+    """Очередь обработки изображений в пуле процессов.
+
+    Запрос загрузки только ставит задачу; пока варианты не готовы,
+    страницы ссылаются на оригинал. on_ready(asset_id) вызывается, когда
+    варианты построены, - из потока пула, без контекста приложения.
+    """
+
+    def __init__(self, store, variants, quality=80, workers=2):
+        self.store = store
+        self.variants = variants
+        self.quality = quality
+        self.workers = workers
+        self.formats = supported_formats()
+        self.on_ready = None
+        self._executor = None
+        self._pending = {}
+        self._manifests = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.formats) and self.workers > 0
+
+    def prefix_for(self, asset_id):
+        return self.store.path_for(asset_id)
+
+    def submit(self, asset_id):
+        """Ставит изображение в очередь, если варианты еще не построены.
+
+        Ошибки пайплайна не мешают загрузке: оригинал уже сохранен, без
+        вариантов страницы просто ссылаются на него. Возвращает future или None.
+        """
+        if not self.enabled or self.manifest(asset_id) is not None:
+            return None
+        try:
+            with self._lock:
+                if asset_id in self._pending:
+                    return self._pending[asset_id]
+                future = self._submit_locked(asset_id)
+                self._pending[asset_id] = future
+        except Exception as e:
+            print(f"❌ Изображение {asset_id} не поставлено в обработку: {e}")
+            return None
+        future.add_done_callback(lambda f: self._finish(asset_id, f))
+        return future
+
+    def _submit_locked(self, asset_id):
+        args = (build_variants, self.store.path_for(asset_id), self.prefix_for(asset_id),
+                self.variants, self.formats, self.quality)
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=worker_context())
+        try:
+            return self._executor.submit(*args)
+        except BrokenProcessPool:
+            # Рабочий процесс умер (нехватка памяти, падение на файле) - пул
+            # после этого не принимает задач, заменяем его новым
+            print("⚠️ Пул обработки изображений сломан, создаю новый")
+            self._executor.shutdown(wait=False)
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=worker_context())
+            return self._executor.submit(*args)
+
+    def _finish(self, asset_id, future):
+        with self._lock:
+            self._pending.pop(asset_id, None)
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is None:
+                self._manifests[asset_id] = future.result()
+        if error is not None:
+            print(f"❌ Ошибка обработки изображения {asset_id}: {error}")
+        elif self.on_ready is not None:
+            self.on_ready(asset_id)
+
+    def manifest(self, asset_id):
+        """Описание готовых вариантов или None"""
+        manifest = self._manifests.get(asset_id)
+        if manifest is None:
+            try:
+                with open(f'{self.prefix_for(asset_id)}.variants.json') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                return None
+            self._manifests[asset_id] = manifest
+        return manifest
+
+    def variant_file(self, asset_id, variant, accept_mimetypes):
+        """Путь и mime type варианта в лучшем формате, который принимает браузер"""
+        manifest = self.manifest(asset_id)
+        info = manifest and manifest['variants'].get(variant)
+        if not info:
+            return None
+        for image_format, mime_type in FORMAT_MIME_TYPES.items():
+            if image_format in info['files'] and (
+                    image_format in ('jpeg', 'png') or accept_mimetypes[mime_type]):
+                return f'{self.prefix_for(asset_id)}.{variant}.{image_format}', mime_type
+        return None
+
+    def srcset(self, asset_id):
+        """Строка для атрибута srcset: по одному URL на каждую ширину"""
+        manifest = self.manifest(asset_id)
+        if not manifest:
+            return ''
+        variants = sorted(manifest['variants'].items(), key=lambda item: item[1]['width'])
+        return ', '.join(f'/assets/{asset_id}/{name} {info["width"]}w' for name, info in variants)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+def get_image_pipeline():
+    """Пайплайн текущего приложения (создается один раз)"""
+    pipeline = current_app.extensions.get('image_pipeline')
+    if pipeline is None:
+        from assets import get_asset_store
+
+        config = current_app.config
+        pipeline = ImagePipeline(
+            get_asset_store(), config['IMAGE_VARIANTS'],
+            quality=config['IMAGE_QUALITY'], workers=config['IMAGE_WORKERS']
+        )
+        current_app.extensions['image_pipeline'] = pipeline
+    return pipeline
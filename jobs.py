@@ -0,0 +1,60 @@
+# jobs.py - фоновые задачи внутри процесса сервера
+import queue
+import threading
+import traceback
+
+
+class JobQueue:
+    """Очередь задач с одним рабочим потоком.
+
+    Задача с тем же ключом, еще ждущая в очереди, повторно не ставится:
+    десять сохранений подряд дают одну пересборку. Каждая задача
+    выполняется в контексте приложения.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def enqueue(self, key, func, *args):
+        with self._lock:
+            if key in self._pending:
+                return False
+            self._pending.add(key)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name='jobs', daemon=True)
+                self._thread.start()
+        self._queue.put((key, func, args))
+        return True
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            key, func, args = item
+            with self._lock:
+                self._pending.discard(key)
+            try:
+                with self.app.app_context():
+                    func(*args)
+            except Exception as e:
+                print(f"❌ Ошибка фоновой задачи {key}: {e}")
+                traceback.print_exc()
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        """Ждет выполнения всех поставленных задач"""
+        self._queue.join()
+
+    def shutdown(self):
+        """Выполняет оставшиеся задачи и останавливает поток"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,389 @@
+# load_test.py - нагрузочный прогон: читатели и авторы одновременно
+#
+# Сначала корпус:  python generate_corpus.py --preset medium
+# Прогон:          python load_test.py --readers 200 --authors 10 --duration 60
+# Свой сервер:     python load_test.py --url http://127.0.0.1:5000 (база - из --dir)
+#
+# Без --url поднимает run.py (waitress) на свободном порту с базой корпуса
+# и останавливает его в конце. Только стандартная библиотека: http.client
+# с keep-alive, по потоку на виртуального пользователя.
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from benchmark import percentile
+from generate_corpus import BENCH_PASSWORD, DEFAULT_DIR, WORDS, configure_environment
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+# Признаки блокировки SQLite в ответе или в выводе сервера
+LOCK_MARKERS = (b'database is locked', b'database table is locked', b'SQLITE_BUSY')
+# Сколько ждать, пока сервер начнет отвечать
+SERVER_START_TIMEOUT = 30
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Нагрузочный прогон: читатели и авторы')
+    parser.add_argument('--dir', default=DEFAULT_DIR, help='каталог корпуса (generate_corpus.py --dir)')
+    parser.add_argument('--url', help='адрес уже запущенного сервера; без него run.py поднимается сам')
+    parser.add_argument('--threads', type=int, help='потоков waitress (по умолчанию SERVER_THREADS)')
+    parser.add_argument('--readers', type=int, default=50, help='анонимных читателей')
+    parser.add_argument('--authors', type=int, default=5, help='авторов, сохраняющих новеллы')
+    parser.add_argument('--duration', type=float, default=30, help='длительность прогона, с')
+    parser.add_argument('--ramp', type=float, default=5, help='за сколько секунд запустить всех пользователей')
+    parser.add_argument('--think', type=float, default=1.0,
+                        help='средняя пауза между действиями пользователя, с (0 - без пауз)')
+    parser.add_argument('--timeout', type=float, default=30, help='таймаут одного запроса, с')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', dest='json_path', help='сохранить результаты в файл')
+    return parser.parse_args(argv)
+
+
+class Sample:
+    __slots__ = ('endpoint', 'latency', 'status', 'ok', 'locked')
+
+    def __init__(self, endpoint, latency, status, ok, locked):
+        self.endpoint = endpoint
+        self.latency = latency
+        self.status = status
+        self.ok = ok
+        self.locked = locked
+
+
+class Client:
+    """Соединение keep-alive с cookie сессии Flask"""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.cookies = SimpleCookie()
+        self.connection = None
+
+    def request(self, method, path, body=None, headers=None):
+        """(статус, заголовки, тело)"""
+        headers = dict(headers or {})
+        if self.cookies:
+            headers['Cookie'] = '; '.join(f'{key}={morsel.value}' for key, morsel in self.cookies.items())
+        while True:
+            # Повтор - только если сервер закрыл уже использованное keep-alive соединение
+            reused = self.connection is not None
+            if not reused:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, ConnectionError):
+                self.close()
+                if reused:
+                    continue
+                raise
+            for header in response.headers.get_all('Set-Cookie') or []:
+                self.cookies.load(header)
+            if response.will_close:
+                self.close()
+            return response.status, response.headers, data
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+class VirtualUser(threading.Thread):
+    """Поток одного пользователя: сценарий повторяется до конца прогона"""
+
+    def __init__(self, run, index):
+        super().__init__(name=f'{self.kind}-{index}', daemon=True)
+        self.run_state = run
+        self.rng = random.Random(run.args.seed * 100003 + index)
+        self.client = Client(run.host, run.port, run.args.timeout)
+        self.samples = []
+
+    def call(self, endpoint, method, path, expect=200, body=None, headers=None, check_json=False):
+        started = time.perf_counter()
+        try:
+            status, _, data = self.client.request(method, path, body, headers)
+        except (OSError, http.client.HTTPException):
+            self.samples.append(Sample(endpoint, time.perf_counter() - started, 0, False, False))
+            return None
+        latency = time.perf_counter() - started
+        ok = status == expect
+        payload = None
+        if ok and check_json:
+            # Ошибки сохранения приходят как 200 с success: false
+            try:
+                payload = json.loads(data)
+                ok = payload.get('success', True) is not False
+            except ValueError:
+                ok = False
+        locked = any(marker in data for marker in LOCK_MARKERS)
+        self.samples.append(Sample(endpoint, latency, status, ok, locked))
+        return payload if check_json else (data if ok else None)
+
+    def think(self):
+        if self.run_state.args.think > 0:
+            self.run_state.stop.wait(self.rng.expovariate(1 / self.run_state.args.think))
+
+    def run(self):
+        self.run_state.stop.wait(self.rng.uniform(0, self.run_state.args.ramp))
+        try:
+            self.prepare()
+            while not self.run_state.stop.is_set():
+                self.scenario()
+        except Exception as e:
+            print(f"❌ {self.name}: {e}")
+        finally:
+            self.client.close()
+
+    def prepare(self):
+        pass
+
+
+class Reader(VirtualUser):
+    """Анонимный читатель: каталог, страница новеллы, сцены порциями, иногда поиск"""
+
+    kind = 'reader'
+
+    def scenario(self):
+        run = self.run_state
+        self.call('index', 'GET', '/')
+        self.think()
+        if self.rng.random() < 0.1:
+            self.call('search', 'GET', '/search?' + urlencode({'q': self.rng.choice(WORDS)}))
+            self.think()
+        novel_id, total = self.rng.choice(run.published)
+        self.call('view_novel', 'GET', f'/view/{novel_id}')
+        position = 1
+        for _ in range(self.rng.randint(1, 4)):
+            if run.stop.is_set() or position >= total:
+                break
+            self.think()
+            positions = ','.join(str(p) for p in range(position, min(total, position + 4)))
+            self.call('read_scenes', 'GET', f'/api/read/{novel_id}/scenes?positions={positions}')
+            position += 4
+
+
+class Author(VirtualUser):
+    """Автор: список своих новелл, открыть в конструкторе, сохранить целиком
+    или правкой одной сцены (автосохранение)"""
+
+    kind = 'author'
+
+    def prepare(self):
+        self.email, self.novels = self.rng.choice(self.run_state.authors)
+        self.saves = 0
+        body = urlencode({'email': self.email, 'password': BENCH_PASSWORD})
+        self.call('login', 'POST', '/login', expect=302, body=body,
+                  headers={'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def scenario(self):
+        self.call('my_novels', 'GET', '/my_novels')
+        self.think()
+        novel_id = self.rng.choice(self.novels)
+        data = self.call('get_novel_data', 'GET', f'/api/novel/{novel_id}')
+        if data is None:
+            return
+        novel = json.loads(data)
+        if not novel['scenes']:
+            return
+        for _ in range(self.rng.randint(1, 3)):
+            if self.run_state.stop.is_set():
+                break
+            self.think()
+            self.saves += 1
+            scene = self.rng.choice(novel['scenes'])
+            scene['text'] = f"{scene['text'].split(' [правка')[0]} [правка {self.saves}]"
+            if self.rng.random() < 0.5:
+                self.call('save_novel', 'POST', f'/api/save_novel/{novel_id}', check_json=True,
+                          body=json.dumps(novel), headers={'Content-Type': 'application/json'})
+            else:
+                operations = [{'op': 'update', 'id': scene['id'], 'data': {'text': scene['text']}}]
+                self.call('batch_scene_operations', 'POST', f'/api/novel/{novel_id}/batch', check_json=True,
+                          body=json.dumps({'operations': operations}), headers={'Content-Type': 'application/json'})
+
+
+class LoadRun:
+    def __init__(self, args, host, port, published, authors):
+        self.args = args
+        self.host = host
+        self.port = port
+        self.published = published
+        self.authors = authors
+        self.stop = threading.Event()
+
+
+def corpus_targets(database_path):
+    """Опубликованные новеллы (id, число сцен) и авторы корпуса со своими новеллами"""
+    connection = sqlite3.connect(f'file:{database_path}?mode=ro', uri=True)
+    try:
+        published = connection.execute(
+            'SELECT id, scene_count FROM novel WHERE is_published = 1 AND scene_count > 0').fetchall()
+        authors = {}
+        for email, novel_id in connection.execute(
+                "SELECT user.email, novel.id FROM novel JOIN user ON user.id = novel.author_id "
+                "WHERE user.email LIKE '%@bench.local' ORDER BY novel.id"):
+            authors.setdefault(email, []).append(novel_id)
+    finally:
+        connection.close()
+    return published, sorted(authors.items())
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(args, log_path):
+    """run.py в отдельном процессе с базой корпуса; ждет первого ответа"""
+    port = free_port()
+    env = dict(os.environ)
+    command = [sys.executable, os.path.join(BASE_DIR, 'run.py'), '--host', '127.0.0.1', '--port', str(port)]
+    if args.threads:
+        command += ['--threads', str(args.threads)]
+    log = open(log_path, 'wb')
+    process = subprocess.Popen(command, cwd=BASE_DIR, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'❌ Сервер завершился при запуске, см. {log_path}')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return process, port
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise SystemExit(f'❌ Сервер не ответил за {SERVER_START_TIMEOUT} с, см. {log_path}')
+
+
+def stop_server(process):
+    # SIGTERM - run.py дожидается текущих запросов и дописывает прогресс
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def summarize(samples, duration):
+    endpoints = {}
+    for sample in samples:
+        endpoints.setdefault(sample.endpoint, []).append(sample)
+
+    def row(items):
+        latencies = [s.latency for s in items]
+        errors = sum(not s.ok for s in items)
+        return {
+            'requests': len(items),
+            'rps': round(len(items) / duration, 1),
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 1),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 1),
+            'p99_ms': round(percentile(latencies, 0.99) * 1000, 1),
+            'max_ms': round(max(latencies) * 1000, 1),
+            'errors': errors,
+            'error_rate': round(errors / len(items) * 100, 2),
+            'locked': sum(s.locked for s in items),
+            'statuses': {str(status): sum(s.status == status for s in items)
+                         for status in sorted({s.status for s in items})}
+        }
+
+    results = {name: row(items) for name, items in sorted(endpoints.items())}
+    if samples:
+        results['total'] = row(samples)
+    return results
+
+
+def print_results(results, server_locks):
+    print(f"\n📊 Результаты:")
+    print(f"   {'endpoint':<24}{'запросов':>9}{'rps':>8}{'p50 мс':>9}{'p95 мс':>9}{'p99 мс':>9}"
+          f"{'max мс':>9}{'ошибки':>8}{'%':>7}{'locked':>8}")
+    for name, row in results.items():
+        if name == 'total':
+            print('   ' + '-' * 98)
+        print(f"   {name:<24}{row['requests']:>9}{row['rps']:>8}{row['p50_ms']:>9}{row['p95_ms']:>9}"
+              f"{row['p99_ms']:>9}{row['max_ms']:>9}{row['errors']:>8}{row['error_rate']:>7}{row['locked']:>8}")
+    if server_locks is not None:
+        print(f"\n🔒 Сообщений о блокировке SQLite в выводе сервера: {server_locks}")
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    database_path = os.path.join(args.dir, 'corpus.db')
+    if not os.path.exists(database_path):
+        raise SystemExit(f'❌ Корпус не найден в {args.dir}: сначала python generate_corpus.py')
+    published, authors = corpus_targets(database_path)
+    if not published or (args.authors and not authors):
+        raise SystemExit('❌ В корпусе нет опубликованных новелл или авторов')
+
+    process = None
+    log_path = os.path.join(args.dir, 'load_test_server.log')
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        configure_environment(args.dir)
+        process, port = start_server(args, log_path)
+        host = '127.0.0.1'
+        print(f"🚀 Сервер: http://{host}:{port} (вывод - {log_path})")
+
+    run = LoadRun(args, host, port, published, authors)
+    users = [Reader(run, i) for i in range(args.readers)] + \
+            [Author(run, args.readers + i) for i in range(args.authors)]
+    print(f"👥 Читателей: {args.readers}, авторов: {args.authors}, "
+          f"пауза ~{args.think} с, прогон {args.duration:g} с")
+
+    started = time.perf_counter()
+    try:
+        for user in users:
+            user.start()
+        run.stop.wait(args.duration)
+    except KeyboardInterrupt:
+        print("\n⏹ Прерываю прогон...")
+    finally:
+        run.stop.set()
+        for user in users:
+            user.join(args.timeout + 1)
+        duration = time.perf_counter() - started
+        if process is not None:
+            stop_server(process)
+
+    samples = [sample for user in users for sample in user.samples]
+    results = summarize(samples, duration)
+    server_locks = None
+    if process is not None:
+        with open(log_path, 'rb') as f:
+            server_log = f.read()
+        server_locks = sum(server_log.count(marker) for marker in LOCK_MARKERS)
+    print_results(results, server_locks)
+
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'readers': args.readers,
+                'authors': args.authors,
+                'think': args.think,
+                'duration': round(duration, 1),
+                'endpoints': results,
+                'server_locks': server_locks
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n💾 Сохранено: {args.json_path}")
+
+    total = results.get('total')
+    return 1 if total is None or total['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+# metrics.py - метрики запросов: /metrics для Prometheus и журнал доступа
+import hmac
+import json
+import logging
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask import Response, abort, g, has_request_context, request
+
+from database.engine import on_query_executed
+
+# Границы корзин гистограмм
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestMetrics:
+    """Счетчики и гистограммы по (endpoint, method) в памяти процесса.
+
+    waitress обслуживает все запросы одним процессом, поэтому общего
+    словаря под блокировкой достаточно.
+    """
+
+    # имя -> (тип, описание, границы корзин или None для счетчика)
+    SERIES = {
+        'http_requests_total': ('counter', 'Число запросов', None),
+        'http_request_duration_seconds': ('histogram', 'Время обработки запроса', DURATION_BUCKETS),
+        'http_request_sql_statements': ('histogram', 'SQL-запросов за один запрос', SQL_COUNT_BUCKETS),
+        'http_request_sql_seconds_total': ('counter', 'Суммарное время SQL-запросов', None),
+        'http_request_bytes': ('histogram', 'Размер тела запроса', BYTES_BUCKETS),
+        'http_response_bytes': ('histogram', 'Размер ответа', BYTES_BUCKETS)
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {name: {} for name in self.SERIES}
+
+    def _add(self, name, labels, value):
+        kind, _, buckets = self.SERIES[name]
+        series = self._series[name]
+        if kind == 'counter':
+            series[labels] = series.get(labels, 0) + value
+        else:
+            if labels not in series:
+                series[labels] = Histogram(buckets)
+            series[labels].observe(value)
+
+    def observe(self, endpoint, method, status, duration, sql_count, sql_time, request_bytes, response_bytes):
+        labels = (('endpoint', endpoint), ('method', method))
+        with self._lock:
+            self._add('http_requests_total', labels + (('status', str(status)),), 1)
+            self._add('http_request_duration_seconds', labels, duration)
+            self._add('http_request_sql_statements', labels, sql_count)
+            self._add('http_request_sql_seconds_total', labels, sql_time)
+            self._add('http_request_bytes', labels, request_bytes)
+            self._add('http_response_bytes', labels, response_bytes)
+
+    def render(self):
+        """Текстовый формат Prometheus"""
+        lines = []
+        with self._lock:
+            for name, (kind, description, _) in self.SERIES.items():
+                lines.append(f'# HELP {name} {description}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in sorted(self._series[name].items()):
+                    if kind == 'counter':
+                        lines.append(f'{name}{format_labels(labels)} {format_value(value)}')
+                        continue
+                    for bound, count in zip(value.buckets, value.counts):
+                        lines.append(f'{name}_bucket{format_labels(labels + (("le", format_value(bound)),))} {count}')
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {value.count}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {format_value(value.sum)}')
+                    lines.append(f'{name}_count{format_labels(labels)} {value.count}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def access_logger(target):
+    """Журнал доступа: одна JSON-строка на запрос. '-' - stdout, иначе путь к файлу"""
+    logger = logging.getLogger('visual_novel.access')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout) if target == '-' else logging.FileHandler(target, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+    return logger
+
+
+def install_sql_counters(app, db):
+    """Считает SQL-запросы и их время для текущего HTTP-запроса (все движки)"""
+    with app.app_context():
+        engines = list(db.engines.values())
+
+    def count_query(conn, statement, parameters, context, executemany, duration):
+        # Фоновые задачи тоже ходят в базу, но к запросу не относятся
+        stats = g.get('request_stats') if has_request_context() else None
+        if stats is not None:
+            stats['sql_count'] += 1
+            stats['sql_time'] += duration
+
+    for engine in engines:
+        on_query_executed(engine, count_query)
+
+
+def init_metrics(app, db):
+    metrics = RequestMetrics()
+    app.extensions['request_metrics'] = metrics
+    install_sql_counters(app, db)
+    log_target = app.config['ACCESS_LOG']
+    logger = access_logger(log_target) if log_target else None
+
+    @app.before_request
+    def start_request_stats():
+        g.request_stats = {'started': time.perf_counter(), 'sql_count': 0, 'sql_time': 0.0}
+
+    @app.after_request
+    def record_request_stats(response):
+        stats = g.pop('request_stats', None)
+        if stats is None:
+            return response
+        duration = time.perf_counter() - stats['started']
+        endpoint = request.endpoint or 'unknown'
+        # Для файлов (send_file) длина известна из заголовка, тело не читаем
+        response_bytes = response.content_length or 0
+        request_bytes = request.content_length or 0
+        metrics.observe(endpoint, request.method, response.status_code, duration,
+                        stats['sql_count'], stats['sql_time'], request_bytes, response_bytes)
+
+        if logger is not None:
+            user = getattr(g, '_login_user', None)
+            logger.info(json.dumps({
+                'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+                'method': request.method,
+                'path': request.path,
+                'endpoint': endpoint,
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 2),
+                'sql_count': stats['sql_count'],
+                'sql_ms': round(stats['sql_time'] * 1000, 2),
+                'request_bytes': request_bytes,
+                'response_bytes': response_bytes,
+                'user_id': user.get_id() if user is not None and user.is_authenticated else None,
+                'remote_addr': request.remote_addr
+            }, ensure_ascii=False))
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        # Без токена метрик нет совсем: маршруты и нагрузка - не для всех
+        token = app.config['METRICS_TOKEN']
+        if not token:
+            abort(404)
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            abort(403)
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    return metrics
@@ -0,0 +1,60 @@
+# migrate_assets.py
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, db
+from database.db import Scene
+from assets import externalize_scene_media, is_data_url
+
+# Рабочие процессы пайплайна изображений (forkserver) импортируют этот модуль заново
+if __name__ == '__main__':
+    print("🔄 Перенос встроенных изображений в хранилище...")
+
+    with app.app_context():
+        db.create_all()
+        try:
+            scene_ids = [row.id for row in db.session.query(Scene.id).order_by(Scene.id)]
+            moved_count = 0
+            error_count = 0
+
+            # Обрабатываем по одной сцене, чтобы не держать в памяти все картинки
+            for scene_id in scene_ids:
+                scene = db.session.get(Scene, scene_id)
+                try:
+                    sprites = scene.sprites_list
+                    has_inline = is_data_url(scene.background) or any(
+                        isinstance(s, dict) and is_data_url(s.get('url')) for s in sprites
+                    )
+                    if not has_inline:
+                        continue
+
+                    owner_id = scene.novel.author_id if scene.novel else None
+                    scene_data = externalize_scene_media({
+                        'background': scene.background,
+                        'sprites': sprites
+                    }, owner_id)
+                    scene.background = scene_data['background']
+                    scene.sprites_list = scene_data['sprites']
+                    db.session.commit()
+                    moved_count += 1
+                    print(f"✅ Scene {scene.id}: изображения перенесены")
+                except Exception as e:
+                    db.session.rollback()
+                    error_count += 1
+                    print(f"❌ Scene {scene_id}: ошибка переноса - {e}")
+                finally:
+                    db.session.expunge_all()
+
+            print(f"\n📊 Результаты:")
+            print(f"   Обработано сцен: {moved_count}")
+            print(f"   Ошибок: {error_count}")
+            print(f"   Всего сцен: {len(scene_ids)}")
+
+        except Exception as e:
+            print(f"❌ Критическая ошибка: {e}")
+            db.session.rollback()
+            import traceback
+            traceback.print_exc()
+
+    print("\n🎯 Перенос завершен!")
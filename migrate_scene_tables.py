@@ -0,0 +1,42 @@
+# migrate_scene_tables.py
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app, db
+from database.db import Novel, SceneChoice, SceneSprite, ensure_schema, rebuild_scene_rows
+
+print("🔄 Заполнение таблиц scene_choice и scene_sprite...")
+
+with app.app_context():
+    ensure_schema()
+    try:
+        novel_ids = [row.id for row in db.session.query(Novel.id).order_by(Novel.id)]
+        scene_count = 0
+        error_count = 0
+
+        # Каждая новелла - отдельная транзакция
+        for novel_id in novel_ids:
+            try:
+                scene_count += rebuild_scene_rows(novel_id)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                error_count += 1
+                print(f"❌ Novel {novel_id}: ошибка - {e}")
+            finally:
+                db.session.expunge_all()
+
+        print(f"\n📊 Результаты:")
+        print(f"   Обработано сцен: {scene_count}")
+        print(f"   Вариантов выбора: {SceneChoice.query.count()}")
+        print(f"   Спрайтов: {SceneSprite.query.count()}")
+        print(f"   Ошибок: {error_count}")
+
+    except Exception as e:
+        print(f"❌ Критическая ошибка: {e}")
+        db.session.rollback()
+        import traceback
+        traceback.print_exc()
+
+print("\n🎯 Миграция завершена!")
@@ -0,0 +1,205 @@
+# progress.py - запись прогресса чтения пачками
+import json
+import threading
+import traceback
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import delete, tuple_
+from sqlalchemy.dialects.sqlite import insert
+
+from database.db import db, ReadingProgress
+
+# Слотов в одном INSERT: 9 колонок на строку, старые SQLite допускают
+# не больше 999 параметров в запросе
+FLUSH_BATCH_SIZE = 100
+# После стольких неудачных записей подряд слот отбрасывается
+FLUSH_MAX_ATTEMPTS = 5
+
+
+def key_matches(key, user_id=None, novel_id=None, slot=None):
+    """Ключ слота (user_id, novel_id, slot) подходит под фильтр; None - любое значение"""
+    return all(value is None or part == value for part, value in zip(key, (user_id, novel_id, slot)))
+
+
+class ProgressBuffer:
+    """Последнее состояние каждого слота в памяти, в базу - раз в interval.
+
+    Читатель листает сцены, и каждый переход не должен становиться
+    отдельной транзакцией единственного писателя SQLite: за интервал
+    от слота остается только последняя запись, а слоты пишутся
+    пачками INSERT ... ON CONFLICT.
+    """
+
+    def __init__(self, app, interval=2.0):
+        self.app = app
+        self.interval = interval
+        self._pending = {}
+        # Неудачные попытки записи слота подряд
+        self._attempts = {}
+        # Фильтры discard() для каждого идущего flush()
+        self._flushing = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = False
+        self._thread = None
+
+    def put(self, user_id, novel_id, slot, scene_position, scene_id=None, history=None, name=''):
+        key = (user_id, novel_id, slot)
+        with self._lock:
+            self._pending[key] = {
+                'user_id': user_id,
+                'novel_id': novel_id,
+                'slot': slot,
+                'name': name or '',
+                'scene_position': scene_position,
+                'scene_id': scene_id,
+                'history': json.dumps(history or []),
+                'updated_at': datetime.utcnow()
+            }
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name='progress', daemon=True)
+                self._thread.start()
+
+    def pending_for(self, user_id, novel_id):
+        """Еще не записанные слоты - чтобы читатель сразу видел свои сохранения"""
+        with self._lock:
+            return {key[2]: dict(row) for key, row in self._pending.items()
+                    if key[0] == user_id and key[1] == novel_id}
+
+    def discard(self, user_id=None, novel_id=None, slot=None):
+        """Забывает несохраненные записи (слот удален или новелла удалена),
+        в том числе те, что flush() уже забрал, но еще не записал"""
+        with self._lock:
+            for discarded in self._flushing:
+                discarded.append((user_id, novel_id, slot))
+            for records in (self._pending, self._attempts):
+                for key in [key for key in records if key_matches(key, user_id, novel_id, slot)]:
+                    del records[key]
+
+    def flush(self):
+        """Записывает накопленное пачками по FLUSH_BATCH_SIZE, возвращает число записанных слотов"""
+        with self._lock:
+            rows, self._pending = list(self._pending.values()), {}
+            # Сюда discard() добавляет фильтры удаленных слотов, пока идет запись
+            discarded = []
+            self._flushing.append(discarded)
+        written = 0
+        try:
+            for start in range(0, len(rows), FLUSH_BATCH_SIZE):
+                batch = rows[start:start + FLUSH_BATCH_SIZE]
+                try:
+                    written += self._write(batch, discarded)
+                except Exception:
+                    db.session.rollback()
+                    # Пачка не прошла - пишем по одной: плохая запись не держит остальные
+                    for row in batch:
+                        try:
+                            written += self._write([row], discarded)
+                        except Exception as e:
+                            db.session.rollback()
+                            self._retry_later(row, e, discarded)
+        finally:
+            with self._lock:
+                self._flushing.remove(discarded)
+        return written
+
+    def _write(self, rows, discarded):
+        with self._lock:
+            rows = [row for row in rows if not self._is_discarded(row, discarded)]
+        if not rows:
+            return 0
+        statement = insert(ReadingProgress).values(
+            [dict(row, created_at=row['updated_at']) for row in rows]
+        )
+        excluded = statement.excluded
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['user_id', 'novel_id', 'slot'],
+            set_={
+                'name': excluded.name,
+                'scene_position': excluded.scene_position,
+                'scene_id': excluded.scene_id,
+                'history': excluded.history,
+                'updated_at': excluded.updated_at
+            }
+        ))
+        # INSERT уже держит блокировку записи: DELETE из delete_progress, начатый
+        # позже, выполнится после нашего commit. Слоты, удаленные раньше, стираем сами
+        with self._lock:
+            gone = [self._key(row) for row in rows if self._is_discarded(row, discarded)]
+        if gone:
+            db.session.execute(delete(ReadingProgress).where(
+                tuple_(ReadingProgress.user_id, ReadingProgress.novel_id, ReadingProgress.slot).in_(gone)
+            ))
+        db.session.commit()
+        with self._lock:
+            for row in rows:
+                self._attempts.pop(self._key(row), None)
+        return len(rows) - len(gone)
+
+    def _retry_later(self, row, error, discarded):
+        """Возвращает запись в буфер, если ее еще не перекрыла новая и слот
+        не удален; после FLUSH_MAX_ATTEMPTS неудач запись отбрасывается"""
+        key = self._key(row)
+        with self._lock:
+            if key in self._pending or self._is_discarded(row, discarded):
+                return
+            attempts = self._attempts.get(key, 0) + 1
+            if attempts < FLUSH_MAX_ATTEMPTS:
+                self._attempts[key] = attempts
+                self._pending[key] = row
+                return
+            self._attempts.pop(key, None)
+        print(f"❌ Прогресс чтения {key} отброшен после {attempts} попыток записи: {error}")
+
+    def _is_discarded(self, row, discarded):
+        key = self._key(row)
+        return any(key_matches(key, *criteria) for criteria in discarded)
+
+    @staticmethod
+    def _key(row):
+        return row['user_id'], row['novel_id'], row['slot']
+
+    def _work(self):
+        while not self._stopping:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                with self.app.app_context():
+                    self.flush()
+            except Exception as e:
+                print(f"❌ Ошибка записи прогресса чтения: {e}")
+                traceback.print_exc()
+
+    def shutdown(self):
+        """Дописывает накопленное и останавливает поток"""
+        self._stopping = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self.app.app_context():
+            self.flush()
+        self._stopping = False
+
+
+def get_progress_buffer():
+    """Буфер прогресса текущего приложения (создается один раз)"""
+    buffer = current_app.extensions.get('progress_buffer')
+    if buffer is None:
+        buffer = ProgressBuffer(current_app._get_current_object(), current_app.config['PROGRESS_FLUSH_INTERVAL'])
+        current_app.extensions['progress_buffer'] = buffer
+    return buffer
+
+
+def delete_progress(user_id=None, novel_id=None, slot=None):
+    """Удаляет слоты из базы и из буфера (commit - за вызывающим)"""
+    get_progress_buffer().discard(user_id, novel_id, slot)
+    statement = delete(ReadingProgress)
+    if user_id is not None:
+        statement = statement.where(ReadingProgress.user_id == user_id)
+    if novel_id is not None:
+        statement = statement.where(ReadingProgress.novel_id == novel_id)
+    if slot is not None:
+        statement = statement.where(ReadingProgress.slot == slot)
+    db.session.execute(statement)
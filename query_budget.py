@@ -0,0 +1,249 @@
+# query_budget.py - проверка числа SQL-запросов на каждый маршрут
+#
+#   python query_budget.py            # код выхода 1, если какой-то маршрут вышел за бюджет
+#   python query_budget.py --verbose  # показать запросы каждого маршрута
+#
+# Корпус создается во временном каталоге дважды: маленький и в несколько раз
+# больше. Число запросов маршрута не должно зависеть от размера корпуса -
+# рост между проходами означает запрос на каждую новеллу или сцену (N+1).
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+from collections import Counter
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from generate_corpus import BENCH_PASSWORD, configure_environment, parse_args as corpus_args
+
+# Бюджет SQL-запросов на один запрос к маршруту. Сюда входит и загрузка
+# текущего пользователя flask_login. Поднимать бюджет - только вместе
+# с объяснением в коммите, почему маршруту понадобился еще запрос.
+QUERY_BUDGETS = {
+    # Каталог и автор каждой карточки - одним запросом; второй - текущий
+    # пользователь, если его нет среди авторов на странице
+    'index': 2,
+    'catalog': 1,
+    'search': 2,
+    'api_search': 2,
+    'login': 1,
+    'profile': 1,
+    'my_novels': 2,
+    'builder': 2,
+    'get_novel_data': 3,
+    # Правка одной сцены: сцена, строки поиска, граф сюжета
+    'save_novel': 10,
+    'batch_scene_operations': 10,
+    # Новелла вместе с автором для шапки читалки и текущий пользователь
+    'view_novel': 2,
+    'view_novel:draft': 2,
+    'read_scenes': 1,
+    'read_scenes:draft': 3,
+    'get_progress': 3,
+    'save_progress': 2,
+    'novel_pack_info': 1
+}
+
+# Маленький корпус и добавка к нему для второго прохода
+SMALL_CORPUS = ['--users', '6', '--novels', '30', '--scenes', '6', '--payload', 'none']
+GROWTH_CORPUS = ['--users', '12', '--novels', '90', '--scenes', '24', '--payload', 'none']
+
+
+class QueryCounter:
+    """SQL-запросы текущего потока, пока счетчик включен.
+
+    Тестовый клиент Flask обрабатывает запрос в вызывающем потоке,
+    поэтому фоновые задачи (бандлы, прогресс) в подсчет не попадают.
+    """
+
+    def __init__(self):
+        self.statements = None
+        self._thread = None
+
+    def install(self, engines):
+        from sqlalchemy import event
+
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if self.statements is not None and threading.get_ident() == self._thread:
+            self.statements.append(' '.join(statement.split()))
+
+    def __enter__(self):
+        self.statements = []
+        self._thread = threading.get_ident()
+        return self
+
+    def __exit__(self, *exc):
+        self.captured, self.statements = self.statements, None
+        return False
+
+
+class Fixture:
+    """Новеллы корпуса для проверок: чужая опубликованная, свои опубликованная и черновик"""
+
+    def __init__(self, app, client, rng):
+        from sqlalchemy import func, select, update
+        from database.db import db, User, Novel, Scene
+        from reader_bundle import build_novel_bundle
+
+        self.client = client
+        with app.app_context():
+            author_id, self.email = db.session.execute(
+                select(User.id, User.email).join(Novel, Novel.author_id == User.id)
+                .where(User.email.like('%@bench.local'))
+                .group_by(User.id).order_by(func.count(Novel.id).desc()).limit(1)
+            ).one()
+            own = [row[0] for row in db.session.execute(
+                select(Novel.id).where(Novel.author_id == author_id).order_by(Novel.id))]
+            # У автора нужен и черновик - читалка для него идет мимо бандла
+            self.draft_id = own[-1]
+            db.session.execute(update(Novel).where(Novel.id == self.draft_id)
+                               .values(is_published=False, updated_at=Novel.updated_at))
+            db.session.commit()
+            self.own_id = rng.choice(own)
+            self.scene_id = db.session.scalar(select(Scene.id).where(Scene.novel_id == self.own_id).limit(1))
+            published = [row[0] for row in db.session.execute(
+                select(Novel.id).where(Novel.is_published == True, Novel.author_id != author_id))]
+            self.published_id = rng.choice(published)
+            # Опубликованные читаются из готового бандла, как на работающем сервере
+            build_novel_bundle(self.published_id)
+            db.session.commit()
+
+    def login(self):
+        response = self.client.post('/login', data={'email': self.email, 'password': BENCH_PASSWORD})
+        if response.status_code != 302:
+            raise SystemExit(f'❌ Не удалось войти как {self.email}')
+
+    def saved_novel(self):
+        data = self.client.get(f'/api/novel/{self.own_id}').get_json()
+        data['scenes'][0]['text'] += ' (правка)'
+        return data
+
+
+# Проверка -> запрос к приложению. Данные для запроса (например, текущая
+# новелла для save_novel) готовятся до включения счетчика
+CHECKS = {
+    'index': lambda f: lambda: f.client.get('/'),
+    'catalog': lambda f: lambda: f.client.get('/api/catalog'),
+    'search': lambda f: lambda: f.client.get('/search?q=дракон'),
+    'api_search': lambda f: lambda: f.client.get('/api/search?q=дракон'),
+    'login': lambda f: lambda: f.client.get('/login'),
+    'profile': lambda f: lambda: f.client.get('/profile'),
+    'my_novels': lambda f: lambda: f.client.get('/my_novels'),
+    'builder': lambda f: lambda: f.client.get(f'/builder/{f.own_id}'),
+    'get_novel_data': lambda f: lambda: f.client.get(f'/api/novel/{f.own_id}'),
+    'save_novel': lambda f: (lambda data: lambda: f.client.post(f'/api/save_novel/{f.own_id}', json=data))(
+        f.saved_novel()),
+    'batch_scene_operations': lambda f: lambda: f.client.post(f'/api/novel/{f.own_id}/batch', json={
+        'operations': [{'op': 'update', 'id': f.scene_id, 'data': {'text': 'Правка из автосохранения'}}]}),
+    'view_novel': lambda f: lambda: f.client.get(f'/view/{f.published_id}'),
+    'view_novel:draft': lambda f: lambda: f.client.get(f'/view/{f.draft_id}'),
+    'read_scenes': lambda f: lambda: f.client.get(f'/api/read/{f.published_id}/scenes?positions=1,2,3'),
+    'read_scenes:draft': lambda f: lambda: f.client.get(f'/api/read/{f.draft_id}/scenes?positions=1,2,3'),
+    'get_progress': lambda f: lambda: f.client.get(f'/api/progress/{f.published_id}'),
+    'save_progress': lambda f: lambda: f.client.put(f'/api/progress/{f.published_id}/0',
+                                                    json={'scene': 1, 'history': [0, 1]}),
+    'novel_pack_info': lambda f: lambda: f.client.get(f'/novel/{f.published_id}/pack/info')
+}
+
+
+def measure(counter, fixture, names):
+    """Число запросов каждой проверки: {имя: [SQL, ...]}"""
+    import app as application
+
+    results = {}
+    for name in names:
+        call = CHECKS[name](fixture)
+        # Страница читалки кешируется - считаем запросы ее настоящей отрисовки
+        application.viewer_cache.clear()
+        with counter:
+            response = call()
+        if response.status_code >= 400:
+            raise SystemExit(f'❌ {name}: ответ {response.status_code}')
+        results[name] = counter.captured
+        application.jobs.join()
+    return results
+
+
+def describe(statements):
+    """Запросы с числом повторов - повторы и есть признак N+1"""
+    lines = []
+    for statement, count in Counter(statements).most_common():
+        prefix = f'×{count} ' if count > 1 else ''
+        lines.append(f'      {prefix}{statement[:300]}')
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Бюджет SQL-запросов на маршрут')
+    parser.add_argument('--checks', default=','.join(QUERY_BUDGETS), help='проверки через запятую')
+    parser.add_argument('--verbose', action='store_true', help='показать запросы всех проверок')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+    names = [name.strip() for name in args.checks.split(',') if name.strip()]
+    unknown = [name for name in names if name not in CHECKS]
+    if unknown:
+        raise SystemExit(f'❌ Неизвестные проверки: {", ".join(unknown)}')
+
+    directory = tempfile.mkdtemp(prefix='query_budget_')
+    try:
+        configure_environment(directory)
+        os.environ['ACCESS_LOG'] = ''
+        os.environ['SLOW_QUERY_THRESHOLD_MS'] = '-1'
+
+        from app import app, db, init_database
+        from generate_corpus import populate
+
+        counter = QueryCounter()
+        with app.app_context():
+            counter.install(db.engines.values())
+            init_database()
+        rng = random.Random(args.seed)
+
+        passes = []
+        offset = 0
+        for label, corpus in (('маленький', SMALL_CORPUS), ('большой', GROWTH_CORPUS)):
+            options = corpus_args(corpus + ['--seed', str(args.seed + offset)])
+            with app.app_context():
+                populate(options, rng, offset)
+            offset += options.users
+            # Запросы - вне контекста приложения: у каждого своя сессия,
+            # без объектов, уже загруженных предыдущими запросами
+            fixture = Fixture(app, app.test_client(), rng)
+            fixture.login()
+            passes.append((label, measure(counter, fixture, names)))
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    (_, small), (_, large) = passes
+    failures = 0
+    print(f"\n📊 SQL-запросов на маршрут:")
+    print(f"   {'проверка':<26}{'бюджет':>8}{'мал.':>7}{'бол.':>7}")
+    for name in names:
+        budget = QUERY_BUDGETS[name]
+        problems = []
+        if len(large[name]) > budget or len(small[name]) > budget:
+            problems.append(f'больше бюджета {budget}')
+        if len(large[name]) != len(small[name]):
+            problems.append('зависит от размера корпуса')
+        mark = '❌' if problems else '✅'
+        print(f"{mark} {name:<26}{budget:>8}{len(small[name]):>7}{len(large[name]):>7}"
+              f"{'   ' + ', '.join(problems) if problems else ''}")
+        if problems or args.verbose:
+            print('\n'.join(describe(large[name])))
+        failures += bool(problems)
+
+    if failures:
+        print(f"\n❌ Вне бюджета: {failures}")
+        return 1
+    print(f"\n✅ Все маршруты в бюджете")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,257 @@
+# reader_bundle.py - готовые данные опубликованной новеллы для читалки
+import hashlib
+import json
+import os
+import tempfile
+import zipfile
+
+from flask import current_app
+from sqlalchemy import update
+
+from assets import asset_id_from_ref, asset_srcset, get_asset_store
+from database.db import db, Asset, Novel, Scene
+from database.graph import compile_story_graph
+from render_cache import RenderCache
+
+BUNDLE_FORMAT = 1
+# Сколько последних версий бандла новеллы хранить на диске
+KEEP_VERSIONS = 2
+
+
+def reader_scene_payload(scene, position):
+    """Данные одной сцены для читалки"""
+    choices = []
+    for choice in scene.choices_list:
+        if not isinstance(choice, dict):
+            continue
+        next_scene = choice.get('nextScene', choice.get('next_scene', 0))
+        choices.append({'text': choice.get('text', ''), 'nextScene': next_scene or 0})
+
+    # Разобранные спрайты общие с кешем сцены - srcset добавляем в копии
+    sprites = []
+    for sprite in scene.sprites_list:
+        srcset = asset_srcset(sprite.get('url')) if isinstance(sprite, dict) else ''
+        sprites.append(dict(sprite, srcset=srcset) if srcset else sprite)
+
+    return {
+        'id': scene.id,
+        'position': position,
+        'name': scene.name or f'Сцена {position + 1}',
+        'text': scene.text or '',
+        'background': scene.background or None,
+        'backgroundSrcset': asset_srcset(scene.background) or None,
+        'choices': choices,
+        'sprites': sprites
+    }
+
+
+def novel_version(novel):
+    """Метка содержимого новеллы, от которой зависят кеши и бандлы: updated_at
+    и render_version (нулевая не пишется - прежние бандлы остаются годными)"""
+    version = novel.updated_at or novel.created_at
+    label = version.isoformat() if version else ''
+    return f'{label}+{novel.render_version}' if novel.render_version else label
+
+
+class ReaderBundle:
+    """Загруженный бандл: исходные байты JSON и разобранные данные"""
+
+    def __init__(self, version, raw):
+        self.version = version
+        self.raw = raw
+        self.data = json.loads(raw)
+
+    def __len__(self):
+        return len(self.raw)
+
+    @property
+    def total(self):
+        return self.data['total']
+
+    def scene(self, position):
+        scenes = self.data['scenes']
+        return scenes[position] if 0 <= position < len(scenes) else None
+
+
+class BundleStore:
+    """Файлы <root>/<novel_id>/<version>.json, версия - хеш содержимого.
+    Рядом лежит офлайн-пакет той же версии <version>.zip.
+
+    Файл версии никогда не перезаписывается, поэтому загруженный бандл
+    можно держать в памяти без проверок.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = str(root)
+        self.cache = RenderCache(max_entries=1024, max_bytes=max_bytes)
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, novel_id, version):
+        return os.path.join(self.root, str(novel_id), f'{version}.json')
+
+    def pack_path_for(self, novel_id, version):
+        return os.path.join(self.root, str(novel_id), f'{version}.zip')
+
+    def save(self, novel_id, version, raw):
+        path = self.path_for(novel_id, version)
+        if os.path.exists(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(raw)
+        os.replace(tmp_path, path)
+        return path
+
+    def save_pack(self, novel_id, bundle, asset_store):
+        """Собирает офлайн-пакет: bundle.json и оригиналы всех изображений.
+
+        Изображения уже сжаты, поэтому архив без сжатия (ZIP_STORED) -
+        клиент достает файлы срезами, не распаковывая.
+        """
+        path = self.pack_path_for(novel_id, bundle.version)
+        if os.path.exists(path):
+            return path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as tmp, zipfile.ZipFile(tmp, 'w', zipfile.ZIP_STORED) as pack:
+                pack.writestr('bundle.json', bundle.raw)
+                for asset in bundle.data['assets']:
+                    if asset_store.exists(asset['id']):
+                        pack.write(asset_store.path_for(asset['id']), f'assets/{asset["id"]}')
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return path
+
+    def load(self, novel_id, version):
+        key = (novel_id, version)
+        bundle = self.cache.get(key)
+        if bundle is None:
+            try:
+                with open(self.path_for(novel_id, version), 'rb') as f:
+                    bundle = ReaderBundle(version, f.read())
+            except (OSError, ValueError):
+                return None
+            self.cache.set(key, bundle)
+        return bundle
+
+    def prune(self, novel_id, keep=KEEP_VERSIONS):
+        """Удаляет старые версии вместе с их пакетами, оставляя keep последних"""
+        directory = os.path.join(self.root, str(novel_id))
+        if not os.path.isdir(directory):
+            return
+        paths = sorted(
+            (os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.json')),
+            key=os.path.getmtime, reverse=True
+        )
+        for path in paths[keep:]:
+            os.remove(path)
+            pack_path = path[:-len('.json')] + '.zip'
+            if os.path.exists(pack_path):
+                os.remove(pack_path)
+
+    def remove(self, novel_id):
+        self.cache.invalidate(novel_id)
+        self.prune(novel_id, keep=0)
+
+
+def get_bundle_store():
+    """Хранилище бандлов текущего приложения (создается один раз)"""
+    store = current_app.extensions.get('bundle_store')
+    if store is None:
+        store = BundleStore(current_app.config['BUNDLE_DIR'], current_app.config['BUNDLE_CACHE_MAX_BYTES'])
+        current_app.extensions['bundle_store'] = store
+    return store
+
+
+def build_reader_bundle(novel):
+    """Собирает бандл новеллы, возвращает (version, bytes)"""
+    scenes = Scene.decode_all(
+        Scene.query.filter_by(novel_id=novel.id).order_by(Scene.order, Scene.id).all()
+    )
+    graph = compile_story_graph([scene.id for scene in scenes], [scene.choices_list for scene in scenes])
+
+    # Все изображения новеллы - для офлайн-пакета и предзагрузки
+    refs = {novel.cover_image} | {scene.background for scene in scenes}
+    refs |= {sprite.get('url') for scene in scenes for sprite in scene.sprites_list if isinstance(sprite, dict)}
+    asset_ids = sorted(filter(None, (asset_id_from_ref(ref) for ref in refs)))
+    assets = Asset.query.filter(Asset.id.in_(asset_ids)).all() if asset_ids else []
+
+    data = {
+        'format': BUNDLE_FORMAT,
+        'novel_id': novel.id,
+        'updated_at': novel_version(novel),
+        'title': novel.title,
+        'description': novel.description or '',
+        # Никнейма автора в бандле нет: он меняется без правки новеллы,
+        # шапка читалки берет его из базы
+        'total': len(scenes),
+        'scene_ids': graph['scene_ids'],
+        'edges': graph['edges'],
+        'scenes': [reader_scene_payload(scene, position) for position, scene in enumerate(scenes)],
+        'assets': [{
+            'id': asset.id,
+            'url': asset.url,
+            'mime_type': asset.mime_type,
+            'size': asset.size,
+            'srcset': asset_srcset(asset.url)
+        } for asset in assets]
+    }
+    raw = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    return hashlib.sha256(raw).hexdigest()[:16], raw
+
+
+def build_novel_bundle(novel_id):
+    """Фоновая задача: собрать бандл опубликованной новеллы и отметить его в базе"""
+    novel = db.session.get(Novel, novel_id)
+    if novel is None or not novel.is_published:
+        return None
+
+    version, raw = build_reader_bundle(novel)
+    store = get_bundle_store()
+    store.save(novel.id, version, raw)
+
+    # Пока собирали, новеллу могли изменить - тогда эта версия уже не нужна,
+    # а свежую соберет следующая задача из очереди
+    result = db.session.execute(
+        update(Novel)
+        .where(Novel.id == novel.id, Novel.updated_at == novel.updated_at,
+               Novel.render_version == novel.render_version)
+        .values(bundle_version=version, updated_at=Novel.updated_at)
+    )
+    db.session.commit()
+    store.prune(novel_id)
+    return version if result.rowcount else None
+
+
+def ready_pack_path(novel_id, bundle):
+    """Путь к готовому офлайн-пакету версии бандла или None"""
+    path = get_bundle_store().pack_path_for(novel_id, bundle.version)
+    return path if os.path.exists(path) else None
+
+
+def build_novel_pack(novel_id):
+    """Фоновая задача: офлайн-пакет текущего бандла опубликованной новеллы.
+    Архив со всеми изображениями собирается долго - не в потоке запроса"""
+    novel = db.session.get(Novel, novel_id)
+    if novel is None:
+        return None
+    bundle = current_bundle(novel)
+    if bundle is None:
+        # Бандл еще собирается - пакет поставит в очередь следующий запрос
+        return None
+    return get_bundle_store().save_pack(novel_id, bundle, get_asset_store())
+
+
+def current_bundle(novel):
+    """Бандл, соответствующий текущему содержимому новеллы, или None"""
+    if not novel.is_published or not novel.bundle_version:
+        return None
+    bundle = get_bundle_store().load(novel.id, novel.bundle_version)
+    if bundle is None or bundle.data.get('updated_at') != novel_version(novel):
+        return None
+    return bundle
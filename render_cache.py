@@ -0,0 +1,59 @@
+# render_cache.py - кеш готовых страниц в памяти процесса
+import threading
+from collections import OrderedDict
+
+
+class RenderCache:
+    """LRU кеш отрендеренных страниц с ограничением по числу и объему.
+
+    Ключ - кортеж, первым элементом которого идет id новеллы: так можно
+    сбросить все варианты страницы одной новеллы через invalidate().
+    """
+
+    def __init__(self, max_entries=256, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._entries[key] = value
+            self._size += size
+            # Вытесняем самые давно использованные страницы
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+
+    def invalidate(self, novel_id):
+        """Удаляет все закешированные варианты страниц новеллы"""
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == novel_id]:
+                self._size -= len(self._entries.pop(key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def __len__(self):
+        return len(self._entries)
@@ -47,6 +47,7 @@ def reset_database():
         sys.path.append(os.path.dirname(os.path.abspath(__file__)))
         
         from app import app, db, User, Novel, Scene
+        from database.db import delete_scene_rows
         from datetime import datetime
         import json
         
@@ -150,6 +151,7 @@ def reset_database():
             ]
             
             # Удаляем старые сцены если есть
+            delete_scene_rows(novel_id)
             Scene.query.filter_by(novel_id=novel_id).delete()
             
             # Добавляем новые сцены
@@ -1,5 +1,108 @@
-# run.py
-from app import app
+# run.py - запуск сервера визуальных новелл через waitress
+#
+#   python run.py                 - сервер (настройки SERVER_* в config.py)
+#   python run.py --init-db       - один раз: схема базы и демо новелла
+#   flask --app app run --debug   - сервер разработки с автоперезагрузкой
+import argparse
+import signal
+import threading
+import time
+
+from waitress import wasyncore
+from waitress.server import create_server
+
+from app import app, db, init_database, jobs
+from image_pipeline import get_image_pipeline
+from progress import get_progress_buffer
+
+
+def parse_args(argv=None):
+    config = app.config
+    parser = argparse.ArgumentParser(description='Сервер визуальных новелл')
+    parser.add_argument('--host', default=config['SERVER_HOST'])
+    parser.add_argument('--port', type=int, default=config['SERVER_PORT'])
+    parser.add_argument('--threads', type=int, default=config['SERVER_THREADS'])
+    parser.add_argument('--init-db', action='store_true',
+                        help='создать/обновить схему базы и демо новеллу, затем выйти')
+    return parser.parse_args(argv)
+
+
+def make_server(host, port, threads):
+    config = app.config
+    return create_server(
+        app,
+        host=host,
+        port=port,
+        threads=threads,
+        connection_limit=config['SERVER_CONNECTION_LIMIT'],
+        backlog=config['SERVER_BACKLOG'],
+        channel_timeout=config['SERVER_CHANNEL_TIMEOUT'],
+        max_request_body_size=config['MAX_CONTENT_LENGTH'],
+        ident='visual-novel',
+        asyncore_use_poll=True
+    )
+
+
+def serve(server, stopping):
+    """Цикл событий waitress, который можно остановить без обрыва запросов"""
+    while not stopping.is_set():
+        wasyncore.loop(timeout=1, map=server._map, use_poll=True, count=1)
+
+    # Больше не принимаем соединения, но дописываем начатые ответы
+    wasyncore.dispatcher.close(server)
+    deadline = time.monotonic() + app.config['SERVER_SHUTDOWN_TIMEOUT']
+    while time.monotonic() < deadline:
+        for channel in list(server.active_channels.values()):
+            # Соединения keep-alive без запросов закрываем сразу
+            if not channel.requests and not channel.total_outbufs_len:
+                channel.handle_close()
+        if not server.active_channels:
+            break
+        wasyncore.loop(timeout=0.1, map=server._map, use_poll=True, count=1)
+
+    server.task_dispatcher.shutdown(cancel_pending=True, timeout=1)
+    server.trigger.close()
+
+
+def shutdown_background_work():
+    jobs.shutdown()
+    with app.app_context():
+        # Несохраненный прогресс чтения пишем до закрытия соединений
+        get_progress_buffer().shutdown()
+        get_image_pipeline().shutdown()
+        db.engine.dispose()
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    if args.init_db:
+        with app.app_context():
+            init_database()
+        return
+
+    server = make_server(args.host, args.port, args.threads)
+    stopping = threading.Event()
+
+    def request_stop(signum, frame):
+        print("\n⏹ Останавливаю сервер, дожидаюсь текущих запросов...")
+        stopping.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    print("=" * 50)
+    print("🚀 Сервер визуальных новелл запущен (waitress)")
+    print(f"🌐 http://{server.effective_host}:{server.effective_port}")
+    print(f"   Потоков: {args.threads}, соединений: до {app.config['SERVER_CONNECTION_LIMIT']}")
+    print("=" * 50)
+
+    try:
+        serve(server, stopping)
+    finally:
+        shutdown_background_work()
+    print("✅ Сервер остановлен")
+
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
+    main()
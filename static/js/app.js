@@ -1,7 +1,7 @@
 // PWA Service Worker регистрация
 if ('serviceWorker' in navigator) {
     window.addEventListener('load', () => {
-        navigator.serviceWorker.register('/static/sw.js')
+        navigator.serviceWorker.register('/sw.js')
             .then(registration => {
                 console.log(' ServiceWorker зарегистрирован: ', registration.scope);
                 
@@ -9,6 +9,21 @@ class NovelBuilder {
         this.activeTool = 'select';
         this.draggingSprite = null;
         
+        // Несохраненные изменения для автосохранения пакетом операций
+        this.dirtyScenes = new Map();
+        this.deletedSceneIds = new Set();
+        this.orderDirty = false;
+        this.novelDirty = false;
+        // Новые сцены, чей create уже отправлен, и те из них, что удалили до ответа
+        this.creatingSceneIds = new Set();
+        this.deletedCreatingIds = new Set();
+        this.flushPromise = null;
+        this.autosave = Utils.debounce(() => this.flushChanges(), 2000);
+        // Проблемы сюжета из последнего ответа сервера
+        this.graph = null;
+        // Файлы больше этого размера загружаются частями (/api/uploads)
+        this.uploadChunkSize = 1024 * 1024;
+        
         console.log(" Конструктор инициализирован, ID новеллы:", this.novelId);
         
         this.init();
@@ -93,11 +108,37 @@ class NovelBuilder {
         // Изменение названия новеллы
         document.getElementById('novel-title')?.addEventListener('input', (e) => {
             this.updateNovelTitle(e.target.value);
+            this.markNovelDirty();
+        });
+        
+        document.getElementById('novel-description')?.addEventListener('input', () => {
+            this.markNovelDirty();
         });
         
         // Публикация чекбокс
         document.getElementById('novel-published')?.addEventListener('change', (e) => {
             this.updatePublishStatus(e.target.checked);
+            this.markNovelDirty();
+        });
+        
+        // Текст и название сцены сохраняются автоматически
+        ['scene-name', 'scene-text'].forEach(fieldId => {
+            document.getElementById(fieldId)?.addEventListener('input', (e) => {
+                const scene = this.scenes[this.currentSceneIndex];
+                if (!scene) return;
+                const field = fieldId === 'scene-name' ? 'name' : 'text';
+                scene[field] = e.target.value;
+                this.markSceneDirty(scene, field);
+            });
+        });
+
+        // Предупреждаем о несохраненных изменениях при уходе со страницы
+        window.addEventListener('beforeunload', (e) => {
+            if (this.hasPendingChanges()) {
+                this.flushChanges();
+                e.preventDefault();
+                e.returnValue = '';
+            }
         });
     }
     
@@ -183,6 +224,7 @@ class NovelBuilder {
             
             // Рендерим сцены
             this.renderSceneList();
+            this.showGraphWarnings(data.graph);
             
             // Если есть сцены, показываем первую
             if (this.scenes.length > 0) {
@@ -365,6 +407,7 @@ class NovelBuilder {
             if (this.currentSceneIndex !== -1) {
                 this.scenes[this.currentSceneIndex].sprites =
                     this.currentSprites.filter(s => s.isOnCanvas);
+                this.markSceneDirty(this.scenes[this.currentSceneIndex], 'sprites');
             }
 
             this.renderCanvasSprites();
@@ -503,6 +546,7 @@ class NovelBuilder {
         this.scenes.push(newScene);
         this.renderSceneList();
         this.selectScene(this.scenes.length - 1);
+        this.autosave();
         
         // Фокус на поле названия
         setTimeout(() => {
@@ -515,6 +559,7 @@ class NovelBuilder {
     updateSceneName(index, name) {
         if (this.scenes[index]) {
             this.scenes[index].name = name;
+            this.markSceneDirty(this.scenes[index], 'name');
             this.renderSceneList();
         }
     }
@@ -526,10 +571,21 @@ class NovelBuilder {
         }
         
         const scene = this.scenes[this.currentSceneIndex];
-        scene.name = document.getElementById('scene-name').value;
-        scene.text = document.getElementById('scene-text').value;
-        scene.choices = [...this.choices];
-        scene.sprites = this.currentSprites.filter(s => s.isOnCanvas);
+        const updated = {
+            name: document.getElementById('scene-name').value,
+            text: document.getElementById('scene-text').value,
+            choices: [...this.choices],
+            sprites: this.currentSprites.filter(s => s.isOnCanvas)
+        };
+        
+        // Помечаем только реально измененные поля
+        const changedFields = Object.keys(updated).filter(
+            field => JSON.stringify(scene[field]) !== JSON.stringify(updated[field])
+        );
+        Object.assign(scene, updated);
+        if (changedFields.length > 0) {
+            this.markSceneDirty(scene, ...changedFields);
+        }
         
         console.log(` Сохранение сцены ${this.currentSceneIndex}:`, {
             name: scene.name,
@@ -552,52 +608,21 @@ class NovelBuilder {
             this.saveCurrentScene();
             
             const saveBtn = document.getElementById('save-btn');
-            const originalText = saveBtn.innerHTML;
             saveBtn.disabled = true;
             saveBtn.innerHTML = ' Сохранение...';
             
-            const novelData = {
-                title: document.getElementById('novel-title').value,
-                description: document.getElementById('novel-description').value,
-                is_published: document.getElementById('novel-published').checked,
-                scenes: this.scenes.map(scene => ({
-                    ...scene,
-                    choices: Array.isArray(scene.choices) ? scene.choices : [],
-                    sprites: Array.isArray(scene.sprites) ? scene.sprites : []
-                }))
-            };
-            
-            console.log("📤 Отправляю данные для сохранения:", {
-                title: novelData.title,
-                scenes: novelData.scenes.length,
-                scene1: novelData.scenes[0] ? {
-                    name: novelData.scenes[0].name,
-                    textLength: novelData.scenes[0].text.length,
-                    choices: novelData.scenes[0].choices.length,
-                    sprites: novelData.scenes[0].sprites.length
-                } : null
-            });
-            
-            const response = await fetch(`/api/save_novel/${this.novelId}`, {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify(novelData)
-            });
-            
-            const data = await response.json();
-            
-            console.log("📥 Ответ от сервера:", data);
+            const data = await this.flushChanges();
             
             if (data.success) {
+                const isPublished = document.getElementById('novel-published').checked;
                 this.showNotification(' Новелла сохранена!', 'success');
-                this.updateNovelTitle(novelData.title);
-                this.updatePublishStatus(novelData.is_published);
+                this.updateNovelTitle(document.getElementById('novel-title').value);
+                this.updatePublishStatus(isPublished);
                 
                 // Обновляем кнопку публикации
                 const publishBtn = document.getElementById('publish-btn');
-                publishBtn.innerHTML = novelData.is_published ? ' Опубликовано' : ' Опубликовать';
+                publishBtn.innerHTML = isPublished ? ' Опубликовано' : ' Опубликовать';
+                this.showGraphWarnings(this.graph);
                 
             } else {
                 this.showNotification(' Ошибка: ' + data.error, 'error');
@@ -613,6 +638,193 @@ class NovelBuilder {
         }
     }
     
+    // ========== АВТОСОХРАНЕНИЕ ==========
+    
+    markSceneDirty(scene, ...fields) {
+        // Для новой сцены правки тоже запоминаем (под временным id): если ее
+        // create уже в пути, после ответа они уйдут операцией update
+        const dirtyFields = this.dirtyScenes.get(scene.id) || new Set();
+        fields.forEach(field => dirtyFields.add(field));
+        this.dirtyScenes.set(scene.id, dirtyFields);
+        this.autosave();
+    }
+    
+    markNovelDirty() {
+        this.novelDirty = true;
+        this.autosave();
+    }
+    
+    hasPendingChanges() {
+        return this.dirtyScenes.size > 0 || this.deletedSceneIds.size > 0 ||
+            this.orderDirty || this.novelDirty ||
+            this.scenes.some(scene => typeof scene.id !== 'number');
+    }
+    
+    // Собирает операции только для измененных сцен
+    collectOperations() {
+        const operations = [];
+        
+        this.deletedSceneIds.forEach(id => operations.push({ op: 'delete', id }));
+        
+        this.scenes.forEach((scene, index) => {
+            if (typeof scene.id !== 'number') {
+                operations.push({
+                    op: 'create',
+                    client_id: scene.id,
+                    data: {
+                        name: scene.name,
+                        text: scene.text || '',
+                        background: scene.background || '',
+                        order: index,
+                        choices: Array.isArray(scene.choices) ? scene.choices : [],
+                        sprites: Array.isArray(scene.sprites) ? scene.sprites : []
+                    }
+                });
+            } else if (this.dirtyScenes.has(scene.id)) {
+                const data = {};
+                this.dirtyScenes.get(scene.id).forEach(field => {
+                    data[field] = scene[field];
+                });
+                operations.push({ op: 'update', id: scene.id, data });
+            }
+        });
+        
+        if (this.orderDirty) {
+            operations.push({ op: 'reorder', order: this.scenes.map(scene => scene.id) });
+        }
+        
+        if (this.novelDirty) {
+            operations.push({
+                op: 'novel',
+                data: {
+                    title: document.getElementById('novel-title').value,
+                    description: document.getElementById('novel-description').value,
+                    is_published: document.getElementById('novel-published').checked
+                }
+            });
+        }
+        
+        return operations;
+    }
+    
+    // Предупреждает о проблемах сюжета, найденных сервером при сборке графа
+    showGraphWarnings(graph) {
+        this.graph = graph || null;
+        if (!graph) return;
+        
+        const number = position => position + 1;
+        const problems = [];
+        if (graph.orphans && graph.orphans.length) {
+            problems.push('недостижимые сцены: ' + graph.orphans.map(number).join(', '));
+        }
+        if (graph.dangling && graph.dangling.length) {
+            const scenes = [...new Set(graph.dangling.map(link => number(link.scene)))];
+            problems.push('выборы ведут на несуществующие сцены в сценах: ' + scenes.join(', '));
+        }
+        if (problems.length) {
+            this.showNotification(' Проверьте сюжет - ' + problems.join('; '), 'info');
+        }
+    }
+    
+    // Отправляет накопленные изменения одним запросом
+    async flushChanges() {
+        // Не запускаем параллельные сохранения - дожидаемся текущего
+        while (this.flushPromise) {
+            await this.flushPromise;
+        }
+        
+        if (!this.hasPendingChanges()) {
+            return { success: true, results: [] };
+        }
+        
+        const operations = this.collectOperations();
+        const snapshot = {
+            dirtyScenes: this.dirtyScenes,
+            deletedSceneIds: this.deletedSceneIds,
+            orderDirty: this.orderDirty,
+            novelDirty: this.novelDirty
+        };
+        this.dirtyScenes = new Map();
+        this.deletedSceneIds = new Set();
+        this.orderDirty = false;
+        this.novelDirty = false;
+        const createdIds = operations.filter(op => op.op === 'create').map(op => op.client_id);
+        createdIds.forEach(id => this.creatingSceneIds.add(id));
+        
+        this.flushPromise = (async () => {
+            try {
+                const response = await fetch(`/api/novel/${this.novelId}/batch`, {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({ operations })
+                });
+                const data = await response.json();
+                
+                if (!data.success) {
+                    this.restorePendingChanges(snapshot);
+                    return data;
+                }
+                
+                // Новые сцены получили id в базе
+                let requeued = false;
+                data.results.forEach(result => {
+                    if (result.op !== 'create') return;
+                    if (this.deletedCreatingIds.has(result.client_id)) {
+                        // Сцену удалили, пока шел create - удаляем и на сервере
+                        this.deletedSceneIds.add(result.id);
+                        requeued = true;
+                        return;
+                    }
+                    const scene = this.scenes.find(s => s.id === result.client_id);
+                    if (scene) {
+                        scene.id = result.id;
+                    }
+                    // Правки, сделанные во время запроса, переносим на id из базы
+                    const dirtyFields = this.dirtyScenes.get(result.client_id);
+                    if (dirtyFields) {
+                        this.dirtyScenes.delete(result.client_id);
+                        this.dirtyScenes.set(result.id, dirtyFields);
+                        requeued = true;
+                    }
+                });
+                if (requeued) {
+                    this.autosave();
+                }
+                this.graph = data.graph || this.graph;
+                console.log(` Автосохранение: ${operations.length} операций`);
+                return data;
+            } catch (error) {
+                this.restorePendingChanges(snapshot);
+                throw error;
+            } finally {
+                createdIds.forEach(id => {
+                    this.creatingSceneIds.delete(id);
+                    this.deletedCreatingIds.delete(id);
+                });
+            }
+        })();
+        
+        try {
+            return await this.flushPromise;
+        } finally {
+            this.flushPromise = null;
+        }
+    }
+    
+    // Возвращает неотправленные изменения после ошибки сохранения
+    restorePendingChanges(snapshot) {
+        snapshot.dirtyScenes.forEach((fields, id) => {
+            const dirtyFields = this.dirtyScenes.get(id) || new Set();
+            fields.forEach(field => dirtyFields.add(field));
+            this.dirtyScenes.set(id, dirtyFields);
+        });
+        snapshot.deletedSceneIds.forEach(id => this.deletedSceneIds.add(id));
+        this.orderDirty = this.orderDirty || snapshot.orderDirty;
+        this.novelDirty = this.novelDirty || snapshot.novelDirty;
+    }
+    
     async publishNovel() {
         try {
             // Сначала сохраняем
@@ -673,10 +885,7 @@ class NovelBuilder {
             return;
         }
         
-        const reader = new FileReader();
-        reader.onload = (e) => {
-            const backgroundUrl = e.target.result;
-            
+        this.uploadAsset(file).then(backgroundUrl => {
             // Обновляем фон на холсте
             const backgroundDiv = document.getElementById('canvas-background');
             backgroundDiv.innerHTML = `
@@ -687,6 +896,7 @@ class NovelBuilder {
             // Обновляем данные сцены
             if (this.currentSceneIndex !== -1) {
                 this.scenes[this.currentSceneIndex].background = backgroundUrl;
+                this.markSceneDirty(this.scenes[this.currentSceneIndex], 'background');
             }
             
             // Показываем превью
@@ -698,8 +908,9 @@ class NovelBuilder {
             `;
             
             this.showNotification(' Фон загружен успешно', 'success');
-        };
-        reader.readAsDataURL(file);
+        }).catch(error => {
+            this.showNotification(' Ошибка загрузки фона: ' + error.message, 'error');
+        });
     }
     
     handleSpriteFiles(files) {
@@ -712,10 +923,7 @@ class NovelBuilder {
                 continue;
             }
             
-            const reader = new FileReader();
-            reader.onload = (e) => {
-                const spriteUrl = e.target.result;
-                
+            this.uploadAsset(file).then(spriteUrl => {
                 // Добавляем в список доступных спрайтов
                 const sprite = {
                     id: 'sprite_' + Date.now() + '_' + i,
@@ -727,9 +935,91 @@ class NovelBuilder {
                 this.currentSprites.push(sprite);
                 this.renderSpritesList();
                 this.showNotification(` Спрайт "${sprite.name}" добавлен`, 'success');
-            };
-            reader.readAsDataURL(file);
+            }).catch(error => {
+                this.showNotification(` Ошибка загрузки "${file.name}": ${error.message}`, 'error');
+            });
+        }
+    }
+    
+    // Загружает файл в хранилище и возвращает короткую ссылку на него
+    async uploadAsset(file) {
+        // Большие файлы грузим частями, чтобы обрыв связи не начинал загрузку заново
+        if (file.size > this.uploadChunkSize) {
+            return this.uploadAssetInChunks(file);
+        }
+        
+        const response = await fetch('/api/assets', {
+            method: 'PUT',
+            headers: {
+                'Content-Type': file.type || 'application/octet-stream'
+            },
+            body: file
+        });
+        
+        const data = await response.json();
+        if (!data.success) {
+            throw new Error(data.error || 'Ошибка загрузки');
+        }
+        return data.url;
+    }
+    
+    async uploadAssetInChunks(file) {
+        const startResponse = await fetch('/api/uploads', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ size: file.size })
+        });
+        let status = await startResponse.json();
+        if (!status.success) {
+            throw new Error(status.error || 'Ошибка загрузки');
+        }
+        
+        const uploadUrl = `/api/uploads/${status.upload_id}`;
+        // Подряд неудачных запросов (части или статуса) до отказа; пауза растет
+        // 1, 2, 4... до 30 секунд - переживаем обрыв связи около минуты
+        const maxFailures = 6;
+        let failures = 0;
+        let resync = false;
+        while (!status.complete) {
+            try {
+                if (resync) {
+                    // После обрыва спрашиваем, сколько сервер уже получил
+                    const response = await fetch(uploadUrl);
+                    const data = await response.json();
+                    if (!data.success) {
+                        throw new Error(data.error || 'Ошибка загрузки');
+                    }
+                    status = data;
+                    resync = false;
+                    continue;
+                }
+                const start = status.offset;
+                const end = Math.min(start + status.chunk_size, file.size);
+                const response = await fetch(uploadUrl, {
+                    method: 'PUT',
+                    headers: {
+                        'Content-Range': `bytes ${start}-${end - 1}/${file.size}`
+                    },
+                    body: file.slice(start, end)
+                });
+                const data = await response.json();
+                // 409 - сервер принял другую часть, продолжаем с его смещения
+                if (!data.success) {
+                    throw new Error(data.error || 'Ошибка загрузки');
+                }
+                status = data;
+                failures = 0;
+            } catch (error) {
+                if (++failures > maxFailures) {
+                    throw error;
+                }
+                await new Promise(resolve => setTimeout(resolve, Math.min(1000 * 2 ** (failures - 1), 30000)));
+                resync = true;
+            }
         }
+        return status.url;
     }
     
     handleBackgroundDrop(e) {
@@ -787,6 +1077,7 @@ class NovelBuilder {
         // Обновляем данные сцены
         if (this.currentSceneIndex !== -1) {
             this.scenes[this.currentSceneIndex].sprites = this.currentSprites.filter(s => s.isOnCanvas);
+            this.markSceneDirty(this.scenes[this.currentSceneIndex], 'sprites');
         }
         
         this.showNotification(` Спрайт "${name}" добавлен на сцену`, 'success');
@@ -823,6 +1114,7 @@ class NovelBuilder {
                 // Обновляем данные сцены
                 if (this.currentSceneIndex !== -1) {
                     this.scenes[this.currentSceneIndex].sprites = this.currentSprites.filter(s => s.isOnCanvas);
+                    this.markSceneDirty(this.scenes[this.currentSceneIndex], 'sprites');
                 }
             };
             
@@ -856,17 +1148,28 @@ class NovelBuilder {
         
         this.choices.push(newChoice);
         this.renderChoicesList();
+        this.markChoicesDirty();
+    }
+    
+    // Переносит варианты выбора в текущую сцену и ставит ее в очередь автосохранения
+    markChoicesDirty() {
+        const scene = this.scenes[this.currentSceneIndex];
+        if (!scene) return;
+        scene.choices = this.choices;
+        this.markSceneDirty(scene, 'choices');
     }
     
     updateChoiceText(index, text) {
         if (this.choices[index]) {
             this.choices[index].text = text;
+            this.markChoicesDirty();
         }
     }
     
     updateChoiceNextScene(index, nextScene) {
         if (this.choices[index]) {
             this.choices[index].nextScene = parseInt(nextScene);
+            this.markChoicesDirty();
         }
     }
     
@@ -874,6 +1177,7 @@ class NovelBuilder {
         if (index > 0) {
             [this.choices[index], this.choices[index - 1]] = [this.choices[index - 1], this.choices[index]];
             this.renderChoicesList();
+            this.markChoicesDirty();
         }
     }
     
@@ -881,6 +1185,7 @@ class NovelBuilder {
         if (index < this.choices.length - 1) {
             [this.choices[index], this.choices[index + 1]] = [this.choices[index + 1], this.choices[index]];
             this.renderChoicesList();
+            this.markChoicesDirty();
         }
     }
     
@@ -888,6 +1193,7 @@ class NovelBuilder {
         if (confirm('Удалить этот вариант выбора?')) {
             this.choices.splice(index, 1);
             this.renderChoicesList();
+            this.markChoicesDirty();
         }
     }
     
@@ -896,23 +1202,39 @@ class NovelBuilder {
             return;
         }
         
-        this.scenes.splice(index, 1);
+        const [removed] = this.scenes.splice(index, 1);
+        if (removed) {
+            this.dirtyScenes.delete(removed.id);
+            if (typeof removed.id === 'number') {
+                this.deletedSceneIds.add(removed.id);
+            } else if (this.creatingSceneIds.has(removed.id)) {
+                // id в базе придет с ответом на create - тогда и удалим
+                this.deletedCreatingIds.add(removed.id);
+            }
+        }
         
         // Обновляем порядок сцен
         this.scenes.forEach((scene, i) => {
             scene.order = i;
         });
+        this.orderDirty = true;
         
         // Обновляем ссылки в вариантах выбора
         this.scenes.forEach(scene => {
             if (scene.choices) {
+                let changed = false;
                 scene.choices.forEach(choice => {
                     if (choice.nextScene > index + 1) {
                         choice.nextScene--;
+                        changed = true;
                     } else if (choice.nextScene === index + 1) {
                         choice.nextScene = 0;
+                        changed = true;
                     }
                 });
+                if (changed) {
+                    this.markSceneDirty(scene, 'choices');
+                }
             }
         });
         
@@ -924,6 +1246,7 @@ class NovelBuilder {
         }
         
         this.renderSceneList();
+        this.autosave();
         this.showNotification(' Сцена удалена', 'info');
     }
     
@@ -1,8 +1,22 @@
 // static/js/viewer.js
+// Как часто отправлять прогресс чтения на сервер (мс) и сколько переходов помнить
+const PROGRESS_SAVE_DELAY = 5000;
+const PROGRESS_HISTORY_LIMIT = 500;
+
 class NovelViewer {
     constructor() {
         this.currentSceneIndex = 0;
-        this.scenesData = [];
+        this.novelId = null;
+        this.totalScenes = 0;
+        // Загруженные сцены по позиции и запросы, которые еще в пути
+        this.scenesCache = new Map();
+        this.pendingScenes = new Map();
+        // Прогресс: пройденные позиции, отложенная запись на сервер
+        this.history = [];
+        this.saveProgressEnabled = false;
+        this.progressReady = false;
+        this.progressDirty = false;
+        this.progressTimer = null;
         this.init();
     }
     
@@ -10,18 +24,180 @@ class NovelViewer {
         console.log(' Инициализация читалки новелл');
         
         const novelData = this.loadNovelData();
-        this.scenesData = novelData.scenes || [];
-        
-        console.log('Загружены сцены:', this.scenesData);
+        this.novelId = novelData.id;
+        // Граф переходов, собранный сервером при сохранении новеллы
+        this.edges = novelData.edges || null;
+        this.cacheScenes(novelData.scenes);
+        this.totalScenes = novelData.total ?? this.scenesCache.size;
+        this.saveProgressEnabled = Boolean(novelData.saveProgress);
         
-        if (this.scenesData.length > 0) {
-            this.displayScene(0);
-            document.getElementById('total-scenes').textContent = this.scenesData.length;
+        // Продолжаем с места, где остановились на этом устройстве
+        const saved = this.loadLocalProgress();
+        if (this.totalScenes > 0) {
+            this.history = saved ? saved.history : [];
+            this.displayScene(saved ? saved.scene : 0);
+            document.getElementById('total-scenes').textContent = this.totalScenes;
         } else {
             this.showNoScenesMessage();
         }
         
         this.setupEventListeners();
+        this.setupOfflinePack();
+        this.syncServerProgress(saved);
+    }
+    
+    // ========== ПРОГРЕСС ЧТЕНИЯ ==========
+    // Каждый переход пишется в localStorage сразу, а на сервер - не чаще
+    // раза в PROGRESS_SAVE_DELAY и при уходе со страницы
+    
+    progressStorageKey() {
+        return `novel-progress-${this.novelId}`;
+    }
+    
+    loadLocalProgress() {
+        try {
+            const saved = JSON.parse(localStorage.getItem(this.progressStorageKey()));
+            if (saved && Number.isInteger(saved.scene) && saved.scene >= 0 && saved.scene < this.totalScenes) {
+                return { scene: saved.scene, history: saved.history || [], savedAt: saved.savedAt };
+            }
+        } catch (error) {
+            console.log('Не удалось прочитать сохраненный прогресс:', error);
+        }
+        return null;
+    }
+    
+    // Сервер знает прогресс с других устройств - берем более свежий
+    async syncServerProgress(local) {
+        try {
+            if (!this.saveProgressEnabled) return;
+            const response = await fetch(`/api/progress/${this.novelId}`);
+            if (!response.ok) return;
+            const data = await response.json();
+            const remote = (data.slots || []).find(slot => slot.slot === 0);
+            if (!remote || remote.scene >= this.totalScenes) return;
+            
+            const localTime = local && local.savedAt ? Date.parse(local.savedAt) : 0;
+            if (Date.parse(remote.updatedAt) > localTime && remote.scene !== this.currentSceneIndex) {
+                this.history = remote.history || [];
+                this.progressReady = true;
+                this.displayScene(remote.scene);
+            }
+        } catch (error) {
+            console.log('Прогресс с сервера не загружен:', error);
+        } finally {
+            this.progressReady = true;
+        }
+    }
+    
+    recordProgress(index, scene) {
+        // Пока не сверились с сервером, не затираем его прогресс
+        if (!this.progressReady) return;
+        if (this.history[this.history.length - 1] !== index) {
+            this.history.push(index);
+            this.history = this.history.slice(-PROGRESS_HISTORY_LIMIT);
+        }
+        this.progress = { scene: index, sceneId: scene.id ?? null, history: this.history };
+        
+        try {
+            localStorage.setItem(this.progressStorageKey(), JSON.stringify({
+                ...this.progress,
+                savedAt: new Date().toISOString()
+            }));
+        } catch (error) {
+            console.log('Не удалось сохранить прогресс локально:', error);
+        }
+        
+        if (this.saveProgressEnabled) {
+            this.progressDirty = true;
+            clearTimeout(this.progressTimer);
+            this.progressTimer = setTimeout(() => this.flushProgress(), PROGRESS_SAVE_DELAY);
+        }
+    }
+    
+    // beacon - при закрытии страницы, обычный fetch туда уже не успеет
+    flushProgress(beacon = false) {
+        if (!this.progressDirty) return;
+        this.progressDirty = false;
+        clearTimeout(this.progressTimer);
+        
+        const url = `/api/progress/${this.novelId}/0`;
+        const body = JSON.stringify(this.progress);
+        if (beacon && navigator.sendBeacon) {
+            navigator.sendBeacon(url, new Blob([body], { type: 'application/json' }));
+            return;
+        }
+        fetch(url, {
+            method: 'PUT',
+            headers: { 'Content-Type': 'application/json' },
+            body,
+            keepalive: true
+        }).catch(error => {
+            console.log('Прогресс не отправлен, повторим при следующем переходе:', error);
+            this.progressDirty = true;
+        });
+    }
+    
+    restart() {
+        this.history = [];
+        this.displayScene(0);
+    }
+    
+    // Принимает сцены как объектом {позиция: сцена}, так и массивом
+    cacheScenes(scenes) {
+        if (!scenes) return;
+        Object.entries(scenes).forEach(([position, scene]) => {
+            this.scenesCache.set(Number(position), scene);
+        });
+    }
+    
+    // Загружает сцены по позициям одним запросом, уже загруженные пропускает
+    fetchScenes(positions) {
+        const missing = positions.filter(p =>
+            p >= 0 && p < this.totalScenes && !this.scenesCache.has(p) && !this.pendingScenes.has(p)
+        );
+        
+        if (missing.length > 0) {
+            const request = fetch(`/api/read/${this.novelId}/scenes?positions=${missing.join(',')}`)
+                .then(response => {
+                    if (!response.ok) throw new Error('Ошибка загрузки сцен');
+                    return response.json();
+                })
+                .then(data => this.cacheScenes(data.scenes))
+                .finally(() => missing.forEach(p => this.pendingScenes.delete(p)));
+            missing.forEach(p => this.pendingScenes.set(p, request));
+        }
+        
+        return Promise.all(positions.map(p => this.pendingScenes.get(p)).filter(Boolean));
+    }
+    
+    async loadScene(index) {
+        if (!this.scenesCache.has(index)) {
+            await this.fetchScenes([index]);
+        }
+        return this.scenesCache.get(index);
+    }
+    
+    // Куда читатель может попасть из сцены: цели выборов или следующая сцена
+    sceneTargets(scene, index) {
+        if (this.edges && this.edges[index]) {
+            return this.edges[index];
+        }
+        const choices = scene.choices || [];
+        if (choices.length === 0) {
+            return [index + 1];
+        }
+        return choices
+            .map(choice => (choice.nextScene || 0) - 1)
+            .filter(position => position >= 0);
+    }
+    
+    prefetchFrom(scene, index) {
+        const targets = this.sceneTargets(scene, index);
+        if (targets.length > 0) {
+            this.fetchScenes(targets).catch(error => {
+                console.log('Не удалось заранее загрузить сцены:', error);
+            });
+        }
     }
     
     setupEventListeners() {
@@ -33,10 +209,50 @@ class NovelViewer {
         document.querySelectorAll('.end-message .btn').forEach(btn => {
             btn.addEventListener('click', (e) => {
                 if (e.target.textContent.includes('Начать заново')) {
-                    this.displayScene(0);
+                    this.restart();
                 }
             });
         });
+        
+        // Уход со страницы или сворачивание - отправляем прогресс сразу
+        document.addEventListener('visibilitychange', () => {
+            if (document.visibilityState === 'hidden') this.flushProgress(true);
+        });
+        window.addEventListener('pagehide', () => this.flushProgress(true));
+    }
+    
+    // Кнопка офлайн-пакета: скачивает его service worker, страница только показывает прогресс
+    setupOfflinePack() {
+        const button = document.getElementById('offline-btn');
+        if (!button || !('serviceWorker' in navigator) || !navigator.serviceWorker.controller) return;
+        
+        const worker = navigator.serviceWorker;
+        button.hidden = false;
+        button.addEventListener('click', () => {
+            button.disabled = true;
+            button.textContent = 'Загрузка...';
+            worker.controller.postMessage({ type: 'DOWNLOAD_PACK', novelId: this.novelId });
+        });
+        
+        worker.addEventListener('message', event => {
+            const message = event.data || {};
+            if (message.novelId !== this.novelId) return;
+            
+            if (message.type === 'PACK_PROGRESS') {
+                button.textContent = `Загрузка... ${Math.floor(message.loaded / message.total * 100)}%`;
+            } else if (message.type === 'PACK_READY') {
+                button.disabled = true;
+                button.textContent = '✓ Доступно офлайн';
+                // Обновлять пакет при появлении сети, если браузер это умеет
+                worker.ready.then(registration => registration.sync?.register('sync-novels')).catch(() => {});
+            } else if (message.type === 'PACK_PENDING') {
+                button.disabled = false;
+                button.textContent = 'Пакет готовится, попробуйте через минуту';
+            } else if (message.type === 'PACK_ERROR') {
+                button.disabled = false;
+                button.textContent = 'Ошибка загрузки, повторить';
+            }
+        });
     }
     
     loadNovelData() {
@@ -50,7 +266,7 @@ class NovelViewer {
             const jsonText = dataElement.textContent.trim();
             if (!jsonText) {
                 console.error('No JSON data found');
-                return { scenes: [] };
+                return { scenes: {} };
             }
             
             return JSON.parse(jsonText);
@@ -60,14 +276,25 @@ class NovelViewer {
         }
     }
     
-    displayScene(index) {
-        if (index < 0 || index >= this.scenesData.length) {
+    async displayScene(index) {
+        if (index < 0 || index >= this.totalScenes) {
             this.showEndMessage();
             return;
         }
         
         this.currentSceneIndex = index;
-        const scene = this.scenesData[index];
+        let scene;
+        try {
+            scene = await this.loadScene(index);
+        } catch (error) {
+            console.error('Ошибка загрузки сцены:', error);
+        }
+        if (!scene) {
+            this.showLoadError(index);
+            return;
+        }
+        // Пока сцена грузилась, читатель мог уйти дальше
+        if (this.currentSceneIndex !== index) return;
         
         // Обновляем заголовок
         document.getElementById('current-scene').textContent = index + 1;
@@ -90,6 +317,17 @@ class NovelViewer {
                 background-size: cover;
                 background-position: center;
             `;
+            // Есть уменьшенные копии - браузер сам выберет размер по srcset
+            if (scene.backgroundSrcset) {
+                background.style.backgroundImage = 'none';
+                background.innerHTML = `
+                    <img src="${this.escapeHtml(scene.background)}"
+                         srcset="${this.escapeHtml(scene.backgroundSrcset)}"
+                         sizes="(max-width: 800px) 100vw, 800px"
+                         alt="" decoding="async"
+                         style="width: 100%; height: 100%; object-fit: cover;">
+                `;
+            }
             spritesContainer.appendChild(background);
         }
         
@@ -111,6 +349,7 @@ class NovelViewer {
                     
                     spriteElement.innerHTML = `
                         <img src="${this.escapeHtml(sprite.url)}" alt="${sprite.name || 'Спрайт'}" 
+                             ${sprite.srcset ? `srcset="${this.escapeHtml(sprite.srcset)}" sizes="${sprite.width || 150}px"` : ''}
                              class="sprite-image"
                              onerror="this.style.display='none'">
                     `;
@@ -139,6 +378,11 @@ class NovelViewer {
         // Обновляем навигацию
         this.updateNavigation(index, scene.choices);
         
+        // Заранее загружаем только сцены, достижимые из текущей
+        this.prefetchFrom(scene, index);
+        
+        this.recordProgress(index, scene);
+        
         // Прокручиваем наверх
         window.scrollTo({ top: 0, behavior: 'smooth' });
     }
@@ -163,7 +407,7 @@ class NovelViewer {
                         ${this.escapeHtml(choiceText)}
                     </button>
                 `;
-            } else if (nextScene > 0 && nextScene <= this.scenesData.length) {
+            } else if (nextScene > 0 && nextScene <= this.totalScenes) {
                 choicesHTML += `
                     <button class="choice-btn" onclick="novelViewer.goToScene(${nextScene - 1})">
                         ${this.escapeHtml(choiceText)}
@@ -182,7 +426,7 @@ class NovelViewer {
     }
     
     updateProgress(index) {
-        const progress = ((index + 1) / this.scenesData.length) * 100;
+        const progress = ((index + 1) / this.totalScenes) * 100;
         document.getElementById('progress-bar').style.width = `${progress}%`;
         document.getElementById('progress-percent').textContent = `${Math.round(progress)}%`;
     }
@@ -194,13 +438,13 @@ class NovelViewer {
         prevBtn.style.display = index > 0 ? 'block' : 'none';
         
         const hasChoices = choices && choices.length > 0;
-        const hasNextScene = index < this.scenesData.length - 1;
+        const hasNextScene = index < this.totalScenes - 1;
         
         nextBtn.style.display = (!hasChoices && hasNextScene) ? 'block' : 'none';
     }
     
     goToScene(index) {
-        if (index >= 0 && index < this.scenesData.length) {
+        if (index >= 0 && index < this.totalScenes) {
             this.displayScene(index);
         } else {
             this.showEndMessage();
@@ -208,7 +452,7 @@ class NovelViewer {
     }
     
     nextScene() {
-        if (this.currentSceneIndex < this.scenesData.length - 1) {
+        if (this.currentSceneIndex < this.totalScenes - 1) {
             this.displayScene(this.currentSceneIndex + 1);
         } else {
             this.showEndMessage();
@@ -230,7 +474,7 @@ class NovelViewer {
                 <h3>Конец истории</h3>
                 <p>${message}</p>
                 <div style="display: flex; gap: 10px; justify-content: center;">
-                    <button onclick="novelViewer.displayScene(0)" class="btn btn-primary">
+                    <button onclick="novelViewer.restart()" class="btn btn-primary">
                          Начать заново
                     </button>
                     <button onclick="window.location.href='/'" class="btn btn-secondary">
@@ -250,6 +494,19 @@ class NovelViewer {
         document.getElementById('progress-percent').textContent = '100%';
     }
     
+    showLoadError(index) {
+        document.getElementById('scene-display').innerHTML = `
+            <div class="error-message">
+                <h3>Не удалось загрузить сцену</h3>
+                <p>Проверьте соединение с интернетом.</p>
+                <button onclick="novelViewer.displayScene(${index})" class="btn btn-primary">
+                    Повторить
+                </button>
+            </div>
+        `;
+        document.getElementById('choices-display').innerHTML = '';
+    }
+    
     showNoScenesMessage() {
         document.getElementById('scene-display').innerHTML = `
             <div class="error-message">
@@ -1,31 +1,54 @@
 // static/sw.js - Service Worker для PWA
-const CACHE_NAME = 'visual-novel-pwa-v3';
-const urlsToCache = [
-    '/',
-    '/static/css/style.css',
-    '/static/js/app.js',
-    '/static/images/icon-192.png',
-    '/static/images/icon-512.png',
-    '/static/manifest.json'
-];
+const CACHE_NAME = 'visual-novel-pwa-v4';
+// Статика из списка, который сервер подставляет в начало /sw.js:
+// [{url, revision}], revision - хеш содержимого файла
+const PRECACHE_NAME = 'visual-novel-precache';
+const PRECACHE_MANIFEST = self.__PRECACHE_MANIFEST || [];
+// Страницы без хеша - обновляются при каждой установке
+const PAGES_TO_CACHE = ['/'];
+// Офлайн-пакеты новелл: у каждой новеллы свой кеш, переживает обновление SW
+const PACK_CACHE_PREFIX = 'novel-pack-';
+const PACK_DB_NAME = 'novel-packs';
+const PACK_CHUNK_SIZE = 1024 * 1024;
+
+// Ключ в кеше включает ревизию: новая версия файла не затирает старую,
+// пока старый воркер еще обслуживает открытые страницы
+function precacheKey(entry) {
+    return new URL(`${entry.url}?__rev=${entry.revision}`, self.location.origin).href;
+}
+
+const precacheKeys = new Map(PRECACHE_MANIFEST.map(entry => [entry.url, precacheKey(entry)]));
 
 // Устанавливаем Service Worker
 self.addEventListener('install', event => {
     console.log(' Service Worker: Установка');
     
     event.waitUntil(
-        caches.open(CACHE_NAME)
-            .then(cache => {
-                console.log(' Service Worker: Кеширование файлов');
-                return cache.addAll(urlsToCache);
-            })
-            .then(() => {
-                console.log(' Service Worker: Установка завершена');
-                return self.skipWaiting();
-            })
-            .catch(error => {
-                console.error(' Service Worker: Ошибка установки:', error);
-            })
+        (async () => {
+            const cache = await caches.open(PRECACHE_NAME);
+            // Скачиваем только файлы, чьей ревизии еще нет в кеше
+            const missing = [];
+            for (const entry of PRECACHE_MANIFEST) {
+                if (!await cache.match(precacheKey(entry))) {
+                    missing.push(entry);
+                }
+            }
+            console.log(` Service Worker: Кеширование файлов: ${missing.length} из ${PRECACHE_MANIFEST.length}`);
+            await Promise.all(missing.map(async entry => {
+                const response = await fetch(entry.url, { cache: 'no-cache' });
+                if (!response.ok) throw new Error(`${entry.url}: ${response.status}`);
+                await cache.put(precacheKey(entry), response);
+            }));
+            
+            const pages = await caches.open(CACHE_NAME);
+            await pages.addAll(PAGES_TO_CACHE);
+            
+            console.log(' Service Worker: Установка завершена');
+            return self.skipWaiting();
+        })().catch(error => {
+            console.error(' Service Worker: Ошибка установки:', error);
+            throw error;
+        })
     );
 });
 
@@ -37,12 +60,21 @@ self.addEventListener('activate', event => {
         caches.keys().then(cacheNames => {
             return Promise.all(
                 cacheNames.map(cacheName => {
-                    if (cacheName !== CACHE_NAME) {
+                    if (cacheName !== CACHE_NAME && cacheName !== PRECACHE_NAME &&
+                            !cacheName.startsWith(PACK_CACHE_PREFIX)) {
                         console.log('🗑️ Service Worker: Удаляем старый кеш:', cacheName);
                         return caches.delete(cacheName);
                     }
                 })
             );
+        }).then(async () => {
+            // Старые ревизии статики больше никому не нужны
+            const cache = await caches.open(PRECACHE_NAME);
+            const current = new Set(precacheKeys.values());
+            const requests = await cache.keys();
+            await Promise.all(
+                requests.filter(request => !current.has(request.url)).map(request => cache.delete(request))
+            );
         }).then(() => {
             console.log(' Service Worker: Активация завершена');
             return self.clients.claim();
@@ -58,6 +90,30 @@ self.addEventListener('fetch', event => {
         return;
     }
     
+    const url = new URL(event.request.url);
+    
+    // Сцены читалки - из сети, без сети - из скачанного пакета
+    const readMatch = url.pathname.match(/^\/api\/read\/(\d+)\/scenes$/);
+    if (readMatch) {
+        event.respondWith(
+            fetch(event.request)
+                .catch(() => offlineScenes(readMatch[1], url.searchParams.get('positions')))
+        );
+        return;
+    }
+    
+    // Изображения неизменны: сначала пакеты и кеш, потом сеть.
+    // Вместо уменьшенной копии (/assets/<id>/<вариант>) подходит и оригинал из пакета
+    const assetMatch = url.pathname.match(/^\/assets\/([0-9a-f]+)(?:\/[\w-]+)?$/);
+    if (assetMatch) {
+        event.respondWith(
+            caches.match(event.request)
+                .then(response => response || caches.match(`/assets/${assetMatch[1]}`))
+                .then(response => response || fetch(event.request))
+        );
+        return;
+    }
+    
     // Для API запросов - только сеть, не кешируем
     if (event.request.url.includes('/api/')) {
         event.respondWith(
@@ -76,7 +132,18 @@ self.addEventListener('fetch', event => {
         return;
     }
     
-    // Для статики - Cache First
+    // Предзагруженная статика - из кеша текущей ревизии
+    const precached = url.origin === self.location.origin && precacheKeys.get(url.pathname);
+    if (precached) {
+        event.respondWith(
+            caches.open(PRECACHE_NAME)
+                .then(cache => cache.match(precached))
+                .then(response => response || fetch(event.request))
+        );
+        return;
+    }
+    
+    // Для остальной статики - Cache First
     if (event.request.url.includes('/static/')) {
         event.respondWith(
             caches.match(event.request)
@@ -173,6 +240,19 @@ self.addEventListener('message', event => {
     if (event.data.type === 'SKIP_WAITING') {
         self.skipWaiting();
     }
+    
+    if (event.data.type === 'DOWNLOAD_PACK') {
+        event.waitUntil(
+            downloadPack(event.data.novelId).catch(error => {
+                console.error(' Service Worker: Ошибка загрузки пакета:', error);
+                notifyClients({ type: 'PACK_ERROR', novelId: event.data.novelId, error: error.message });
+            })
+        );
+    }
+    
+    if (event.data.type === 'REMOVE_PACK') {
+        event.waitUntil(removePack(event.data.novelId));
+    }
 });
 
 // Фоновая синхронизация
@@ -225,21 +305,232 @@ self.addEventListener('notificationclick', event => {
     );
 });
 
-// Функция для синхронизации новелл
+// Функция для синхронизации новелл: обновляет скачанные пакеты до текущих версий
 async function syncNovels() {
     try {
         console.log('🔄 Service Worker: Начинаем синхронизацию новелл');
         
-        // Здесь можно добавить логику синхронизации данных
-        // Например, отправку данных, сохраненных в IndexedDB
-        
-        return Promise.resolve();
+        const db = await openPackDb();
+        const packs = await idbRequest(db.transaction('packs').objectStore('packs').getAll());
+        for (const pack of packs) {
+            await downloadPack(pack.novelId);
+        }
     } catch (error) {
         console.error(' Service Worker: Ошибка синхронизации:', error);
         return Promise.reject(error);
     }
 }
 
+// ========== ОФЛАЙН-ПАКЕТЫ ==========
+// Пакет - ZIP без сжатия с /novel/<id>/pack: bundle.json и assets/<id>.
+// Качаем частями через Range, части лежат в IndexedDB до конца загрузки,
+// поэтому оборванная загрузка продолжается с места обрыва. Готовый пакет
+// раскладывается в Cache Storage: bundle.json и каждое изображение отдельно.
+
+function idbRequest(request) {
+    return new Promise((resolve, reject) => {
+        request.onsuccess = () => resolve(request.result);
+        request.onerror = () => reject(request.error);
+    });
+}
+
+function openPackDb() {
+    const request = indexedDB.open(PACK_DB_NAME, 1);
+    request.onupgradeneeded = () => {
+        const db = request.result;
+        // packs: {novelId, version, size, complete}; chunks: части архива по смещению
+        db.createObjectStore('packs', { keyPath: 'novelId' });
+        db.createObjectStore('chunks', { keyPath: ['novelId', 'version', 'offset'] });
+    };
+    return idbRequest(request);
+}
+
+function chunkRange(novelId, version) {
+    return IDBKeyRange.bound([novelId, version, 0], [novelId, version, Infinity]);
+}
+
+async function notifyClients(message) {
+    const clientList = await self.clients.matchAll({ type: 'window' });
+    clientList.forEach(client => client.postMessage(message));
+}
+
+async function downloadPack(novelId) {
+    novelId = Number(novelId);
+    const infoResponse = await fetch(`/novel/${novelId}/pack/info`, { cache: 'no-store' });
+    if (infoResponse.status === 202) {
+        // Сервер еще собирает бандл или пакет
+        notifyClients({ type: 'PACK_PENDING', novelId });
+        return null;
+    }
+    if (!infoResponse.ok) throw new Error('Пакет новеллы недоступен');
+    const info = await infoResponse.json();
+    
+    const db = await openPackDb();
+    const stored = await idbRequest(db.transaction('packs').objectStore('packs').get(novelId));
+    if (stored && stored.complete && stored.version === info.version) {
+        notifyClients({ type: 'PACK_READY', novelId, version: info.version });
+        return stored;
+    }
+    
+    // Части другой версии не подходят для докачки
+    let tx = db.transaction(['packs', 'chunks'], 'readwrite');
+    if (stored && stored.version !== info.version) {
+        tx.objectStore('chunks').delete(chunkRange(novelId, stored.version));
+    }
+    tx.objectStore('packs').put({ novelId, version: info.version, size: info.size, complete: false });
+    
+    const chunks = await idbRequest(tx.objectStore('chunks').getAll(chunkRange(novelId, info.version)));
+    let offset = chunks.reduce((end, chunk) => Math.max(end, chunk.offset + chunk.data.size), 0);
+    
+    while (offset < info.size) {
+        const end = Math.min(offset + PACK_CHUNK_SIZE, info.size) - 1;
+        const response = await fetch(info.url, { headers: { Range: `bytes=${offset}-${end}` }, cache: 'no-store' });
+        if (response.status === 409 || response.status === 202) {
+            // Новелла обновилась во время загрузки - начинаем с новой версией
+            // (202 - ее пакет еще собирается)
+            return downloadPack(novelId);
+        }
+        if (response.status !== 206 && response.status !== 200) {
+            throw new Error(`Ошибка загрузки пакета: ${response.status}`);
+        }
+        const data = await response.blob();
+        // 200 - сервер отдал архив целиком, части больше не нужны
+        const chunkOffset = response.status === 200 ? 0 : offset;
+        tx = db.transaction('chunks', 'readwrite');
+        if (response.status === 200) {
+            tx.objectStore('chunks').delete(chunkRange(novelId, info.version));
+        }
+        await idbRequest(tx.objectStore('chunks').put({ novelId, version: info.version, offset: chunkOffset, data }));
+        offset = chunkOffset + data.size;
+        notifyClients({ type: 'PACK_PROGRESS', novelId, loaded: offset, total: info.size });
+    }
+    
+    const parts = await idbRequest(
+        db.transaction('chunks').objectStore('chunks').getAll(chunkRange(novelId, info.version))
+    );
+    const archive = new Blob(parts.sort((a, b) => a.offset - b.offset).map(part => part.data));
+    await unpackToCache(novelId, archive);
+    
+    tx = db.transaction(['packs', 'chunks'], 'readwrite');
+    tx.objectStore('chunks').delete(chunkRange(novelId, info.version));
+    const pack = { novelId, version: info.version, size: info.size, complete: true, savedAt: Date.now() };
+    await idbRequest(tx.objectStore('packs').put(pack));
+    
+    notifyClients({ type: 'PACK_READY', novelId, version: info.version });
+    console.log(' Service Worker: Новелла сохранена для офлайн-чтения:', novelId);
+    return pack;
+}
+
+// Записи ZIP без сжатия: {name, data} со срезами исходного Blob
+async function readZipEntries(archive) {
+    // Архив без комментария: конец центрального каталога - последние 22 байта
+    const tail = new DataView(await archive.slice(archive.size - 22).arrayBuffer());
+    if (tail.getUint32(0, true) !== 0x06054b50) throw new Error('Поврежденный пакет');
+    const count = tail.getUint16(10, true);
+    const directorySize = tail.getUint32(12, true);
+    const directoryOffset = tail.getUint32(16, true);
+    const directory = new DataView(
+        await archive.slice(directoryOffset, directoryOffset + directorySize).arrayBuffer()
+    );
+    
+    const decoder = new TextDecoder();
+    const entries = [];
+    let p = 0;
+    for (let i = 0; i < count; i++) {
+        const size = directory.getUint32(p + 20, true);
+        const nameLength = directory.getUint16(p + 28, true);
+        const extraLength = directory.getUint16(p + 30, true);
+        const commentLength = directory.getUint16(p + 32, true);
+        const headerOffset = directory.getUint32(p + 42, true);
+        const name = decoder.decode(new Uint8Array(directory.buffer, p + 46, nameLength));
+        
+        // Длина доп. поля в локальном заголовке может отличаться от каталога
+        const header = new DataView(await archive.slice(headerOffset, headerOffset + 30).arrayBuffer());
+        const dataOffset = headerOffset + 30 + header.getUint16(26, true) + header.getUint16(28, true);
+        entries.push({ name, data: archive.slice(dataOffset, dataOffset + size) });
+        p += 46 + nameLength + extraLength + commentLength;
+    }
+    return entries;
+}
+
+async function unpackToCache(novelId, archive) {
+    const entries = await readZipEntries(archive);
+    const bundleEntry = entries.find(entry => entry.name === 'bundle.json');
+    if (!bundleEntry) throw new Error('В пакете нет данных новеллы');
+    const bundle = JSON.parse(await bundleEntry.data.text());
+    const mimeTypes = new Map(bundle.assets.map(asset => [asset.id, asset.mime_type]));
+    
+    // Новую версию собираем начисто, старые изображения не копим
+    const cacheName = PACK_CACHE_PREFIX + novelId;
+    await caches.delete(cacheName);
+    const cache = await caches.open(cacheName);
+    await cache.put(`/offline/novel/${novelId}/bundle.json`, new Response(bundleEntry.data, {
+        headers: { 'Content-Type': 'application/json' }
+    }));
+    for (const entry of entries) {
+        if (!entry.name.startsWith('assets/')) continue;
+        const assetId = entry.name.slice('assets/'.length);
+        await cache.put(`/assets/${assetId}`, new Response(entry.data, {
+            headers: { 'Content-Type': mimeTypes.get(assetId) || 'application/octet-stream' }
+        }));
+    }
+    
+    // Страница читалки со своими скриптами и стилями: сцены она берет
+    // через /api/read, а их отдадим из пакета
+    try {
+        const page = await fetch(`/view/${novelId}`, { credentials: 'same-origin' });
+        if (page.ok && !page.redirected) {
+            const html = await page.text();
+            await cache.put(`/view/${novelId}`, new Response(html, {
+                headers: { 'Content-Type': 'text/html; charset=utf-8' }
+            }));
+            const staticUrls = [...html.matchAll(/(?:src|href)="(\/static\/[^"]+)"/g)]
+                .map(match => match[1])
+                .filter(staticUrl => !precacheKeys.has(staticUrl));
+            const staticCache = await caches.open(CACHE_NAME);
+            await staticCache.addAll([...new Set(staticUrls)]);
+        }
+    } catch (error) {
+        console.warn(' Service Worker: Страница читалки не сохранена:', error);
+    }
+}
+
+// Ответ /api/read/<id>/scenes из скачанного пакета
+async function offlineScenes(novelId, positionsParam) {
+    const cached = await caches.match(`/offline/novel/${novelId}/bundle.json`);
+    if (!cached) {
+        return new Response(
+            JSON.stringify({ error: 'Новелла не сохранена для офлайн-чтения' }),
+            { status: 503, headers: { 'Content-Type': 'application/json' } }
+        );
+    }
+    
+    const bundle = await cached.json();
+    const scenes = {};
+    (positionsParam || '').split(',').forEach(value => {
+        const position = parseInt(value, 10);
+        if (position >= 0 && position < bundle.scenes.length) {
+            scenes[position] = bundle.scenes[position];
+        }
+    });
+    return new Response(JSON.stringify({ total: bundle.total, scenes }), {
+        headers: { 'Content-Type': 'application/json' }
+    });
+}
+
+async function removePack(novelId) {
+    novelId = Number(novelId);
+    const db = await openPackDb();
+    const stored = await idbRequest(db.transaction('packs').objectStore('packs').get(novelId));
+    const tx = db.transaction(['packs', 'chunks'], 'readwrite');
+    if (stored) {
+        tx.objectStore('chunks').delete(chunkRange(novelId, stored.version));
+    }
+    await idbRequest(tx.objectStore('packs').delete(novelId));
+    await caches.delete(PACK_CACHE_PREFIX + novelId);
+    notifyClients({ type: 'PACK_REMOVED', novelId });
+}
+
 // Обработка ошибок Service Worker
 self.addEventListener('error', event => {
     console.error(' Service Worker: Ошибка:', event.error);
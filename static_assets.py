@@ -0,0 +1,102 @@
+# static_assets.py - раздача собранной статики (build_static.py)
+import hashlib
+import json
+import mimetypes
+import os
+
+from flask import request, send_from_directory
+
+# Сжатые копии в порядке предпочтения
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+IMMUTABLE = 'public, max-age=31536000, immutable'
+SERVICE_WORKER = 'sw.js'
+
+
+class StaticManifest:
+    """Соответствие static/<путь> -> static/dist/<путь с хешем>.
+
+    Без собранного манифеста все ссылки остаются обычными - удобно при
+    разработке, когда файлы правятся без пересборки.
+    """
+
+    def __init__(self, static_folder, manifest_path, static_url_path='/static'):
+        self.static_folder = static_folder
+        self.static_url_path = static_url_path
+        self.dist_folder = os.path.join(static_folder, 'dist')
+        self.files = {}
+        self.hashed = set()
+        self._precache = None
+        self._precache_signature = None
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding='utf-8') as f:
+                self.files = json.load(f)
+            self.hashed = set(self.files.values())
+
+    def url_defaults(self, endpoint, values):
+        """Подменяет filename в url_for('static', ...) на имя с хешем"""
+        if endpoint == 'static' and values.get('filename') in self.files:
+            values['filename'] = self.files[values['filename']]
+
+    def serve(self, filename):
+        """Замена стандартного обработчика static"""
+        if filename not in self.hashed:
+            return send_from_directory(self.static_folder, filename)
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        for encoding, suffix in ENCODINGS:
+            if encoding in request.accept_encodings and \
+                    os.path.exists(os.path.join(self.static_folder, filename + suffix)):
+                response = send_from_directory(self.static_folder, filename + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(self.static_folder, filename)
+
+        # Имя меняется вместе с содержимым - браузер может не перепроверять файл
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def source_files(self):
+        """Файлы static/ (без dist/ и самого service worker) и пути, откуда их отдают"""
+        files = []
+        for root, dirs, names in os.walk(self.static_folder):
+            dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != self.dist_folder)
+            for name in sorted(names):
+                relative_path = os.path.relpath(os.path.join(root, name), self.static_folder).replace(os.sep, '/')
+                if relative_path != SERVICE_WORKER:
+                    files.append((relative_path, self.files.get(relative_path, relative_path)))
+        return files
+
+    def precache_entries(self):
+        """Список {url, revision} для предзагрузки в service worker.
+
+        revision - хеш содержимого: при обновлении воркер скачивает только
+        изменившиеся файлы. Список пересчитывается, если файлы поменялись.
+        """
+        files = self.source_files()
+        stats = [os.stat(os.path.join(self.static_folder, served)) for _, served in files]
+        signature = [(served, stat.st_mtime_ns, stat.st_size) for (_, served), stat in zip(files, stats)]
+        if signature != self._precache_signature:
+            entries = []
+            for _, served in files:
+                with open(os.path.join(self.static_folder, served), 'rb') as f:
+                    revision = hashlib.sha256(f.read()).hexdigest()[:10]
+                entries.append({'url': f'{self.static_url_path}/{served}', 'revision': revision})
+            self._precache, self._precache_signature = entries, signature
+        return self._precache
+
+    def service_worker_source(self):
+        """sw.js с подставленным списком предзагрузки"""
+        with open(os.path.join(self.static_folder, SERVICE_WORKER), 'rb') as f:
+            source = f.read()
+        manifest = json.dumps(self.precache_entries(), separators=(',', ':'))
+        return f'self.__PRECACHE_MANIFEST = {manifest};\n'.encode('utf-8') + source
+
+
+def init_static_assets(app):
+    manifest = StaticManifest(app.static_folder, app.config['STATIC_MANIFEST'], app.static_url_path)
+    app.url_defaults(manifest.url_defaults)
+    app.view_functions['static'] = manifest.serve
+    app.extensions['static_manifest'] = manifest
+    return manifest
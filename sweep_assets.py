@@ -0,0 +1,27 @@
+# sweep_assets.py - удаляет из хранилища файлы без записи в таблице asset
+#
+#   python sweep_assets.py        # файлы старше 24 часов
+#   python sweep_assets.py 6      # старше 6 часов
+#
+# Такие файлы остаются, когда изображение сохранено, а транзакция запроса
+# откатилась. Свежие файлы не трогаем: их запись может быть еще не закоммичена.
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from app import app
+from assets import sweep_unregistered_files
+
+# Рабочие процессы пайплайна изображений (forkserver) импортируют этот модуль заново
+if __name__ == '__main__':
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 24
+    print(f"🔄 Поиск файлов без записи в базе (старше {hours:g} ч)...")
+
+    with app.app_context():
+        removed = sweep_unregistered_files(hours * 60 * 60)
+        for asset_id in removed:
+            print(f"🗑️ {asset_id[:12]}: удален")
+
+    print(f"\n📊 Результаты:")
+    print(f"   Удалено файлов: {len(removed)}")
+    print("\n🎯 Готово!")